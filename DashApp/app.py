@@ -1,238 +1,461 @@
-from dash import Dash, html, dcc
-import pandas as pd
-import os
-import plotly.express as px
-import dash_bootstrap_components as dbc
-from dash_bootstrap_templates import load_figure_template
-
-
-def quarter_to_time(quarter):
-    start_minute = (quarter - 1) * 15
-    end_minute = start_minute + 15
-    start_time = f"{start_minute // 60:02d}:{start_minute % 60:02d}"
-    end_time = f"{end_minute // 60:02d}:{end_minute % 60:02d}"
-    return f"{start_time} - {end_time}"
-
-
-def info_exporter(df):
-    location_id = df.at[0, 'location_id'].split('_')[0]
-    date = df.at[0, 'Date']
-
-    # time = '6:00 A.M. - 6:00 P.M.'
-    # time_14_15 = '6:00 A.M. - 1:00 P.M.'
-    # time_20 = '6:00 A.M. - 11:45 A.M.'
-    # if int(df.at[0, 'location_id'].split('-')[-1]) == 14 or 15:
-    #     time = time_14_15
-    # elif int(df.at[0, 'location_id'].split('-')[-1]) == 20:
-    #     time = time_20
-
-    row = dbc.Row([
-        html.H2(f'Location : {location_id}', className="text-primary text-center fs-3"),
-        html.H2(f'Date : {date}', className="text-primary text-center fs-3"),  # Time: {time}
-    ])
-    return row
-
-
-def card_exporter(df):
-    df['minute'] = df['Hour'] * 60 + (df['Quarter'] - 1) * 15
-
-    # Summary Cards data
-    vehicle_counts = df.groupby('vehicle_id')['count'].sum().reset_index()
-    total_vehicles = vehicle_counts['count'].sum()  # Total count of all vehicles
-    vehicle_counts['vehicle_id'] = vehicle_counts['vehicle_id'].replace('motorcycle', 'Bike')
-    # Individual vehicle type cards
-    vehicle_cards = [
-        dbc.Col(
-            dbc.Card(
-                dbc.CardBody(
-                    [
-                        html.H2(f'{x["vehicle_id"].capitalize()}', className="text-center text-success"),
-                        html.H2(f'{x["count"]}', className="text-center text-success")
-                    ]
-                ),
-                className="mb-4",
-            ),
-            width=2  # Adjust the width as needed
-        )
-        for x in vehicle_counts[["vehicle_id", "count"]].to_dict("records")
-    ]
-
-    # Total vehicles card
-    total_card = dbc.Col(
-        dbc.Card(
-            dbc.CardBody(
-                [
-                    html.H2('Total', className="text-center text-primary"),
-                    html.H2(f'{total_vehicles}', className="text-center text-primary")
-                ]
-            ),
-            className="mb-4",
-        ),
-        width=2  # Adjust the width as needed
-    )
-
-    # Combine individual cards and total card into a row
-    row = dbc.Row(
-        vehicle_cards + [total_card],
-        justify='center',
-    )
-
-    return row
-
-
-def bar_exporter(df):
-
-    df_copy = df.copy()
-
-    df_copy['Continuous_Quarter'] = df_copy['Hour'] * 4 + df_copy['Quarter']
-
-    grouped_df_total = df_copy.groupby('Continuous_Quarter')['count'].sum().reset_index()
-    grouped_df_total['Continuous_Quarter'] = grouped_df_total['Continuous_Quarter'].apply(quarter_to_time)
-    # Create the bar plot
-    fig_total = px.bar(grouped_df_total, x='Continuous_Quarter', y='count',
-                       title='Vehicle Distribution in Every 15-mins',
-                       labels={'count': 'Total Count of Vehicles'},
-                       text='count')
-    fig_total.update_traces(textposition='outside', textfont_size=12, cliponaxis=False,
-                            outsidetextfont_size=35)
-
-    # Customize the x-axis to show each value instead of the column name
-    fig_total.update_layout(
-        xaxis_title=None,
-        xaxis=dict(
-            tickmode='array',
-            tickvals=grouped_df_total['Continuous_Quarter'],
-            ticktext=grouped_df_total['Continuous_Quarter'].astype(str),
-            tickangle=90,
-            tickfont=dict(size=15, weight='bold'),
-        )
-    )
-    cont = dbc.Container(
-        [
-            dbc.Row(dcc.Markdown(" ## Vehicle Counts in 15-mins")),
-            dbc.Row(
-                dcc.Graph(figure=fig_total)
-            ),
-            dbc.Row(
-                dbc.Col(
-                    html.Div(style={"height": "30px"}),
-                )
-            )
-        ]
-    )
-    return cont
-
-
-def line_exporter(df):
-    # Create a copy of the dataframe
-
-    df_copy = df.copy()
-
-    df_copy['Continuous Quarter'] = df_copy['Hour'] * 4 + df_copy['Quarter']
-
-    grouped_df_total = df_copy.groupby(['Continuous Quarter', 'vehicle_id'])['count'].sum().reset_index()
-    grouped_df_total['Continuous Quarter'] = grouped_df_total['Continuous Quarter'].apply(quarter_to_time)
-    # Create the bar plot
-    fig_total = px.line(grouped_df_total, x='Continuous Quarter', y='count',
-                        title='Total Count of Vehicles in Every Quarter',
-                        labels={'count': 'Total Count of Vehicles'},
-                        text='count',
-                        color='vehicle_id')
-    fig_total.update_traces(text=None)
-
-    cont = dbc.Container(
-        [
-            dbc.Row(dcc.Markdown("## Vehicle-wise Trends in 15-min")),
-            dbc.Row(dcc.Graph(figure=fig_total)),
-        ]
-    )
-    return cont
-
-
-def pie_exporter(df):
-    # Pie Chart Data
-    records_per_set = len(df) // 4
-
-    # Create the 4 sets sequentially
-    set1 = df.iloc[:records_per_set]
-    set2 = df.iloc[records_per_set:2 * records_per_set]
-    set3 = df.iloc[2 * records_per_set:3 * records_per_set]
-    set4 = df.iloc[3 * records_per_set:]
-    cont = dbc.Container(
-        [
-            dbc.Row(dcc.Markdown(" ## Vehicle Distribution by 6-Hours")),
-            dbc.Row(
-                [
-                    dbc.Col(dcc.Graph(figure=px.pie(set1, values='count', names='vehicle_id',
-                                                    title='12:00 A.M. - 6:00 A.M.').update_layout(font_size=20,))),
-                    dbc.Col(dcc.Graph(figure=px.pie(set2, values='count', names='vehicle_id',
-                                                    title='6:00 A.M. - 12:00 P.M.').update_layout(font_size=20,))),
-                ]
-            ),
-            dbc.Row(
-                [
-                    dbc.Col(dcc.Graph(figure=px.pie(set3, values='count', names='vehicle_id',
-                                                    title='12:00 P.M. - 6:00 P.M.').update_layout(font_size=20,))),
-                    dbc.Col(dcc.Graph(figure=px.pie(set4, values='count', names='vehicle_id',
-                                                    title='6:00 P.M. - 12:00 A.M.').update_layout(font_size=20,)))
-                ]
-            )
-        ]
-    )
-    return cont
-
-
-def process_subset(sub):
-
-    info_row = info_exporter(sub)
-    card_row = card_exporter(sub)
-    hist_cont = bar_exporter(sub)
-    line_cont = line_exporter(sub)
-    # pie_cont = pie_exporter(sub)
-
-    location_info = [info_row, card_row, hist_cont, line_cont]  #, pie_cont
-    # whitespace = dbc.Row(
-    #     dbc.Col(
-    #         html.Div(style={"height": "240px"}),
-    #     )
-    # )
-    # whitespace2 = dbc.Row(
-    #     dbc.Col(
-    #         html.Div(style={"height": "20px"}),
-    #     )
-    # )
-    # location_info.append(whitespace)
-    # location_info.insert(4, whitespace2)
-    return location_info
-
-
-load_figure_template("lux")
-external_stylesheets = [dbc.themes.LUX]
-app = Dash(__name__, external_stylesheets=external_stylesheets)
-
-data = pd.read_excel('PTZ-01-AIRPORT.xlsx')
-# Save subsets in the subsets folder
-location_groups = data.groupby('location_id')
-if not os.path.exists('Subsets'):
-    os.mkdir('Subsets')
-if len(os.listdir('Subsets')) == 0:
-    idx = 0
-    for location, subset in location_groups:
-        idx += 1
-        subset.to_csv(f'Subsets/{location}_subset{idx}.csv', index=False)
-
-list_info = []
-subsets = ['Subsets/' + x for x in os.listdir('Subsets')]
-datas = [pd.read_csv(x) for x in subsets]
-for subs in datas:
-    loc = process_subset(subs)
-    list_info.append(loc)
-
-flattened_list = [item for sublist in list_info for item in sublist]
-app.layout = dbc.Container(
-    flattened_list,
-)
-
-
-if __name__ == '__main__':
-    app.run(debug=True)
+from dash import Dash, html, dcc, Input, Output, State, Patch
+from dash.exceptions import PreventUpdate
+import pandas as pd
+import plotly.express as px
+import dash_bootstrap_components as dbc
+from datetime import date
+from dash_bootstrap_templates import load_figure_template
+from queries import open_repository, GRANULARITIES
+from live_counts import LiveCounts, DASH_AMQP_URL, DASH_LIVE_INTERVAL
+
+PERIOD_NAMES = {'quarter': '15-mins', 'hour': 'Hour', 'day': 'Day'}
+_repository = None
+_live = None
+
+
+def get_repository():
+    # connects on first use instead of at import time
+    global _repository
+    if _repository is None:
+        _repository = open_repository()
+    return _repository
+
+
+def get_live():
+    # subscribes on first use, None when DASH_AMQP_URL is not set
+    global _live
+    if _live is None and DASH_AMQP_URL:
+        _live = LiveCounts()
+        _live.start()
+    return _live
+
+
+def quarter_to_time(quarter):
+    start_minute = (quarter - 1) * 15
+    end_minute = start_minute + 15
+    start_time = f"{start_minute // 60:02d}:{start_minute % 60:02d}"
+    end_time = f"{end_minute // 60:02d}:{end_minute % 60:02d}"
+    return f"{start_time} - {end_time}"
+
+
+def period_label(day, hour, quarter, granularity, multi_day):
+    """Label of the time bucket a quarter falls in, labels sort in time order."""
+    if granularity == 'quarter':
+        label = quarter_to_time(int(hour) * 4 + int(quarter))
+    elif granularity == 'hour':
+        label = f"{int(hour):02d}:00 - {int(hour) + 1:02d}:00"
+    else:
+        return str(day)
+    return f'{day} {label}' if multi_day else label
+
+
+def add_period(df, granularity, multi_day):
+    """Label each row with its time bucket."""
+    df['Period'] = [period_label(day, hour, quarter, granularity, multi_day)
+                    for day, hour, quarter in zip(df['Date'], df['Hour'], df['Quarter'])]
+    return df
+
+
+def info_exporter(location_id, start, end):
+    date = start if start == end else f'{start} to {end}'
+
+    # time = '6:00 A.M. - 6:00 P.M.'
+    # time_14_15 = '6:00 A.M. - 1:00 P.M.'
+    # time_20 = '6:00 A.M. - 11:45 A.M.'
+    # if int(df.at[0, 'location_id'].split('-')[-1]) == 14 or 15:
+    #     time = time_14_15
+    # elif int(df.at[0, 'location_id'].split('-')[-1]) == 20:
+    #     time = time_20
+
+    row = dbc.Row([
+        html.H2(f'Location : {location_id}', className="text-primary text-center fs-3"),
+        html.H2(f'Date : {date}', className="text-primary text-center fs-3"),  # Time: {time}
+    ])
+    return row
+
+
+def card_exporter(df):
+    # Summary Cards data
+    vehicle_counts = df.groupby('vehicle_id', observed=True)['count'].sum().reset_index()
+    total_vehicles = vehicle_counts['count'].sum()  # Total count of all vehicles
+    vehicle_counts['vehicle_id'] = vehicle_counts['vehicle_id'].astype(str).replace('motorcycle', 'Bike')
+    # Individual vehicle type cards
+    vehicle_cards = [
+        dbc.Col(
+            dbc.Card(
+                dbc.CardBody(
+                    [
+                        html.H2(f'{x["vehicle_id"].capitalize()}', className="text-center text-success"),
+                        html.H2(f'{x["count"]}', className="text-center text-success")
+                    ]
+                ),
+                className="mb-4",
+            ),
+            width=2  # Adjust the width as needed
+        )
+        for x in vehicle_counts[["vehicle_id", "count"]].to_dict("records")
+    ]
+
+    # Total vehicles card
+    total_card = dbc.Col(
+        dbc.Card(
+            dbc.CardBody(
+                [
+                    html.H2('Total', className="text-center text-primary"),
+                    html.H2(f'{total_vehicles}', className="text-center text-primary")
+                ]
+            ),
+            className="mb-4",
+        ),
+        width=2  # Adjust the width as needed
+    )
+
+    # Combine individual cards and total card into a row
+    row = dbc.Row(
+        vehicle_cards + [total_card],
+        justify='center',
+    )
+
+    return row
+
+
+def bar_figure(df, granularity):
+
+    grouped_df_total = df.groupby('Period')['count'].sum().reset_index()
+    # Create the bar plot
+    fig_total = px.bar(grouped_df_total, x='Period', y='count',
+                       title=f'Vehicle Distribution per {PERIOD_NAMES[granularity]}',
+                       labels={'count': 'Total Count of Vehicles'},
+                       text='count')
+    fig_total.update_traces(textposition='outside', textfont_size=12, cliponaxis=False,
+                            outsidetextfont_size=35)
+
+    # Customize the x-axis to show each value instead of the column name
+    fig_total.update_layout(
+        xaxis_title=None,
+        xaxis=dict(
+            tickmode='array',
+            tickvals=grouped_df_total['Period'],
+            ticktext=grouped_df_total['Period'].astype(str),
+            tickangle=90,
+            tickfont=dict(size=15, weight='bold'),
+        )
+    )
+    return fig_total
+
+
+def bar_exporter(fig_total, granularity):
+    cont = dbc.Container(
+        [
+            dbc.Row(dcc.Markdown(f" ## Vehicle Counts per {PERIOD_NAMES[granularity]}")),
+            dbc.Row(
+                dcc.Graph(id='bar-graph', figure=fig_total)
+            ),
+            dbc.Row(
+                dbc.Col(
+                    html.Div(style={"height": "30px"}),
+                )
+            )
+        ]
+    )
+    return cont
+
+
+def line_figure(df, granularity):
+
+    grouped_df_total = df.groupby(['Period', 'vehicle_id'], observed=True)['count'].sum().reset_index()
+    # Create the line plot
+    fig_total = px.line(grouped_df_total, x='Period', y='count',
+                        title=f'Total Count of Vehicles per {PERIOD_NAMES[granularity]}',
+                        labels={'count': 'Total Count of Vehicles'},
+                        text='count',
+                        color='vehicle_id')
+    fig_total.update_traces(text=None)
+    return fig_total
+
+
+def line_exporter(fig_total, granularity):
+    cont = dbc.Container(
+        [
+            dbc.Row(dcc.Markdown(f"## Vehicle-wise Trends per {PERIOD_NAMES[granularity]}")),
+            dbc.Row(dcc.Graph(id='line-graph', figure=fig_total)),
+        ]
+    )
+    return cont
+
+
+def pie_exporter(df):
+    # Pie Chart Data
+    records_per_set = len(df) // 4
+
+    # Create the 4 sets sequentially
+    set1 = df.iloc[:records_per_set]
+    set2 = df.iloc[records_per_set:2 * records_per_set]
+    set3 = df.iloc[2 * records_per_set:3 * records_per_set]
+    set4 = df.iloc[3 * records_per_set:]
+    cont = dbc.Container(
+        [
+            dbc.Row(dcc.Markdown(" ## Vehicle Distribution by 6-Hours")),
+            dbc.Row(
+                [
+                    dbc.Col(dcc.Graph(figure=px.pie(set1, values='count', names='vehicle_id',
+                                                    title='12:00 A.M. - 6:00 A.M.').update_layout(font_size=20,))),
+                    dbc.Col(dcc.Graph(figure=px.pie(set2, values='count', names='vehicle_id',
+                                                    title='6:00 A.M. - 12:00 P.M.').update_layout(font_size=20,))),
+                ]
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(dcc.Graph(figure=px.pie(set3, values='count', names='vehicle_id',
+                                                    title='12:00 P.M. - 6:00 P.M.').update_layout(font_size=20,))),
+                    dbc.Col(dcc.Graph(figure=px.pie(set4, values='count', names='vehicle_id',
+                                                    title='6:00 P.M. - 12:00 A.M.').update_layout(font_size=20,)))
+                ]
+            )
+        ]
+    )
+    return cont
+
+
+def load_counts(location_id, start, end, granularity, live):
+    """
+    Counts of the period labelled with their time bucket, and today's quarter counts when the view is live.
+    Today's rows of a live view are aggregated from those quarters, so live updates apply to the same numbers.
+    """
+    repository = get_repository()
+    df = repository.counts(location_id, start, end, granularity)
+    quarters = None
+    if live:
+        today = date.today()
+        quarters = repository.counts(location_id, today, today, 'quarter')
+        today_rows = quarters
+        if granularity != 'quarter':
+            keys = ['Date', 'Hour', 'vehicle_id'] if granularity == 'hour' else ['Date', 'vehicle_id']
+            today_rows = quarters.groupby(keys, observed=True)['count'].sum().reset_index()
+        df = pd.concat([df[df['Date'] != today], today_rows], ignore_index=True)
+        df['vehicle_id'] = df['vehicle_id'].astype('category')
+    return add_period(df, granularity, multi_day=start != end), quarters
+
+
+def live_state(location_id, start, end, granularity, seq, df, quarters, bar_fig, line_fig):
+    """
+    What the live callback needs to patch the figures in place: where today's periods sit in the bar and
+    line traces with their values, today's quarter counts the updates are compared against, and the totals
+    of the cards. Earlier periods never change, so they are left out.
+    """
+    today = date.today()
+    today_labels = set(df.loc[df['Date'] == today, 'Period'])
+    bar = bar_fig.data[0]
+    return {
+        'location_id': location_id,
+        'start': str(start),
+        'end': str(end),
+        'granularity': granularity,
+        'today': str(today),
+        'seq': seq,
+        'bar': {label: [i, int(y)] for i, (label, y) in enumerate(zip(bar.x, bar.y)) if label in today_labels},
+        'bar_length': len(bar.x),
+        'line': {
+            trace.name: {
+                'index': i,
+                'length': len(trace.x),
+                'points': {label: [j, int(y)] for j, (label, y) in enumerate(zip(trace.x, trace.y))
+                           if label in today_labels},
+            }
+            for i, trace in enumerate(line_fig.data)
+        },
+        'quarters': {f'{hour}-{quarter}': counts.set_index('vehicle_id')['count'].astype(int).to_dict()
+                     for (hour, quarter), counts in quarters.groupby(['Hour', 'Quarter'])},
+        'totals': df.groupby('vehicle_id', observed=True)['count'].sum().astype(int).to_dict(),
+    }
+
+
+def process_location(location_id, start, end, granularity):
+    """Children of the location view and the state of its live updates, None when it does not include today."""
+    live = get_live()
+    is_live = live is not None and start <= date.today() <= end
+    seq = live.seq if is_live else None  # taken first, updates that race the queries are applied again
+    df, quarters = load_counts(location_id, start, end, granularity, is_live)
+    info_row = info_exporter(location_id, start, end)
+    if df.empty:
+        children = [info_row, dbc.Row(html.H4('No counts for this period', className="text-center text-muted"))]
+        if not is_live:
+            return children, None
+        # rendered again once counts for the location come in
+        return children + [dcc.Interval(id='empty-tick', interval=DASH_LIVE_INTERVAL * 1000)], {
+            'location_id': location_id, 'start': str(start), 'end': str(end), 'granularity': granularity,
+            'seq': seq,
+        }
+
+    bar_fig = bar_figure(df, granularity)
+    line_fig = line_figure(df, granularity)
+    card_row = card_exporter(df)
+    hist_cont = bar_exporter(bar_fig, granularity)
+    line_cont = line_exporter(line_fig, granularity)
+    # pie_cont = pie_exporter(df)
+
+    children = [info_row, html.Div(card_row, id='cards'), hist_cont, line_cont]  #, pie_cont
+    if not is_live:
+        return children, None
+    state = live_state(location_id, start, end, granularity, seq, df, quarters, bar_fig, line_fig)
+    return children + [dcc.Interval(id='live-tick', interval=DASH_LIVE_INTERVAL * 1000)], state
+
+
+load_figure_template("lux")
+external_stylesheets = [dbc.themes.LUX]
+# the live callbacks target components that only exist once a location is shown
+app = Dash(__name__, external_stylesheets=external_stylesheets, suppress_callback_exceptions=True)
+
+
+def serve_layout():
+    # built per page load, so the location list is current and nothing is queried at import time
+    today = date.today()
+    return dbc.Container(
+        [
+            dbc.Row(
+                [
+                    dbc.Col(dcc.Dropdown(id='location', options=get_repository().locations(),
+                                         placeholder='Location'), width=4),
+                    dbc.Col(dcc.DatePickerRange(id='dates', start_date=today, end_date=today,
+                                                max_date_allowed=today), width=4),
+                    dbc.Col(dcc.RadioItems(id='granularity', value='quarter', inline=True,
+                                           options=[{'label': f' {PERIOD_NAMES[g]} ', 'value': g}
+                                                    for g in GRANULARITIES]), width=4),
+                ],
+                className="my-4",
+            ),
+            dcc.Loading(html.Div(id='location-view')),
+            dcc.Store(id='view-state'),
+        ]
+    )
+
+
+app.layout = serve_layout
+
+
+@app.callback(
+    Output('location-view', 'children'),
+    Output('view-state', 'data'),
+    Input('location', 'value'),
+    Input('dates', 'start_date'),
+    Input('dates', 'end_date'),
+    Input('granularity', 'value'),
+)
+def update_location_view(location_id, start_date, end_date, granularity):
+    if not location_id or not start_date or not end_date:
+        return dbc.Row(html.H4('Select a location', className="text-center text-muted")), None
+    start, end = date.fromisoformat(start_date[:10]), date.fromisoformat(end_date[:10])
+    return process_location(location_id, start, end, granularity)
+
+
+def rebuild_view(state):
+    # figures from scratch, when the updates cannot be applied in place
+    start, end = date.fromisoformat(state['start']), date.fromisoformat(state['end'])
+    seq = get_live().seq
+    df, quarters = load_counts(state['location_id'], start, end, state['granularity'], True)
+    if df.empty:
+        raise PreventUpdate
+    bar_fig = bar_figure(df, state['granularity'])
+    line_fig = line_figure(df, state['granularity'])
+    state = live_state(state['location_id'], start, end, state['granularity'], seq, df, quarters, bar_fig, line_fig)
+    return bar_fig, line_fig, card_exporter(df), state
+
+
+@app.callback(
+    Output('bar-graph', 'figure', allow_duplicate=True),
+    Output('line-graph', 'figure', allow_duplicate=True),
+    Output('cards', 'children', allow_duplicate=True),
+    Output('view-state', 'data', allow_duplicate=True),
+    Input('live-tick', 'n_intervals'),
+    State('view-state', 'data'),
+    prevent_initial_call=True,
+)
+def patch_live_view(_n_intervals, state):
+    """
+    Apply the count updates that came in since the last tick to the figures as patches, so only the changed
+    points travel to the browser. Updates carry a quarter's totals so far; the difference to the quarter's
+    last known counts is added to the period the quarter falls in.
+    """
+    if not state or 'bar' not in state:
+        raise PreventUpdate
+    if state['today'] != str(date.today()):
+        return rebuild_view(state)
+    updates, seq = get_live().since(state['seq'], state['location_id'])
+    if updates is None:
+        return rebuild_view(state)
+    state['seq'] = seq
+    bar_patch, line_patch = Patch(), Patch()
+    changed = False
+    for update in updates:
+        if update['date'] != state['today']:
+            continue
+        key = f"{update['hour']}-{update['quarter']}"
+        previous = state['quarters'].get(key, {})
+        deltas = {name: count - previous.get(name, 0) for name, count in update['counts'].items()
+                  if count != previous.get(name, 0)}
+        state['quarters'][key] = update['counts']
+        if not deltas:
+            continue
+        changed = True
+        label = period_label(update['date'], update['hour'], update['quarter'], state['granularity'],
+                             state['start'] != state['end'])
+
+        pos, value = state['bar'].get(label, [None, 0])
+        value += sum(deltas.values())
+        if pos is None:
+            pos = state['bar_length']
+            state['bar_length'] += 1
+            for prop in ('x', 'y', 'text'):
+                bar_patch['data'][0][prop].append(label if prop == 'x' else value)
+            bar_patch['layout']['xaxis']['tickvals'].append(label)
+            bar_patch['layout']['xaxis']['ticktext'].append(label)
+        else:
+            bar_patch['data'][0]['y'][pos] = value
+            bar_patch['data'][0]['text'][pos] = value
+        state['bar'][label] = [pos, value]
+
+        for name, delta in deltas.items():
+            trace = state['line'].get(name)
+            if trace is None:  # first count of a class in the period, needs a trace of its own
+                return rebuild_view(state)
+            pos, value = trace['points'].get(label, [None, 0])
+            value += delta
+            if pos is None:
+                pos = trace['length']
+                trace['length'] += 1
+                line_patch['data'][trace['index']]['x'].append(label)
+                line_patch['data'][trace['index']]['y'].append(value)
+            else:
+                line_patch['data'][trace['index']]['y'][pos] = value
+            trace['points'][label] = [pos, value]
+            state['totals'][name] = state['totals'].get(name, 0) + delta
+
+    if not changed:
+        return Patch(), Patch(), Patch(), state
+    totals = pd.DataFrame({'vehicle_id': list(state['totals']), 'count': list(state['totals'].values())})
+    return bar_patch, line_patch, card_exporter(totals), state
+
+
+@app.callback(
+    Output('location-view', 'children', allow_duplicate=True),
+    Output('view-state', 'data', allow_duplicate=True),
+    Input('empty-tick', 'n_intervals'),
+    State('view-state', 'data'),
+    prevent_initial_call=True,
+)
+def fill_empty_view(_n_intervals, state):
+    # a live view without counts yet, shown in full once the location has some
+    if not state:
+        raise PreventUpdate
+    updates, _seq = get_live().since(state['seq'], state['location_id'])
+    if updates == []:
+        raise PreventUpdate
+    start, end = date.fromisoformat(state['start']), date.fromisoformat(state['end'])
+    children, new_state = process_location(state['location_id'], start, end, state['granularity'])
+    if new_state is not None and 'bar' not in new_state:
+        raise PreventUpdate  # the queries are still cached, tried again on the next tick
+    return children, new_state
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,45 @@
+import argparse
+import pandas as pd
+from datetime import date, timedelta
+from queries import CountsRepository
+from parquet_store import write_counts, DASH_PARQUET_DIR
+
+
+def export_from_mysql(start: date, end: date, root: str) -> int:
+    """Copy the quarter counts of every location between `start` and `end` into the Parquet dataset."""
+    repository = CountsRepository()
+    rows = 0
+    for location in repository.locations():
+        df = repository.counts(location, start, end, 'quarter')
+        if df.empty:
+            continue
+        df.insert(0, 'location_id', location)
+        write_counts(df, root)
+        rows += len(df)
+    return rows
+
+
+def export_from_excel(path: str, root: str) -> int:
+    """Convert an old `vehicle_counts` Excel export."""
+    df = pd.read_excel(path)
+    write_counts(df[['location_id', 'Date', 'Hour', 'Quarter', 'vehicle_id', 'count']], root)
+    return len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write vehicle counts to the dashboard's Parquet dataset")
+    parser.add_argument('--excel', type=str, help='Old Excel export to convert instead of reading MySQL')
+    parser.add_argument('--start', type=date.fromisoformat, default=date.today() - timedelta(days=1))
+    parser.add_argument('--end', type=date.fromisoformat, default=date.today())
+    parser.add_argument('--root', type=str, default=DASH_PARQUET_DIR)
+    args = parser.parse_args()
+
+    if args.excel:
+        rows = export_from_excel(args.excel, args.root)
+    else:
+        rows = export_from_mysql(args.start, args.end, args.root)
+    print(f"Wrote {rows} rows to {args.root}")
+
+
+if __name__ == '__main__':
+    main()
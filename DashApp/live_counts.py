@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+DASH_AMQP_URL = os.getenv("DASH_AMQP_URL", "")  # broker the congestion consumers publish to, empty disables live mode
+COUNTS_EXCHANGE = os.getenv("COUNTS_EXCHANGE", "vehicle_counts")
+DASH_LIVE_INTERVAL = float(os.getenv("DASH_LIVE_INTERVAL", 5))  # seconds between updates of an open dashboard
+LIVE_HISTORY = 10000  # updates kept for callbacks that fell behind
+RECONNECT_DELAY = 5  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class LiveCounts:
+    """
+    Subscribes to the quarter counts the congestion consumers publish to the `COUNTS_EXCHANGE` fanout exchange,
+    through a server-named queue of its own that the broker deletes when the dashboard goes away.
+
+    Updates are numbered as they arrive. A callback keeps the last number it applied and asks for what came
+    after it with `since`; `None` tells it that it fell behind by more than `LIVE_HISTORY` updates.
+    """
+
+    def __init__(self, amqp_url: str = DASH_AMQP_URL, exchange: str = COUNTS_EXCHANGE):
+        self.amqp_url = amqp_url
+        self.exchange = exchange
+        self.seq = 0
+        self._updates = deque(maxlen=LIVE_HISTORY)  # (seq, update dict)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="LiveCounts", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        import pika
+        while True:
+            try:
+                connection = pika.BlockingConnection(pika.URLParameters(self.amqp_url))
+                channel = connection.channel()
+                channel.exchange_declare(exchange=self.exchange, exchange_type='fanout', durable=False)
+                queue = channel.queue_declare(queue='', exclusive=True, auto_delete=True).method.queue
+                channel.queue_bind(queue=queue, exchange=self.exchange)
+                channel.basic_consume(queue=queue, on_message_callback=self.on_message, auto_ack=True)
+                logger.info(f"Subscribed to live counts on exchange {self.exchange!r}")
+                channel.start_consuming()
+            except Exception:
+                logger.error(f"Live counts subscription lost, reconnecting in {RECONNECT_DELAY} seconds", exc_info=True)
+                time.sleep(RECONNECT_DELAY)
+
+    def on_message(self, _channel, _method, _properties, body):
+        try:
+            update = json.loads(body)
+        except ValueError:
+            logger.warning(f"Ignoring malformed count update: {body[:100]!r}")
+            return
+        with self._lock:
+            self.seq += 1
+            self._updates.append((self.seq, update))
+
+    def since(self, seq: int, location_id: str):
+        """
+        Updates of `location_id` numbered after `seq`, the latest per quarter, and the current number.
+        The updates are None when some of them were already dropped.
+        """
+        with self._lock:
+            current = self.seq
+            if seq < current - len(self._updates):
+                return None, current
+            updates = {}
+            for number, update in reversed(self._updates):
+                if number <= seq:
+                    break
+                if update.get('location_id') == location_id:
+                    updates.setdefault((update['date'], update['hour'], update['quarter']), update)
+        return [updates[key] for key in sorted(updates)], current
@@ -0,0 +1,131 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from datetime import date
+from pyarrow import fs
+from urllib.parse import unquote
+from dotenv import load_dotenv
+from queries import TTLCache, GRANULARITIES, COLUMNS, DASH_CACHE_TTL, DASH_HISTORY_TTL
+
+load_dotenv()
+DASH_PARQUET_DIR = os.getenv("DASH_PARQUET_DIR", "counts_parquet")
+
+# typed columns of the files, classes are dictionary encoded and come back as pandas categoricals;
+# location_id and month are the partition keys and only live in the directory names
+SCHEMA = pa.schema([
+    ('location_id', pa.string()),
+    ('date', pa.date32()),
+    ('hour', pa.int8()),
+    ('quarter', pa.int8()),
+    ('vehicle_id', pa.dictionary(pa.int8(), pa.string())),
+    ('count', pa.int32()),
+])
+KEY = ['location_id', 'date', 'hour', 'quarter', 'vehicle_id']  # one count per key, later writes win
+# one directory per location and month, a file per day would only hold 96 quarters x 6 classes
+PARTITIONING = ds.partitioning(pa.schema([('location_id', pa.string()), ('month', pa.string())]), flavor='hive')
+# given when opening the dataset, a directory without files yet has no schema to discover
+DATASET_SCHEMA = SCHEMA.append(pa.field('month', pa.string()))
+
+
+def _partition_rows(root: str, locations: list, months: list) -> pd.DataFrame:
+    """Rows already stored in the partitions of `locations` x `months`."""
+    if not os.path.isdir(root):
+        return pd.DataFrame(columns=SCHEMA.names)
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING, schema=DATASET_SCHEMA)
+    predicate = ds.field('location_id').isin(locations) & ds.field('month').isin(months)
+    return dataset.to_table(columns=SCHEMA.names, filter=predicate).to_pandas()
+
+
+def write_counts(df: pd.DataFrame, root: str = DASH_PARQUET_DIR) -> None:
+    """
+    Write quarter counts with the columns `location_id`, `Date`, `Hour`, `Quarter`, `vehicle_id` and `count`
+    (the `vehicle_counts` layout) to the dataset. A partition holds a whole location-month, so the rows it
+    already has are merged in before it is rewritten; rows of `df` replace stored rows with the same key.
+    """
+    df = df.rename(columns={'Date': 'date', 'Hour': 'hour', 'Quarter': 'quarter'})[SCHEMA.names]
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    df['vehicle_id'] = df['vehicle_id'].astype(str)
+    months = df['date'].map(lambda d: d.strftime('%Y-%m'))
+    existing = _partition_rows(root, df['location_id'].unique().tolist(), months.unique().tolist())
+    if len(existing):
+        existing['vehicle_id'] = existing['vehicle_id'].astype(str)
+        df = pd.concat([existing, df], ignore_index=True).drop_duplicates(KEY, keep='last')
+        months = df['date'].map(lambda d: d.strftime('%Y-%m'))
+
+    table = pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+    table = table.append_column('month', pa.array(months, pa.string()))
+    ds.write_dataset(table, root, format='parquet', partitioning=PARTITIONING,
+                     existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+
+    written = _partition_rows(root, df['location_id'].unique().tolist(), months.unique().tolist())
+    if len(written) != len(df):
+        raise RuntimeError(f"Partitions under {root} hold {len(written)} rows after the write, expected {len(df)}")
+
+
+class ParquetCountsRepository:
+    """
+    `CountsRepository` over a Parquet dataset partitioned by location and month. Reads only open the
+    partitions of the location and months asked for and filter the rows by date inside them (predicate
+    pushdown), the files are memory mapped. Hourly and daily sums are aggregated in Arrow.
+    """
+
+    def __init__(self, root: str = DASH_PARQUET_DIR, cache: TTLCache = None):
+        self.root = root
+        self.cache = cache or TTLCache()
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+
+    def _dataset(self) -> ds.Dataset:
+        # rediscovered after the TTL, so partitions written meanwhile are picked up
+        dataset = self.cache.get(('dataset', ))
+        if dataset is None:
+            dataset = ds.dataset(self.root, format='parquet', partitioning=PARTITIONING, schema=DATASET_SCHEMA,
+                                 filesystem=self.filesystem)
+            self.cache.put(('dataset', ), dataset, DASH_CACHE_TTL)
+        return dataset
+
+    def locations(self) -> list[str]:
+        locations = self.cache.get(('locations', ))
+        if locations is None:
+            # the partition directories, no file has to be opened
+            locations = sorted(unquote(entry.split('=', 1)[1]) for entry in os.listdir(self.root)
+                               if entry.startswith('location_id=')) if os.path.isdir(self.root) else []
+            self.cache.put(('locations', ), locations, DASH_CACHE_TTL)
+        return locations
+
+    def counts(self, location: str, start: date, end: date, granularity: str = 'quarter') -> pd.DataFrame:
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity {granularity!r}, expected one of {GRANULARITIES}")
+        key = (location, start, end, granularity)
+        df = self.cache.get(key)
+        if df is None:
+            df = self._read(location, start, end, granularity)
+            self.cache.put(key, df, DASH_CACHE_TTL if end >= date.today() else DASH_HISTORY_TTL)
+        return df.copy()
+
+    def _read(self, location: str, start: date, end: date, granularity: str) -> pd.DataFrame:
+        if not os.path.isdir(self.root):
+            return pd.DataFrame(columns=COLUMNS)
+        predicate = ((ds.field('location_id') == location)
+                     & (ds.field('month') >= start.strftime('%Y-%m')) & (ds.field('month') <= end.strftime('%Y-%m'))
+                     & (ds.field('date') >= start) & (ds.field('date') <= end))
+        columns = ['date', 'hour', 'quarter', 'vehicle_id', 'count']
+        try:
+            table = self._dataset().to_table(columns=columns, filter=predicate)
+        except (OSError, pa.ArrowInvalid):
+            # a partition was rewritten by the exporter since the dataset was discovered
+            self.cache.put(('dataset', ), None, 0)
+            table = self._dataset().to_table(columns=columns, filter=predicate)
+        if granularity != 'quarter':
+            keys = ['date', 'hour', 'vehicle_id'] if granularity == 'hour' else ['date', 'vehicle_id']
+            # group_by does not take dictionary columns, sums are a few rows per day anyway
+            table = table.set_column(3, 'vehicle_id', table.column('vehicle_id').cast(pa.string()))
+            table = table.group_by(keys).aggregate([('count', 'sum')]).rename_columns(keys + ['count'])
+            for column in ('hour', 'quarter'):
+                if column not in table.column_names:
+                    table = table.append_column(column, pa.nulls(len(table), pa.int8()))
+            table = table.select(['date', 'hour', 'quarter', 'vehicle_id', 'count'])
+        df = table.to_pandas()
+        df.columns = COLUMNS
+        df['vehicle_id'] = df['vehicle_id'].astype('category')
+        return df.sort_values(['Date', 'Hour', 'Quarter'], na_position='first', ignore_index=True)
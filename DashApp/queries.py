@@ -0,0 +1,141 @@
+import os
+import time
+import threading
+import pandas as pd
+from collections import OrderedDict
+from datetime import date
+from dotenv import load_dotenv
+from mysql.connector import pooling
+
+load_dotenv()
+HOST = os.getenv("HOST")
+USER = os.getenv("USER")
+PASSWORD = os.getenv("PASSWORD")
+DATABASE = os.getenv("DATABASE")
+DASH_POOL_SIZE = int(os.getenv("DASH_POOL_SIZE", 4))
+DASH_CACHE_SIZE = int(os.getenv("DASH_CACHE_SIZE", 256))  # cached query results
+DASH_CACHE_TTL = float(os.getenv("DASH_CACHE_TTL", 60))  # seconds, for ranges that include today
+DASH_HISTORY_TTL = float(os.getenv("DASH_HISTORY_TTL", 3600))  # seconds, for ranges that ended before today
+DASH_BACKEND = os.getenv("DASH_BACKEND", 'mysql')  # 'mysql' or 'parquet', see parquet_store.py
+GRANULARITIES = ('quarter', 'hour', 'day')
+COLUMNS = ['Date', 'Hour', 'Quarter', 'vehicle_id', 'count']
+
+# counts per granularity, from the consumers' vehicle_counts_v2 table and its rollups
+_QUERIES = {
+    'quarter': """
+        SELECT v.date, v.hour, v.quarter, c.name, v.count
+        FROM vehicle_counts_v2 v
+        JOIN locations l ON l.location_id = v.location_id
+        JOIN vehicle_classes c ON c.class_id = v.class_id
+        WHERE l.name = %s AND v.date BETWEEN %s AND %s
+        ORDER BY v.date, v.hour, v.quarter
+    """,
+    'hour': """
+        SELECT v.date, v.hour, NULL, c.name, v.count
+        FROM vehicle_counts_hourly v
+        JOIN locations l ON l.location_id = v.location_id
+        JOIN vehicle_classes c ON c.class_id = v.class_id
+        WHERE l.name = %s AND v.date BETWEEN %s AND %s
+        ORDER BY v.date, v.hour
+    """,
+    'day': """
+        SELECT v.date, NULL, NULL, c.name, v.count
+        FROM vehicle_counts_daily v
+        JOIN locations l ON l.location_id = v.location_id
+        JOIN vehicle_classes c ON c.class_id = v.class_id
+        WHERE l.name = %s AND v.date BETWEEN %s AND %s
+        ORDER BY v.date
+    """,
+}
+
+
+class TTLCache:
+    """Least recently used cache whose entries also expire after their own time to live."""
+
+    def __init__(self, maxsize: int = DASH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class CountsRepository:
+    """
+    Read side of the vehicle counts for the dashboard. Results are cached per
+    (location, start date, end date, granularity); ranges that include today expire after `DASH_CACHE_TTL`
+    seconds since the consumers keep writing to them, older ranges after `DASH_HISTORY_TTL`.
+    """
+
+    def __init__(self, cache: TTLCache = None, pool_size: int = DASH_POOL_SIZE):
+        self.cache = cache or TTLCache()
+        self._pool = pooling.MySQLConnectionPool(
+            pool_name="dashapp",
+            pool_size=pool_size,
+            pool_reset_session=True,
+            host=HOST,
+            user=USER,
+            password=PASSWORD,
+            database=DATABASE
+        )
+
+    def _fetch(self, query: str, params: tuple = ()) -> list:
+        connection = self._pool.get_connection()
+        try:
+            connection.ping(reconnect=True, attempts=3, delay=1)
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+
+    def locations(self) -> list[str]:
+        locations = self.cache.get(('locations', ))
+        if locations is None:
+            locations = [row[0] for row in self._fetch("SELECT name FROM locations ORDER BY name")]
+            self.cache.put(('locations', ), locations, DASH_CACHE_TTL)
+        return locations
+
+    def counts(self, location: str, start: date, end: date, granularity: str = 'quarter') -> pd.DataFrame:
+        """
+        Counts per class of one location from `start` to `end` (inclusive), with the columns
+        `Date`, `Hour`, `Quarter`, `vehicle_id` and `count`; `Hour`/`Quarter` are empty for coarser granularities.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity {granularity!r}, expected one of {GRANULARITIES}")
+        key = (location, start, end, granularity)
+        df = self.cache.get(key)
+        if df is None:
+            df = pd.DataFrame(self._fetch(_QUERIES[granularity], (location, start, end)), columns=COLUMNS)
+            df['vehicle_id'] = df['vehicle_id'].astype('category')
+            self.cache.put(key, df, DASH_CACHE_TTL if end >= date.today() else DASH_HISTORY_TTL)
+        return df.copy()
+
+
+def open_repository(backend: str = DASH_BACKEND):
+    """The counts repository of the configured backend."""
+    if backend == 'parquet':
+        from parquet_store import ParquetCountsRepository
+        return ParquetCountsRepository()
+    if backend != 'mysql':
+        raise ValueError(f"Unknown DASH_BACKEND {backend!r}, expected 'mysql' or 'parquet'")
+    return CountsRepository()
@@ -0,0 +1,35 @@
+import pytest
+import pandas as pd
+from datetime import date
+
+pytest.importorskip('mysql.connector')  # parquet_store takes the cache and column names from queries
+from parquet_store import ParquetCountsRepository, write_counts
+
+
+def counts(rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=['location_id', 'Date', 'Hour', 'Quarter', 'vehicle_id', 'count'])
+
+
+def test_write_counts_merges_partitions(tmp_path):
+    root = str(tmp_path)
+    write_counts(counts([
+        ('Junction 1', '2024-04-09', 10, 1, 'car', 5),
+        ('Junction 1', '2024-04-09', 10, 1, 'bus', 1),
+        ('Junction 1', '2024-05-01', 0, 0, 'car', 2),
+    ]), root)
+    # a later flush of the same quarter replaces its rows, other rows of the month stay
+    write_counts(counts([
+        ('Junction 1', '2024-04-09', 10, 1, 'car', 7),
+        ('Junction 1', '2024-04-10', 8, 3, 'auto', 4),
+        ('Junction 2', '2024-04-09', 10, 1, 'car', 9),
+    ]), root)
+
+    repository = ParquetCountsRepository(root)
+    assert repository.locations() == ['Junction 1', 'Junction 2']
+    df = repository.counts('Junction 1', date(2024, 4, 1), date(2024, 5, 31))
+    rows = sorted(zip(df['Date'].astype(str), df['Hour'], df['Quarter'], df['vehicle_id'].astype(str), df['count']))
+    assert rows == [('2024-04-09', 10, 1, 'bus', 1), ('2024-04-09', 10, 1, 'car', 7),
+                    ('2024-04-10', 8, 3, 'auto', 4), ('2024-05-01', 0, 0, 'car', 2)]
+
+    daily = repository.counts('Junction 1', date(2024, 4, 9), date(2024, 4, 9), 'day')
+    assert daily.set_index('vehicle_id')['count'].astype(int).to_dict() == {'bus': 1, 'car': 7}
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip('mysql.connector')
+import queries
+from queries import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(queries.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache()
+    cache.put('today', 1, ttl=60)
+    cache.put('history', 2, ttl=3600)
+    clock[0] += 59
+    assert cache.get('today') == 1
+    clock[0] += 2
+    assert cache.get('today') is None and cache.get('history') == 2
+    assert cache.get('missing') is None
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(maxsize=2)
+    cache.put('a', 1, ttl=60)
+    cache.put('b', 2, ttl=60)
+    assert cache.get('a') == 1
+    cache.put('c', 3, ttl=60)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
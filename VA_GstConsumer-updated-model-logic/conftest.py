@@ -0,0 +1,2 @@
+# Puts this project's root on sys.path so the tests import its modules as the scripts do.
+# Run the tests from here with `python -m pytest -q`.
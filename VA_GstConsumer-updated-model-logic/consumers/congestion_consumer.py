@@ -5,25 +5,34 @@ import multiprocessing
 from dotenv import load_dotenv
 from pika.exceptions import AMQPConnectionError
 from infer.congestion_processor import RTSPFrameConsumer
+from infer.inference_server import BatchInferenceServer
+from utils.metrics import metrics
 from utils.utilities import arguments_parser, init_logger_alt
-from db.crud_sql import get_db_connection, create_main_table, create_stream_quality_table
+from utils.queue_policy import load_policies
+from db.crud_sql import db_cursor, create_main_table, create_stream_quality_table
 
 load_dotenv()
 LOG_FOLDER = os.getenv('CONGESTION_LOG_FOLDER')
 RABBIT_ID = os.getenv('RABBIT_ID')
 RABBIT_PASS = os.getenv('RABBIT_PASS')
 PRODUCER_IPV4 = os.getenv('PRODUCER_IPV4')
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 15))
+INFERENCE_MODE = os.getenv('INFERENCE_MODE', 'local')  # 'local': model per process, 'server': shared batching
+INFER_WORKERS = int(os.getenv('INFER_WORKERS', 1))
 main_logger = init_logger_alt(f'{LOG_FOLDER}/main_log')
 
 
 class ReconnectingConsumer(object):
 
-    def __init__(self, amqp_url, camera, vc, sl):
+    def __init__(self, amqp_url, camera, vc, sl, inference_client=None, queue_policy=None):
         self._reconnect_delay = 0
         self._amqp_url = amqp_url
         self._location = camera
         self._main_logger = sl
-        self._consumer = RTSPFrameConsumer(amqp_url=amqp_url, location=camera, vehicle_counts=vc, main_logger=sl)
+        self._inference_client = inference_client
+        self._queue_policy = queue_policy
+        self._consumer = RTSPFrameConsumer(amqp_url=amqp_url, location=camera, vehicle_counts=vc, main_logger=sl,
+                                           inference_client=inference_client, queue_policy=queue_policy)
 
     def run(self):
         while True:
@@ -37,7 +46,9 @@ class ReconnectingConsumer(object):
                 time.sleep(self._get_reconnect_delay())
                 self._remove_handlers()
                 self._consumer = RTSPFrameConsumer(amqp_url=self._amqp_url, location=self._location,
-                                                   vehicle_counts=e.args, main_logger=self._main_logger)
+                                                   vehicle_counts=e.args, main_logger=self._main_logger,
+                                                   inference_client=self._inference_client,
+                                                   queue_policy=self._queue_policy)
             except Exception as e:
                 self._consumer.stop()
                 time.sleep(self._get_reconnect_delay())
@@ -65,8 +76,10 @@ class ReconnectingConsumer(object):
         return self._reconnect_delay
 
 
-def run_consumer(amqp_url, camera, source_logger):
-    consumer = ReconnectingConsumer(amqp_url=amqp_url, camera=camera, vc={key: 0 for key in range(6)}, sl=source_logger)
+def run_consumer(amqp_url, camera, source_logger, inference_client=None, queue_policy=None):
+    metrics.start_reporter(METRICS_INTERVAL, textfile=f'{LOG_FOLDER}/metrics/{camera}.prom')
+    consumer = ReconnectingConsumer(amqp_url=amqp_url, camera=camera, vc={key: 0 for key in range(6)}, sl=source_logger,
+                                    inference_client=inference_client, queue_policy=queue_policy)
     consumer.run()
 
 
@@ -81,16 +94,22 @@ def run_congestion_consumers():
     main_logger.info(f"Number of congestion consumers: {len(args.camera_names)}")
     amqp_url = rf'amqp://{RABBIT_ID}:{RABBIT_PASS}@{PRODUCER_IPV4}:5672/%2F?connection_attempts=20&heartbeat=600'
 
-    db_conn = get_db_connection()
-    db_cur = db_conn.cursor()
-    create_main_table(db_cur)
-    create_stream_quality_table(db_cur)
-    db_cur.close()
-    db_conn.commit()
+    with db_cursor(commit=True) as db_cur:
+        create_main_table(db_cur)
+        create_stream_quality_table(db_cur)
 
+    inference_server = None
+    if INFERENCE_MODE == 'server':
+        inference_server = BatchInferenceServer(congestion_cameras, num_workers=INFER_WORKERS)
+        inference_server.start()
+        main_logger.info(f"Started shared inference server with {INFER_WORKERS} workers")
+
+    queue_policies = load_policies()
     processes = []
     for cam in congestion_cameras:
-        process = multiprocessing.Process(target=run_consumer, args=(amqp_url, cam, main_logger))
+        client = inference_server.client(cam) if inference_server else None
+        process = multiprocessing.Process(target=run_consumer,
+                                          args=(amqp_url, cam, main_logger, client, queue_policies.get(cam)))
         process.start()
         processes.append(process)
 
@@ -105,6 +124,8 @@ def run_congestion_consumers():
         for process in processes:
             if process.is_alive():
                 process.terminate()
+        if inference_server:
+            inference_server.stop()
         main_logger.info("All producers stopped")
 
 
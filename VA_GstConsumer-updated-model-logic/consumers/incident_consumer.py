@@ -5,24 +5,28 @@ import multiprocessing
 from dotenv import load_dotenv
 from pika.exceptions import AMQPConnectionError
 from infer.incident_processor import RTSPFrameConsumer
+from utils.metrics import metrics
 from utils.utilities import arguments_parser, init_logger_alt
+from utils.queue_policy import load_policies
 
 load_dotenv()
 LOG_FOLDER = os.getenv('CONGESTION_LOG_FOLDER')
 RABBIT_ID = os.getenv('RABBIT_ID')
 RABBIT_PASS = os.getenv('RABBIT_PASS')
 PRODUCER_IPV4 = os.getenv('PRODUCER_IPV4')
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 15))
 main_logger = init_logger_alt(f'{LOG_FOLDER}/main_log')
 
 
 class ReconnectingConsumer(object):
 
-    def __init__(self, amqp_url, camera, sl):
+    def __init__(self, amqp_url, camera, sl, queue_policy=None):
         self._reconnect_delay = 0
         self._amqp_url = amqp_url
         self._location = camera
         self._main_logger = sl
-        self._consumer = RTSPFrameConsumer(amqp_url=amqp_url, location=camera, main_logger=sl)
+        self._queue_policy = queue_policy
+        self._consumer = RTSPFrameConsumer(amqp_url=amqp_url, location=camera, main_logger=sl, queue_policy=queue_policy)
 
     def run(self):
         while True:
@@ -35,7 +39,8 @@ class ReconnectingConsumer(object):
                 self._consumer.stop()
                 time.sleep(self._get_reconnect_delay())
                 self._remove_handlers()
-                self._consumer = RTSPFrameConsumer(amqp_url=self._amqp_url, location=self._location,main_logger=self._main_logger)
+                self._consumer = RTSPFrameConsumer(amqp_url=self._amqp_url, location=self._location,main_logger=self._main_logger,
+                                                   queue_policy=self._queue_policy)
             except Exception as e:
                 self._consumer.stop()
                 time.sleep(self._get_reconnect_delay())
@@ -61,8 +66,9 @@ class ReconnectingConsumer(object):
         return self._reconnect_delay
 
 
-def run_consumer(amqp_url, camera, source_logger):
-    consumer = ReconnectingConsumer(amqp_url=amqp_url, camera=camera, sl=source_logger)
+def run_consumer(amqp_url, camera, source_logger, queue_policy=None):
+    metrics.start_reporter(METRICS_INTERVAL, textfile=f'{LOG_FOLDER}/metrics/{camera}.prom')
+    consumer = ReconnectingConsumer(amqp_url=amqp_url, camera=camera, sl=source_logger, queue_policy=queue_policy)
     consumer.run()
 
 
@@ -77,9 +83,10 @@ def run_incident_consumers():
     main_logger.info(f"Number of incident consumers: {len(args.camera_names)}")
     amqp_url = rf'amqp://{RABBIT_ID}:{RABBIT_PASS}@{PRODUCER_IPV4}:5672/%2F?connection_attempts=20&heartbeat=600'
 
+    queue_policies = load_policies()
     processes = []
     for cam in incident_cameras:
-        process = multiprocessing.Process(target=run_consumer, args=(amqp_url, cam, main_logger))
+        process = multiprocessing.Process(target=run_consumer, args=(amqp_url, cam, main_logger, queue_policies.get(cam)))
         process.start()
         processes.append(process)
 
@@ -0,0 +1,49 @@
+import os
+import time
+from datetime import date
+from dotenv import load_dotenv
+from db.crud_sql import update_main_db
+
+load_dotenv()
+FLUSH_INTERVAL = float(os.getenv('COUNT_FLUSH_INTERVAL', 5))  # seconds
+
+
+class VehicleCountStore:
+    """
+    Write-behind store for the vehicle counts of one location. Only the current quarter is kept in
+    memory; it is written to `vehicle_counts` when it changed and `flush_interval` seconds have passed,
+    when the quarter changes, and on `close()` so no counts are lost on shutdown. Each write is passed on
+    to `on_flush(location_id, date, hour, quarter, counts)` when given, e.g. to publish it to dashboards.
+    """
+
+    def __init__(self, location_id: str, flush_interval: float = FLUSH_INTERVAL, on_flush=None):
+        self.location_id = location_id
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self._quarter_key = None  # (date, hour, quarter) of the counts held in memory
+        self._counts = None
+        self._flushed_counts = None
+        self._last_flush = time.monotonic()
+
+    def update(self, current_date: date, hour: int, quarter: int, vehicle_counts: dict[int, int]) -> None:
+        key = (current_date, hour, quarter)
+        if self._quarter_key is not None and key != self._quarter_key:
+            self.flush()
+            self._flushed_counts = None
+        self._quarter_key = key
+        self._counts = dict(vehicle_counts)
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if self._quarter_key is None or self._counts == self._flushed_counts:
+            return
+        update_main_db(self.location_id, *self._quarter_key, self._counts)
+        self._flushed_counts = self._counts
+        if self.on_flush is not None:
+            self.on_flush(self.location_id, *self._quarter_key, self._counts)
+
+    def close(self) -> None:
+        self.flush()
@@ -1,36 +1,149 @@
 import os
+import time
 import logging
+import threading
+from multiprocessing import util
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
 from dotenv import load_dotenv
+from utils.log_setup import setup_logging
 
 load_dotenv()
 db_name = os.getenv("DB_NAME")
+INCIDENT_FLUSH_SIZE = int(os.getenv("INCIDENT_FLUSH_SIZE", 20))  # buffered incidents that trigger an insert_many
+INCIDENT_FLUSH_INTERVAL = float(os.getenv("INCIDENT_FLUSH_INTERVAL", 2.0))  # seconds an incident may wait in the buffer
+INCIDENT_BUFFER_MAX = int(os.getenv("INCIDENT_BUFFER_MAX", 1000))  # kept while MongoDB is unreachable, oldest dropped
+STREAM_REFRESH_INTERVAL = 30  # seconds between full reloads of the CameraName map on misses
 client = MongoClient('localhost', 27017)
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
-        
 
-def push_to_incidents(camera_name: str, timestamp: datetime, name: str, b64_image: str) -> None:
+
+class IncidentStore:
+    """
+    Buffered writer for the `Incidents` collection.
+
+    Incident documents reference their stream by the `_id` of its `Streams` document, resolved from a cached
+    CameraName -> _id map that is reloaded in one query when a camera is missing from it. Documents are
+    buffered and written with one unordered `insert_many` when `flush_size` of them are waiting or the
+    oldest waited `flush_interval` seconds. Images are not embedded, documents carry the path of the saved
+    JPEG (`IncImagePath`). Inserts that fail because MongoDB is unreachable stay buffered and are retried.
+    """
+
+    def __init__(self, mongo_client: MongoClient = client, database: str = db_name,
+                 flush_size: int = INCIDENT_FLUSH_SIZE, flush_interval: float = INCIDENT_FLUSH_INTERVAL,
+                 buffer_max: int = INCIDENT_BUFFER_MAX):
+        self.db = mongo_client[database]
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.buffer_max = buffer_max
+        self._stream_ids = {}
+        self._refreshed_at = 0.0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._indexed = False
+        self._thread = threading.Thread(target=self._run, name="IncidentStore", daemon=True)
+        self._thread.start()
+
+    def ensure_indexes(self) -> None:
+        collection = self.db["Incidents"]
+        collection.create_index([("IncRTSP", ASCENDING), ("IncTimestamp", DESCENDING)])
+        collection.create_index([("IncTimestamp", DESCENDING)])
+        self._indexed = True
+
+    def stream_id(self, camera_name: str):
+        """`_id` of the camera's `Streams` document, None when there is none."""
+        stream_id = self._stream_ids.get(camera_name)
+        if stream_id is None and time.monotonic() - self._refreshed_at >= STREAM_REFRESH_INTERVAL:
+            self._stream_ids = {doc["CameraName"]: doc["_id"]
+                                for doc in self.db["Streams"].find({}, {"CameraName": 1})
+                                if "CameraName" in doc}
+            self._refreshed_at = time.monotonic()
+            stream_id = self._stream_ids.get(camera_name)
+        return stream_id
+
+    def add(self, camera_name: str, timestamp: datetime, name: str, img_path: str) -> None:
+        """Buffer an incident, it is written with the next flush."""
+        document = {
+            "IncTimestamp": str(timestamp),
+            "IncName": name,
+            "IncImagePath": img_path,
+            "CameraName": camera_name,  # IncRTSP is resolved from it at flush time
+        }
+        with self._lock:
+            self._buffer.append(document)
+            if len(self._buffer) > self.buffer_max:
+                dropped = len(self._buffer) - self.buffer_max
+                del self._buffer[:dropped]
+                logger.error(f"Incident buffer full, dropped {dropped} incidents")
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.error("Incident flush failed", exc_info=True)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                documents, self._buffer = self._buffer, []
+            if not documents:
+                return
+            try:
+                if not self._indexed:
+                    self.ensure_indexes()
+                for document in documents:
+                    if "IncRTSP" not in document:
+                        document["IncRTSP"] = self.stream_id(document["CameraName"])
+                        if document["IncRTSP"] is None:
+                            logger.warning(f"No stream named {document['CameraName']!r}, incident stored without IncRTSP")
+                result = self.db["Incidents"].insert_many(documents, ordered=False)
+                logger.info(f"Inserted {len(result.inserted_ids)} incidents into Collection: 'Incidents'.")
+            except BulkWriteError as e:
+                # unordered: everything but the failed documents was written, those will fail again
+                logger.error(f"{len(e.details.get('writeErrors', []))} of {len(documents)} incidents not inserted: "
+                             f"{e.details.get('writeErrors')}")
+            except PyMongoError as e:
+                logger.warning(f"MongoDB unavailable, keeping {len(documents)} incidents for the next flush: {e}")
+                with self._lock:
+                    self._buffer[:0] = documents
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def incident_store() -> IncidentStore:
+    """The process wide incident store, created on first use and flushed at exit, also of multiprocessing children."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IncidentStore()
+            util.Finalize(_store, _store.close, exitpriority=10)  # after the alert dispatcher drained into it
+        return _store
+
+
+def push_to_incidents(camera_name: str, timestamp: datetime, name: str, img_path: str) -> None:
     """
-    Push the incident info to MongoDB Instance
+    Queue the incident info for MongoDB, see `IncidentStore`.
 
     Args:
-        date: Timestamp of the incident
+        camera_name: CameraName of the stream's document in `Streams`
+        timestamp: Timestamp of the incident
         name: Name of the incident
-        b64_img: Base64 encoded image to string
+        img_path: Path of the saved incident image
     """
-    stream = client[db_name]["Streams"].find_one({"CameraName":camera_name})
-    id = stream["_id"]
-
-    document = {
-        "IncTimestamp": str(timestamp),
-        "IncName": name,
-        "IncImage": [b64_image],
-        "IncRTSP": id,
-    }
-    collection = client[db_name]["Incidents"]
-    result = collection.insert_one(document)
-    IncId = repr(result.inserted_id)
-    logger.info(f"Inserted incident info with {IncId} into Collection: '{collection}' .")
+    incident_store().add(camera_name, timestamp, name, img_path)
@@ -1,8 +1,11 @@
 import os
+import time
 import uuid
+import threading
+from contextlib import contextmanager
 from datetime import datetime, date
 from sqlite3 import Date
-from mysql.connector import connect
+from mysql.connector import pooling, errors
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -10,19 +13,78 @@ HOST = os.getenv("HOST")
 USER = os.getenv("USER")
 PASSWORD = os.getenv("PASSWORD")
 DATABASE = os.getenv("DATABASE")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 2))  # connections per consumer process
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # seconds to wait for a free connection
 class_names = {0: 'auto', 1: 'bus', 2: 'car', 3: 'motorbike', 4: 'truck', 5: 'person'}
 
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> pooling.MySQLConnectionPool:
+    """
+    The connection pool of this process. Consumers are forked, a child never reuses the sockets of a
+    pool it inherited and builds its own on first use.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = pooling.MySQLConnectionPool(
+                pool_name=f"va_{os.getpid()}",
+                pool_size=DB_POOL_SIZE,
+                pool_reset_session=True,
+                host=HOST,
+                user=USER,
+                password=PASSWORD,
+                database=DATABASE
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
 
 def get_db_connection():
-    connection = connect(
-        host=HOST,
-        user=USER,
-        password=PASSWORD,
-        database=DATABASE
-    )
+    """
+    A connection checked out of the pool and pinged (reconnecting if the server dropped it). `close()`
+    returns it to the pool. Waits up to `DB_POOL_TIMEOUT` seconds while all connections are in use.
+    """
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    while True:
+        try:
+            connection = get_pool().get_connection()
+            break
+        except errors.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+    try:
+        connection.ping(reconnect=True, attempts=3, delay=1)
+    except Exception:
+        connection.close()
+        raise
     return connection
 
 
+@contextmanager
+def db_cursor(commit: bool = False):
+    """
+    Cursor on a pooled connection. Commits on success when `commit` is set, rolls back on errors, and
+    always closes the cursor and returns the connection to the pool.
+    """
+    connection = get_db_connection()
+    cursor = connection.cursor()
+    try:
+        yield cursor
+        if commit:
+            connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
 def create_stream_quality_table(cursor) -> None:
     cursor.execute("""
             CREATE TABLE IF NOT EXISTS stream_quality (
@@ -37,75 +99,222 @@ def create_stream_quality_table(cursor) -> None:
 
 
 def create_main_table(cursor) -> None:
+    """
+    Schema version 2 of the vehicle counts: `vehicle_counts_v2` keyed by small integer ids of the
+    `locations` and `vehicle_classes` dimension tables, with `vehicle_counts` kept as a view in the
+    version 1 layout for existing reports. A version 1 `vehicle_counts` table is migrated on the way.
+    """
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS vehicle_counts (
-            location_id VARCHAR(255),
-            Date DATE,
-            Hour INT,
-            Quarter INT,
-            vehicle_id VARCHAR(255),
-            count INT,
-            source_id VARCHAR(255) PRIMARY KEY
+        CREATE TABLE IF NOT EXISTS locations (
+            location_id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL UNIQUE
         )
     """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_classes (
+            class_id TINYINT UNSIGNED PRIMARY KEY,
+            name VARCHAR(32) NOT NULL UNIQUE
+        )
+    """)
+    cursor.executemany("INSERT IGNORE INTO vehicle_classes (class_id, name) VALUES (%s, %s)",
+                       list(class_names.items()))
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_counts_v2 (
+            location_id SMALLINT UNSIGNED NOT NULL,
+            date DATE NOT NULL,
+            hour TINYINT UNSIGNED NOT NULL,
+            quarter TINYINT UNSIGNED NOT NULL,
+            class_id TINYINT UNSIGNED NOT NULL,
+            count INT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY (location_id, date, hour, quarter, class_id),
+            KEY idx_date_location (date, location_id),
+            FOREIGN KEY (location_id) REFERENCES locations (location_id),
+            FOREIGN KEY (class_id) REFERENCES vehicle_classes (class_id)
+        )
+    """)
+    migrate_vehicle_counts(cursor)
+    create_rollup_tables(cursor)
 
 
-def update_main_db(connection, location_id: str, date: Date, hour: int,
-                   quarter: int, vehicle_counts: dict[int, int]) -> None:
-    cursor = connection.cursor()
-    for i in range(6):
-        source_id = f"{location_id}_{date}_{hour}_{quarter}_{class_names[i]}"
-        cursor.execute("SELECT COUNT(*) FROM vehicle_counts WHERE source_id = %s", (source_id,))
-        result = cursor.fetchone()
-        if result[0] > 0:
-            cursor.execute("UPDATE vehicle_counts SET count = %s WHERE source_id = %s", (vehicle_counts[i], source_id,))
-        else:
-            cursor.execute("""
-                    INSERT INTO vehicle_counts (location_id, Date, Hour, Quarter, vehicle_id, count, source_id)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                            """, (location_id, date, hour, quarter, class_names[i], vehicle_counts[i], source_id))
-        # cursor.close()
-        connection.commit()
-
-
-def update_stream_db(connection, location_id: str, date: date, status: bool,
+def create_rollup_tables(cursor) -> None:
+    """
+    Hourly and daily sums of `vehicle_counts_v2` for the dashboard, kept current by `update_main_db`.
+    Filled from the quarter counts when they are created empty.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_counts_hourly (
+            location_id SMALLINT UNSIGNED NOT NULL,
+            date DATE NOT NULL,
+            hour TINYINT UNSIGNED NOT NULL,
+            class_id TINYINT UNSIGNED NOT NULL,
+            count INT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY (location_id, date, hour, class_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_counts_daily (
+            location_id SMALLINT UNSIGNED NOT NULL,
+            date DATE NOT NULL,
+            class_id TINYINT UNSIGNED NOT NULL,
+            count INT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY (location_id, date, class_id)
+        )
+    """)
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM vehicle_counts_hourly)")
+    if not cursor.fetchone()[0]:
+        cursor.execute("""
+            INSERT INTO vehicle_counts_hourly (location_id, date, hour, class_id, count)
+            SELECT location_id, date, hour, class_id, SUM(count) FROM vehicle_counts_v2
+            GROUP BY location_id, date, hour, class_id
+        """)
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM vehicle_counts_daily)")
+    if not cursor.fetchone()[0]:
+        cursor.execute("""
+            INSERT INTO vehicle_counts_daily (location_id, date, class_id, count)
+            SELECT location_id, date, class_id, SUM(count) FROM vehicle_counts_hourly
+            GROUP BY location_id, date, class_id
+        """)
+
+
+def _table_type(cursor, table: str):
+    cursor.execute("""
+        SELECT TABLE_TYPE FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table, ))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def migrate_vehicle_counts(cursor) -> None:
+    """
+    Move a version 1 `vehicle_counts` table (string `source_id` key) to `vehicle_counts_v2`.
+
+    The old table is renamed to `vehicle_counts_v1` and kept, its rows are copied over, and `vehicle_counts`
+    is recreated as a view. Each step is idempotent, an interrupted migration is finished on the next start.
+    """
+    if _table_type(cursor, 'vehicle_counts') == 'BASE TABLE':
+        cursor.execute("RENAME TABLE vehicle_counts TO vehicle_counts_v1")
+    if _table_type(cursor, 'vehicle_counts') == 'VIEW':
+        return
+
+    if _table_type(cursor, 'vehicle_counts_v1') is not None:
+        cursor.execute("INSERT IGNORE INTO locations (name) SELECT DISTINCT location_id FROM vehicle_counts_v1")
+        cursor.execute("""
+            INSERT INTO vehicle_counts_v2 (location_id, date, hour, quarter, class_id, count)
+            SELECT l.location_id, v.Date, v.Hour, v.Quarter, c.class_id, GREATEST(v.count, 0)
+            FROM vehicle_counts_v1 v
+            JOIN locations l ON l.name = v.location_id
+            JOIN vehicle_classes c ON c.name = v.vehicle_id
+            ON DUPLICATE KEY UPDATE count = VALUES(count)
+        """)
+    cursor.execute("""
+        CREATE OR REPLACE VIEW vehicle_counts AS
+        SELECT l.name AS location_id, v.date AS Date, v.hour AS Hour, v.quarter AS Quarter,
+               c.name AS vehicle_id, v.count AS count,
+               CONCAT(l.name, '_', v.date, '_', v.hour, '_', v.quarter, '_', c.name) AS source_id
+        FROM vehicle_counts_v2 v
+        JOIN locations l ON l.location_id = v.location_id
+        JOIN vehicle_classes c ON c.class_id = v.class_id
+    """)
+
+
+_location_ids: dict[str, int] = {}
+
+
+def location_key(cursor, location_id: str) -> int:
+    """
+    Integer id of a location in `locations`, added on first use and cached for the process. Only ids found
+    already stored are cached: one added here is rolled back with the caller's transaction if that fails.
+    """
+    key = _location_ids.get(location_id)
+    if key is None:
+        cursor.execute("SELECT location_id FROM locations WHERE name = %s", (location_id, ))
+        row = cursor.fetchone()
+        if row is not None:
+            key = _location_ids[location_id] = row[0]
+        else:  # checked first, a failed INSERT IGNORE still uses up an AUTO_INCREMENT value
+            cursor.execute("INSERT IGNORE INTO locations (name) VALUES (%s)", (location_id, ))
+            cursor.execute("SELECT location_id FROM locations WHERE name = %s", (location_id, ))
+            key = cursor.fetchone()[0]
+    return key
+
+
+def update_main_db(location_id: str, date: Date, hour: int, quarter: int, vehicle_counts: dict[int, int]) -> None:
+    """
+    Upsert the counts of all classes for one quarter with a single multi-row
+    `INSERT ... ON DUPLICATE KEY UPDATE` statement and one commit.
+    """
+    with db_cursor(commit=True) as cursor:
+        _upsert_counts(cursor, location_id, date, hour, quarter, vehicle_counts)
+
+
+def _upsert_counts(cursor, location_id: str, date: Date, hour: int, quarter: int,
+                   vehicle_counts: dict[int, int]) -> None:
+    key = location_key(cursor, location_id)
+    rows = [(key, date, hour, quarter, class_id, max(0, vehicle_counts.get(class_id, 0))) for class_id in class_names]
+
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows))
+    cursor.execute(f"""
+            INSERT INTO vehicle_counts_v2 (location_id, date, hour, quarter, class_id, count)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE count = VALUES(count)
+                """, [value for row in rows for value in row])
+    _refresh_rollups(cursor, key, date, hour)
+
+
+def _refresh_rollups(cursor, key: int, date: Date, hour: int) -> None:
+    """Re-sum the hour and the day just written, both are primary key range reads of at most a day."""
+    cursor.execute("""
+        INSERT INTO vehicle_counts_hourly (location_id, date, hour, class_id, count)
+        SELECT location_id, date, hour, class_id, SUM(count) FROM vehicle_counts_v2
+        WHERE location_id = %s AND date = %s AND hour = %s
+        GROUP BY location_id, date, hour, class_id
+        ON DUPLICATE KEY UPDATE count = VALUES(count)
+    """, (key, date, hour))
+    cursor.execute("""
+        INSERT INTO vehicle_counts_daily (location_id, date, class_id, count)
+        SELECT location_id, date, class_id, SUM(count) FROM vehicle_counts_hourly
+        WHERE location_id = %s AND date = %s
+        GROUP BY location_id, date, class_id
+        ON DUPLICATE KEY UPDATE count = VALUES(count)
+    """, (key, date))
+
+
+def update_stream_db(location_id: str, date: date, status: bool,
                      event_time: datetime, error_code: int, logger) -> None:
-    cursor = connection.cursor()
     try:
-        if status:  # insert a new up_time event
-            new_id = str(uuid.uuid4())
-            cursor.execute("""
-                INSERT INTO stream_quality (event_id, location_id, date, up_time, response_code) VALUES
-                 (%s, %s, %s, %s, %s);
-            """, (new_id, location_id, date, event_time, error_code, ))
-            connection.commit()
-            logger.info(f"Inserted new up_time: {event_time} for new ID : {new_id}")
-        else:  # update an existing up_time event's down_time
-            cursor.execute("""
-                SELECT event_id FROM stream_quality
-                WHERE location_id = %s
-                ORDER BY up_time DESC
-                LIMIT 1;
-            """, (location_id, ))
-            old_id = cursor.fetchone()[0]
-            cursor.execute("""
-                UPDATE stream_quality SET down_time = %s, response_code=%s WHERE event_id = %s;
-            """, (event_time, error_code, old_id, ))
-            connection.commit()
-            logger.info(f"Updated down_time: {event_time} for old ID: {old_id}")
+        with db_cursor(commit=True) as cursor:
+            if status:  # insert a new up_time event
+                new_id = str(uuid.uuid4())
+                cursor.execute("""
+                    INSERT INTO stream_quality (event_id, location_id, date, up_time, response_code) VALUES
+                     (%s, %s, %s, %s, %s);
+                """, (new_id, location_id, date, event_time, error_code, ))
+                logger.info(f"Inserted new up_time: {event_time} for new ID : {new_id}")
+            else:  # update an existing up_time event's down_time
+                cursor.execute("""
+                    SELECT event_id FROM stream_quality
+                    WHERE location_id = %s
+                    ORDER BY up_time DESC
+                    LIMIT 1;
+                """, (location_id, ))
+                old_id = cursor.fetchone()[0]
+                cursor.execute("""
+                    UPDATE stream_quality SET down_time = %s, response_code=%s WHERE event_id = %s;
+                """, (event_time, error_code, old_id, ))
+                logger.info(f"Updated down_time: {event_time} for old ID: {old_id}")
     except Exception as e:
         logger.error(f"DBWrite Exception occurred.", exc_info=True)
         raise e
 
 
-def resume_count(connection, location_id: str, date: Date, hour: int, quarter: int, vehicle_counts: dict[int, int]) -> None:
-    cursor = connection.cursor()
-    for i in range(6):
-        source_id = f"{location_id}_{date}_{hour}_{quarter}_{class_names[i]}"
-        cursor.execute("SELECT count FROM vehicle_counts WHERE source_id = %s", (source_id,))
-        result = cursor.fetchone()
-        if result:
-            vehicle_counts[i] = result[0] if result[0] > 0 else 0
-        else:
-            vehicle_counts[i] = 0
-    update_main_db(connection, location_id, date, hour, quarter, vehicle_counts)
+def resume_count(location_id: str, date: Date, hour: int, quarter: int, vehicle_counts: dict[int, int]) -> None:
+    with db_cursor(commit=True) as cursor:
+        cursor.execute("""
+            SELECT class_id, count FROM vehicle_counts_v2
+            WHERE location_id = %s AND date = %s AND hour = %s AND quarter = %s
+        """, (location_key(cursor, location_id), date, hour, quarter))
+        stored = dict(cursor.fetchall())
+        for class_id in class_names:
+            vehicle_counts[class_id] = stored.get(class_id, 0)
+        _upsert_counts(cursor, location_id, date, hour, quarter, vehicle_counts)
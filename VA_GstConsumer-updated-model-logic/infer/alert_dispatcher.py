@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import requests
+from multiprocessing import util
+from datetime import datetime
+from dotenv import load_dotenv
+from turbojpeg import TurboJPEG
+from requests.adapters import HTTPAdapter
+from utils.metrics import metrics
+from utils.log_setup import setup_logging
+from db.crud_mongo import push_to_incidents, incident_store
+
+load_dotenv()
+disc_webhoook_url = os.getenv("DISCORD_WEBHOOK_URL")
+save_location = os.getenv("INCIDENT_SAVE_LOCATION")
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", 64))  # incidents waiting for their side effects, per process
+ALERT_WORKERS = int(os.getenv("ALERT_WORKERS", 2))
+ALERT_MAX_RETRIES = int(os.getenv("ALERT_MAX_RETRIES", 5))  # attempts per step before the alert is dead-lettered
+ALERT_BACKOFF = float(os.getenv("ALERT_BACKOFF", 1.0))  # seconds before the first retry, doubled on each retry
+ALERT_MAX_BACKOFF = float(os.getenv("ALERT_MAX_BACKOFF", 30.0))
+ALERT_HTTP_TIMEOUT = float(os.getenv("ALERT_HTTP_TIMEOUT", 10.0))  # seconds
+ALERT_DEAD_LETTER = os.getenv("ALERT_DEAD_LETTER", os.path.join(save_location or '.', 'dead_letter.jsonl'))
+ALERT_CLOSE_TIMEOUT = 30  # seconds to drain pending alerts at exit
+
+setup_logging()
+logger = logging.getLogger(__name__)
+jpeg = TurboJPEG()
+
+
+class Alert:
+    """An incident whose image still has to be saved, posted to Discord and recorded in MongoDB."""
+
+    __slots__ = ('camera_name', 'name', 'timestamp', 'image', 'encoded', 'img_path', 'done', 'attempts')
+
+    def __init__(self, camera_name: str, name: str, timestamp: datetime, image, encoded: bytes = None):
+        self.camera_name = camera_name
+        self.name = name
+        self.timestamp = timestamp
+        self.encoded = bytes(encoded) if encoded is not None else None  # the JPEG as received, saved as is
+        self.image = image if encoded is None else None  # BGR frame, JPEG encoded by the worker when not received as one
+        self.img_path = None
+        self.done = set()  # steps that already succeeded, not repeated on retry
+        self.attempts = 0
+
+    def __repr__(self):
+        return f"Alert({self.name} at {self.camera_name}, {self.timestamp}, done={sorted(self.done)})"
+
+
+class AlertDispatcher:
+    """
+    Runs incident side effects (saving the frame, the Discord webhook, the MongoDB insert) on background
+    workers so frame processing never waits on disk or network I/O.
+
+    `submit` only puts the alert on a bounded queue. A worker runs the steps in order and retries a failing
+    step with exponential backoff, without repeating the steps that already succeeded. Alerts that still fail
+    after `max_retries` attempts, or that find the queue full, are appended to a JSON lines dead-letter file
+    with the saved image path when there is one, so they can be replayed by hand. Delivered alerts are then
+    handed to the incident store, which buffers the MongoDB inserts and retries them itself.
+    """
+
+    STEPS = ('save', 'discord')
+
+    def __init__(self, workers: int = ALERT_WORKERS, queue_size: int = ALERT_QUEUE_SIZE,
+                 max_retries: int = ALERT_MAX_RETRIES, backoff: float = ALERT_BACKOFF,
+                 max_backoff: float = ALERT_MAX_BACKOFF, dead_letter: str = ALERT_DEAD_LETTER):
+        self.max_retries = max(1, max_retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dead_letter = dead_letter
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._dead_letter_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.session = requests.Session()  # keeps the webhook connection alive between alerts
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers)))
+        self._workers = [
+            threading.Thread(target=self._run, name=f"AlertWorker-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, alert: Alert) -> bool:
+        """
+        Queue an alert without blocking.
+
+        Returns:
+            False if the queue was full and the alert went straight to the dead-letter file.
+        """
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            logger.error(f"Alert queue full, dead-lettering {alert}")
+            metrics.inc('alerts_dropped', alert.camera_name)
+            self._dead_letter(alert, 'queue full')
+            return False
+        metrics.inc('alerts_queued', alert.camera_name)
+        return True
+
+    def _run(self):
+        while True:
+            alert = self._queue.get()
+            try:
+                if alert is None:
+                    return
+                self._handle(alert)
+            except Exception:
+                logger.error(f"Alert worker failed on {alert}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def _handle(self, alert: Alert):
+        for step in self.STEPS:
+            if step in alert.done:
+                continue
+            delay = self.backoff
+            for attempt in range(1, self.max_retries + 1):
+                alert.attempts += 1
+                try:
+                    getattr(self, f'_{step}')(alert)
+                    alert.done.add(step)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries or self._stop.is_set():
+                        logger.error(f"{alert}: {step} failed {attempt} times, dead-lettering: {e}")
+                        metrics.inc('alerts_failed', alert.camera_name)
+                        self._dead_letter(alert, f'{step}: {e}')
+                        return
+                    logger.warning(f"{alert}: {step} failed ({e}), retrying in {delay:.1f} seconds...")
+                    self._stop.wait(delay)
+                    delay = min(self.max_backoff, delay * 2)
+        push_to_incidents(camera_name=alert.camera_name, timestamp=alert.timestamp, name=alert.name,
+                          img_path=alert.img_path)
+        alert.done.add('mongo')
+        metrics.inc('alerts_sent', alert.camera_name)
+        logger.info(f"{alert.name} alert for {alert.camera_name} at {alert.timestamp} delivered")
+
+    def _save(self, alert: Alert):
+        """Frame as JPEG in the incident directory of its capture date, the received bytes when there are any."""
+        day_dir = os.path.join(save_location, alert.timestamp.strftime("%d %B %Y"))
+        os.makedirs(day_dir, exist_ok=True)
+        img_path = os.path.join(day_dir, f'{alert.timestamp.strftime("%H_%M_%S")}_{alert.camera_name}_{alert.name}.jpg')
+        with open(img_path, 'wb') as f:
+            f.write(alert.encoded if alert.encoded is not None else jpeg.encode(alert.image))
+        alert.img_path = img_path
+        alert.image = alert.encoded = None
+
+    def _discord(self, alert: Alert):
+        if not disc_webhoook_url:
+            return
+        payload = {"content": f"{alert.name} detected at {alert.camera_name} at {alert.timestamp}"}
+        with open(alert.img_path, 'rb') as f:
+            files = {'payload_json': (None, json.dumps(payload)), 'media': (os.path.basename(alert.img_path), f)}
+            response = self.session.post(disc_webhoook_url, files=files, timeout=ALERT_HTTP_TIMEOUT)
+        response.raise_for_status()
+
+    def _dead_letter(self, alert: Alert, reason: str):
+        record = {
+            'camera_name': alert.camera_name,
+            'name': alert.name,
+            'timestamp': str(alert.timestamp),
+            'img_path': alert.img_path,
+            'done': sorted(alert.done),
+            'reason': reason,
+            'failed_at': str(datetime.now()),
+        }
+        try:
+            with self._dead_letter_lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter)), exist_ok=True)
+                with open(self.dead_letter, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+        except OSError:
+            logger.error(f"Could not write dead letter for {alert}: {record}", exc_info=True)
+
+    def close(self, timeout: float = ALERT_CLOSE_TIMEOUT):
+        """Give queued alerts up to `timeout` seconds, then stop retrying and dead-letter what is left."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self._stop.set()
+        while True:
+            try:
+                alert = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if alert is not None:
+                self._dead_letter(alert, 'shutdown')
+            self._queue.task_done()
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        self.session.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> AlertDispatcher:
+    """
+    The process wide dispatcher, started on first use and drained at exit, also of multiprocessing children
+    which skip atexit.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            incident_store()
+            _dispatcher = AlertDispatcher()
+            util.Finalize(_dispatcher, _dispatcher.close, exitpriority=20)  # before the incident store is flushed
+        return _dispatcher
@@ -1,40 +1,65 @@
 import os
+import json
+import time
 import pika
-import torch
 import logging
 import functools
-from ultralytics import YOLO
 from dotenv import load_dotenv
 from turbojpeg import TurboJPEG
+from utils.metrics import metrics
 from utils.utilities import init_logger
+from utils.frame_ring import SharedFrameReader
+from utils.frame_envelope import envelopes_from_message, SequenceTracker, EnvelopeError, CODEC_SHM, unpack_shm_descriptor
+from utils.queue_policy import QueuePolicy, QUEUE_DECLARE
+from utils.log_setup import setup_logging, FrameLog
+from infer.frame_pipeline import FramePipeline, CONSUMER_MODE, CONSUMER_PREFETCH
+from infer.load_shedder import LoadShedder, CONGESTION_MAX_STRIDE
 from datetime import datetime, timedelta
-from infer.vehicle_tracker import VehicleTracker
+from infer.vehicle_tracker import VehicleTracker, ArrayVehicleTracker
 from pika.exceptions import AMQPConnectionError
 from pika.adapters.asyncio_connection import AsyncioConnection
-from db.crud_sql import update_main_db, resume_count, get_db_connection
+from db.count_store import VehicleCountStore
+from db.crud_sql import resume_count, class_names
 
 load_dotenv()
 LOG_FOLDER = os.getenv('CONGESTION_LOG_FOLDER')
 MODEL_PATH = os.getenv('CONGESTION_MODEL_PATH')
+TRACKER_ENGINE = os.getenv('TRACKER_ENGINE', 'dict')  # 'dict': VehicleTracker, 'array': ArrayVehicleTracker
+COUNTS_EXCHANGE = os.getenv('COUNTS_EXCHANGE', 'vehicle_counts')  # fanout exchange for live dashboards, empty disables
 STREAM_STATUS = None
 tracker_type: str = "bytetrack.yaml"
 confidence: float = 0.3
 iou: float = 0.8
 buffer_size: int = 25
-date_format = "%Y-%m-%d %H:%M:%S.%f"
 jpeg = TurboJPEG()
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = YOLO(MODEL_PATH).to(device)
+model = None  # loaded on first local inference, never in processes served by an inference server
 vc_dict = None
 msg_count = 0
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
+def get_model():
+    global model
+    if model is None:
+        import torch
+        from ultralytics import YOLO
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model = YOLO(MODEL_PATH).to(device)
+    return model
+
+
+def new_tracker(vehicle_counts):
+    if TRACKER_ENGINE == 'array':
+        return ArrayVehicleTracker(max_frames_absent=10, vehicle_counts=vehicle_counts)
+    return VehicleTracker(max_frames_absent=10, vehicle_counts=vehicle_counts)
+
+
 class RTSPFrameConsumer:
 
     def __init__(self, amqp_url, location, vehicle_counts, main_logger,
-                 streams_log_dir=f'{LOG_FOLDER}/streams', frames_log_dir=f'{LOG_FOLDER}/frames'):
+                 streams_log_dir=f'{LOG_FOLDER}/streams', frames_log_dir=f'{LOG_FOLDER}/frames',
+                 inference_client=None, queue_policy=None):
 
         self.should_reconnect = False
         self.was_consuming = False
@@ -44,7 +69,12 @@ class RTSPFrameConsumer:
         self._consumer_tag = None
         self._url = amqp_url
         self._consuming = False
-        self._prefetch_count = 0
+        self.queue_policy = queue_policy or QueuePolicy()  # the camera's own, see `load_policies`
+        self._prefetch_count = CONSUMER_PREFETCH if CONSUMER_MODE == 'pipelined' else 0
+        if self.queue_policy.queue_type == 'stream':  # streams refuse unlimited prefetch
+            self._prefetch_count = self._prefetch_count or CONSUMER_PREFETCH
+        self._pipeline = None
+        self.shedder = LoadShedder(location, max_stride=CONGESTION_MAX_STRIDE)
         self.queue_name = location
         self.ml = main_logger
 
@@ -52,13 +82,18 @@ class RTSPFrameConsumer:
         self.stream_start_time = None
         self.previous_ts = None
         self.previous_quarter = None
-        self.db_connection = None
+        self.count_store = None
 
         self.tracker = None
         self.vehicle_count = vehicle_counts
+        self.inference_client = inference_client  # InferenceClient when a shared inference server is used
+
+        self.frame_reader = SharedFrameReader()  # raw frames from a producer on the same host
+        self.sequence = SequenceTracker()
 
         # logging Setup
         self.stream_logger = init_logger(streams_log_dir, self.queue_name, type='stream')
+        self.frame_log = FrameLog(self.stream_logger, self.queue_name)
         # self.frame_logger = init_logger(frames_log_dir, self.queue_name, type='frames')
         # os.makedirs(f'frames/{self.queue_name}', exist_ok=True)
 
@@ -106,8 +141,9 @@ class RTSPFrameConsumer:
         self.stream_logger.info('Channel opened')
         self._channel = channel
         self.add_on_channel_close_callback()
-
-        self._channel.basic_qos(prefetch_count=self._prefetch_count, callback=self.on_basic_qos_ok)
+        if COUNTS_EXCHANGE:
+            self._channel.exchange_declare(exchange=COUNTS_EXCHANGE, exchange_type='fanout', durable=False)
+        self.declare_queue()
 
     def add_on_channel_close_callback(self):
         self.stream_logger.info('Adding channel close callback')
@@ -117,6 +153,20 @@ class RTSPFrameConsumer:
         self.ml.warning('Channel %i was closed: %s', channel, reason)
         self.close_connection()
 
+    def declare_queue(self):
+        """
+        The producer owns the queue arguments, so by default only check the queue exists. With
+        QUEUE_DECLARE=policy the queue is declared from the environment's policy, which has to match
+        the producer's or the broker closes the channel.
+        """
+        passive = QUEUE_DECLARE != 'policy'
+        self.stream_logger.info(f"Declaring queue {'passively' if passive else f'with {self.queue_policy}'}")
+        self._channel.queue_declare(queue=self.queue_name, callback=self.on_queue_declareok,
+                                    **self.queue_policy.declare_kwargs(passive=passive))
+
+    def on_queue_declareok(self, _unused_frame):
+        self._channel.basic_qos(prefetch_count=self._prefetch_count, callback=self.on_basic_qos_ok)
+
     def on_basic_qos_ok(self, _unused_frame):
         self.stream_logger.info('QOS set to: %d', self._prefetch_count)
         self.start_consuming()
@@ -125,7 +175,10 @@ class RTSPFrameConsumer:
         self.stream_logger.info('Issuing consumer related RPC commands')
         self.add_on_cancel_callback()
         self._consumer_tag = self._channel.basic_consume(
-            self.queue_name, self.on_message, auto_ack=False)
+            self.queue_name, self.on_message, auto_ack=False, arguments=self.queue_policy.consume_arguments())
+        if CONSUMER_MODE == 'pipelined':
+            self._pipeline = FramePipeline(self._connection.ioloop, self.read_frames, self.process_frames, self.ack,
+                                           self.queue_name, prefetch=self._prefetch_count)
         self.was_consuming = True
         self._consuming = True
 
@@ -139,33 +192,81 @@ class RTSPFrameConsumer:
         if self._channel:
             self._channel.close()
 
-    def update_tracker(self, results):
+    def track(self, frame):
+        """
+        Run detection + tracking on a frame as returned by `read_frame`, either on the shared inference server
+        or the local model.
+
+        Returns:
+            (tracking_ids, classes), both None when nothing is tracked in the frame. None instead when the
+            server found the frame's shared memory slot already reused.
+        """
+        if self.inference_client is not None:
+            return self.inference_client.track(frame)
+
+        results = get_model().track(frame, persist=True, conf=confidence, iou=iou)[0]
         if hasattr(results, 'boxes') and results.boxes is not None:
-            tracking_ids = getattr(results.boxes, 'id', None)
-            classes = getattr(results.boxes, 'cls', None)
-            if tracking_ids is not None and classes is not None:
-                self.tracker.update(tracking_ids, classes)
+            return getattr(results.boxes, 'id', None), getattr(results.boxes, 'cls', None)
+        return None, None
+
+    def track_many(self, frames):
+        """
+        Track consecutive frames of this stream. The inference server gets them in one request so they
+        batch together; the local model has to see them one by one since its tracker persists between calls.
+        """
+        if self.inference_client is not None:
+            return self.inference_client.track_many(frames)
+        return [self.track(frame) for frame in frames]
+
+    def update_tracker(self, tracking_ids, classes):
+        if tracking_ids is not None and classes is not None and len(tracking_ids) > 0:
+            self.tracker.update(tracking_ids, classes)
         return self.tracker.get_class_counts(out_type='dct')
 
-    def setup_attributes(self, properties):
-        if properties.headers['resume'] is not None:  # implement stream quality check code
+    def setup_attributes(self, envelope):
+        if envelope.resume:  # implement stream quality check code
             self.stream_logger.info(f"Stream was offline, fetching latest counts.")
         else:
-            self.stream_logger.info(f"Starting processing with frame TS: {properties.headers['timestamp']}")
-        self.stream_start_time = datetime.strptime(properties.headers['timestamp'], date_format)
+            self.stream_logger.info(f"Starting processing with frame TS: {envelope.timestamp}")
+        self.stream_start_time = envelope.timestamp
         self.current_date = self.stream_start_time.date()
         self.previous_ts = self.stream_start_time
         self.previous_quarter: int = int((self.previous_ts.minute / 15) + 1)
-        self.db_connection = get_db_connection()
+        if self.count_store is not None:
+            self.count_store.close()
         self.vehicle_count: dict[int, int] = {key: 0 for key in range(7)}
-        resume_count(self.db_connection, self.queue_name, self.stream_start_time.date(),
+        resume_count(self.queue_name, self.stream_start_time.date(),
                      self.stream_start_time.hour, int((self.stream_start_time.minute / 15) + 1), self.vehicle_count)
+        self.count_store = VehicleCountStore(self.queue_name, on_flush=self.publish_counts if COUNTS_EXCHANGE else None)
         self.stream_logger.info(f"{self.queue_name}: Fetched latest count: {self.vehicle_count}")
-        self.tracker = VehicleTracker(max_frames_absent=10, vehicle_counts=self.vehicle_count)
+        self.tracker = new_tracker(self.vehicle_count)
+
+    def publish_counts(self, location_id, date, hour, quarter, counts):
+        """
+        Send a quarter's counts to the live dashboards. These are the quarter's totals so far, so a lost or
+        repeated message is corrected by the next one. Scheduled on the ioloop, flushes may happen on the
+        processing thread and pika is not thread safe.
+        """
+        body = json.dumps({
+            'location_id': location_id, 'date': str(date), 'hour': hour, 'quarter': quarter,
+            'counts': {name: counts.get(class_id, 0) for class_id, name in class_names.items()},
+        })
+
+        def publish():
+            if self._channel is not None and self._channel.is_open:
+                self._channel.basic_publish(exchange=COUNTS_EXCHANGE, routing_key='', body=body,
+                                            properties=pika.BasicProperties(content_type='application/json',
+                                                                            delivery_mode=1))
+
+        try:
+            self._connection.ioloop.call_soon_threadsafe(publish)
+        except RuntimeError:  # ioloop already closed while stopping
+            pass
 
     def change_quarter(self, curr_ts, curr_quarter):
-        update_main_db(self.db_connection, self.queue_name, self.previous_ts.date(), self.previous_ts.hour,
-                       self.previous_quarter, self.vehicle_count)  # update counts from first frame of next quarter
+        self.count_store.update(self.previous_ts.date(), self.previous_ts.hour,
+                                self.previous_quarter, self.vehicle_count)  # counts from first frame of next quarter
+        self.count_store.flush()
         counts = {self.tracker.mapping[k]: v for k, v in self.tracker.class_counts.items()
                   if self.tracker.mapping[k] not in ['rider', 'person']}
         self.stream_logger.info(f"Finished Hour: {self.previous_ts.hour} | Quarter: {self.previous_quarter} | "
@@ -173,48 +274,125 @@ class RTSPFrameConsumer:
         self.previous_ts = curr_ts
         self.previous_quarter = curr_quarter
         self.vehicle_count = {key: 0 for key in range(7)}
-        self.tracker = VehicleTracker(max_frames_absent=10, vehicle_counts=self.vehicle_count)
+        self.tracker = new_tracker(self.vehicle_count)
+
+    def open_envelopes(self, properties, body):
+        """
+        Parse a delivery's frame envelopes (several when the producer batches frames) and account for
+        frames lost or reordered on the way. Returns an empty list for messages that cannot be parsed.
+        """
+        try:
+            envelopes = envelopes_from_message(properties, body, self.queue_name)
+        except EnvelopeError as e:
+            self.stream_logger.warning(f"Dropping message: {e}")
+            metrics.inc('frames_corrupt', self.queue_name)
+            return []
+        for envelope in envelopes:
+            missing = self.sequence.observe(envelope)
+            if missing > 0:
+                metrics.inc('frames_lost', self.queue_name, missing)
+                self.stream_logger.warning(f"{missing} frames lost before frame {envelope.seq}")
+            elif missing < 0:
+                metrics.inc('frames_reordered', self.queue_name)
+                self.stream_logger.warning(f"Frame {envelope.seq} arrived out of order")
+        return envelopes
 
     def on_message(self, _unused_channel, _basic_deliver, properties, body):
+        # resume frames re-initialise the counts and must never be dropped
+        envelopes = [envelope for envelope in self.open_envelopes(properties, body)
+                     if envelope.resume or self.shedder.should_process(envelope.timestamp)]
+        if not envelopes:
+            if self._pipeline is not None:
+                self._pipeline.skip(_basic_deliver.delivery_tag)
+            else:
+                self._channel.basic_ack(_basic_deliver.delivery_tag)
+            return
+
+        if self._pipeline is not None:
+            self._pipeline.submit(_basic_deliver.delivery_tag, envelopes)
+            return
+
+        self.process_frames(envelopes, self.read_frames(envelopes))
+        with metrics.timer('ack', self.queue_name):
+            self._channel.basic_ack(_basic_deliver.delivery_tag)
+
+    def ack(self, delivery_tag, multiple=False):
+        if self._channel and self._channel.is_open:
+            with metrics.timer('ack', self.queue_name):
+                self._channel.basic_ack(delivery_tag, multiple=multiple)
+
+    def process_frames(self, envelopes, frames):
+        """Track the frames of one delivery as a batch, then count them in capture order."""
+        decoded = [(envelope, frame) for envelope, frame in zip(envelopes, frames) if frame is not None]
+        if not decoded:
+            return
+        start = time.perf_counter()
+        tracks = self.track_many([frame for _, frame in decoded])
+        inference_time = (time.perf_counter() - start) / len(decoded)
+        for (envelope, _), result in zip(decoded, tracks):
+            if result is None:
+                self.stream_logger.warning(f"Frame {envelope.seq} could not be read or inferred by the inference server, skipping")
+                metrics.inc('frames_stale', self.queue_name)
+                continue
+            metrics.observe('inference', self.queue_name, inference_time)
+            self.process_frame(envelope, *result)
+
+    def process_frame(self, envelope, tracking_ids, classes):
 
         global vc_dict, msg_count
         msg_count += 1
-        if msg_count == 1 or properties.headers['resume'] is not None:
-            self.setup_attributes(properties)
+        if msg_count == 1 or envelope.resume:
+            self.setup_attributes(envelope)
 
-        frame = jpeg.decode(body)
-        current_ts = datetime.strptime(properties.headers['timestamp'], date_format)
+        current_ts = envelope.timestamp
+        metrics.observe('queue_wait', self.queue_name, (datetime.now() - current_ts).total_seconds())
 
         current_quarter: int = int((current_ts.minute / 15) + 1)
-        results = model.track(frame, persist=True, conf=0.3, iou=0.8)[0]
-        self.vehicle_count = self.update_tracker(results)
-
-        if current_quarter != self.previous_quarter:
-            self.change_quarter(current_ts, current_quarter)
+        with metrics.timer('tracker', self.queue_name):
+            self.vehicle_count = self.update_tracker(tracking_ids, classes)
 
-        update_main_db(self.db_connection, self.queue_name, current_ts.date(), current_ts.hour,
-                       current_quarter, self.vehicle_count)
+        with metrics.timer('db_write', self.queue_name):
+            if current_quarter != self.previous_quarter:
+                self.change_quarter(current_ts, current_quarter)
+            self.count_store.update(current_ts.date(), current_ts.hour, current_quarter, self.vehicle_count)
         vc_dict = self.vehicle_count
 
         if timedelta(days=1) <= (current_ts.date() - self.current_date):
             self.current_date = current_ts.date()
-            self.stream_logger.info("End of the day")
-            if self.stream_logger.hasHandlers():
-                for handler in self.stream_logger.handlers[:]:
-                    handler.close()
-                    self.stream_logger.removeHandler(handler)
-            self.stream_logger = init_logger(r"logs/stream_logs", self.queue_name, 'stream')
-            self.stream_logger.info("Started inferencing for next day")
-
-        self._channel.basic_ack(_basic_deliver.delivery_tag)
-
-        # self.frame_logger.info(f"Processed {msg_count} | TS: {properties.headers['timestamp']} | "
-        #                        f"Resume: {properties.headers['resume']} | Counts: {self.vehicle_count}"
+            self.stream_logger.info("End of the day, started inferencing for next day")
+
+        metrics.inc('frames_processed', self.queue_name)
+
+        # self.frame_logger.info(f"Processed {msg_count} | TS: {envelope.timestamp} | "
+        #                        f"Resume: {envelope.resume} | Counts: {self.vehicle_count}"
         #                        )
 
-        logger.info(f"Processed {msg_count} | TS: {properties.headers['timestamp']} | "
-                    f"Resume: {properties.headers['resume']} | Counts: {self.vehicle_count}"
-                    )
+        self.frame_log("Processed %d | TS: %s | Resume: %s | Counts: %s", msg_count, envelope.timestamp,
+                       envelope.resume, self.vehicle_count, force=bool(envelope.resume))
+
+    def read_frames(self, envelopes):
+        return [self.read_frame(envelope) for envelope in envelopes]
+
+    def read_frame(self, envelope):
+        """
+        Decode an envelope into a BGR frame. Returns None when its shared memory slot was already reused.
+        With an inference server the frame is left for the server to decode, only the JPEG bytes or the slot
+        descriptor go through its request queue instead of the whole decoded frame.
+        """
+        if self.inference_client is not None:
+            if envelope.codec == CODEC_SHM:
+                return unpack_shm_descriptor(envelope.payload)
+            return bytes(envelope.payload)
+        if envelope.codec == CODEC_SHM:
+            descriptor = unpack_shm_descriptor(envelope.payload)
+            with metrics.timer('shm_read', self.queue_name):
+                frame = self.frame_reader.read(descriptor)
+            if frame is None:
+                self.stream_logger.warning(f"Frame slot {descriptor['slot']} was overwritten or its ring is gone, skipping")
+                metrics.inc('frames_stale', self.queue_name)
+            return frame
+        with metrics.timer('jpeg_decode', self.queue_name):
+            return jpeg.decode(envelope.payload)
 
     def stop_consuming(self):
         if self._channel:
@@ -247,6 +425,15 @@ class RTSPFrameConsumer:
         if not self._closing:
             self._closing = True
             self.stream_logger.info(f'Stopping')
+            if self._pipeline is not None:
+                self._pipeline.close()
+                self._pipeline = None
+            self.frame_reader.close()
+            if self.count_store is not None:
+                try:
+                    self.count_store.close()
+                except Exception:
+                    self.stream_logger.error("Could not flush vehicle counts on shutdown", exc_info=True)
             if self._consuming:
                 self.stop_consuming()
                 self._connection.ioloop.run_forever()
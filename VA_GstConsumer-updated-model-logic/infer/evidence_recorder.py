@@ -0,0 +1,159 @@
+import os
+import queue
+import struct
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from utils.metrics import metrics
+from utils.log_setup import setup_logging
+
+load_dotenv()
+save_location = os.getenv("INCIDENT_SAVE_LOCATION")
+EVIDENCE_CLIPS = os.getenv("EVIDENCE_CLIPS", 'true').lower() == 'true'
+EVIDENCE_PRE_ROLL = float(os.getenv("EVIDENCE_PRE_ROLL", 5))  # seconds of frames before the trigger
+EVIDENCE_POST_ROLL = float(os.getenv("EVIDENCE_POST_ROLL", 5))  # seconds of frames after the trigger
+EVIDENCE_MAX_MB = int(os.getenv("EVIDENCE_MAX_MB", 64))  # JPEG bytes kept in memory per stream
+EVIDENCE_QUEUE_SIZE = 8  # clips waiting to be written, per stream
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+
+def _chunk(fourcc: bytes, data: bytes) -> bytes:
+    return fourcc + struct.pack('<I', len(data)) + data + (b'\0' if len(data) % 2 else b'')
+
+
+def _list(fourcc: bytes, *chunks: bytes) -> bytes:
+    return _chunk(b'LIST', fourcc + b''.join(chunks))
+
+
+def write_mjpeg_avi(path: str, frames: list, fps: float, width: int, height: int) -> None:
+    """
+    Write JPEG images unchanged as the frames of an MJPEG AVI, which any player opens, no re-encoding.
+    Written to a temporary name and renamed, so a half written clip is never left under `path`.
+    """
+    fps = max(fps, 0.1)
+    rate, scale = int(round(fps * 1000)), 1000
+    max_frame = max(len(frame) for frame in frames)
+
+    avih = struct.pack('<14I', int(round(1e6 / fps)), int(max_frame * fps), 0, AVIF_HASINDEX, len(frames), 0, 1,
+                       max_frame, width, height, 0, 0, 0, 0)
+    strh = struct.pack('<4s4sIHHIIIIIIIIhhhh', b'vids', b'MJPG', 0, 0, 0, 0, scale, rate, 0, len(frames),
+                       max_frame, 0xFFFFFFFF, 0, 0, 0, width, height)
+    strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+    hdrl = _list(b'hdrl', _chunk(b'avih', avih), _list(b'strl', _chunk(b'strh', strh), _chunk(b'strf', strf)))
+
+    index, offset = [], 4  # idx1 offsets count from the 'movi' fourcc
+    for frame in frames:
+        index.append(struct.pack('<4sIII', b'00dc', AVIIF_KEYFRAME, offset, len(frame)))
+        offset += 8 + len(frame) + len(frame) % 2
+    movi_size = offset
+    riff_size = 4 + len(hdrl) + 8 + movi_size + 8 + 16 * len(frames)
+
+    tmp_path = f'{path}.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', riff_size) + b'AVI ')
+        f.write(hdrl)
+        f.write(b'LIST' + struct.pack('<I', movi_size) + b'movi')
+        for frame in frames:
+            f.write(b'00dc' + struct.pack('<I', len(frame)))
+            f.write(frame)
+            if len(frame) % 2:
+                f.write(b'\0')
+        f.write(b'idx1' + struct.pack('<I', 16 * len(frames)))
+        f.write(b''.join(index))
+    os.replace(tmp_path, path)
+
+
+class EvidenceRecorder:
+    """
+    Keeps the JPEG bodies a stream receives, as they came off the wire, for the last `pre_roll + post_roll`
+    seconds of capture time (at most `max_bytes`). `trigger` marks an incident; once frames `post_roll`
+    seconds past it arrived, the frames around it are written as one MJPEG AVI clip by a background thread.
+    Frames from shared memory transport carry no JPEG and are not kept.
+    """
+
+    def __init__(self, camera_name: str, pre_roll: float = EVIDENCE_PRE_ROLL, post_roll: float = EVIDENCE_POST_ROLL,
+                 max_bytes: int = EVIDENCE_MAX_MB * 1024 * 1024):
+        self.camera_name = camera_name
+        self.pre_roll = timedelta(seconds=pre_roll)
+        self.post_roll = timedelta(seconds=post_roll)
+        self.max_bytes = max_bytes
+        self._frames = deque()  # (timestamp, jpeg bytes, width, height), oldest first
+        self._bytes = 0
+        self._pending = []  # (name, trigger timestamp) waiting for their post-roll
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=EVIDENCE_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name=f"Evidence-{camera_name}", daemon=True)
+        self._thread.start()
+
+    def add(self, timestamp: datetime, jpeg: bytes, width: int = 0, height: int = 0) -> None:
+        if isinstance(jpeg, memoryview):
+            jpeg = bytes(jpeg)  # a view would keep its whole message body alive, all frames of a batch
+        with self._lock:
+            self._frames.append((timestamp, jpeg, width, height))
+            self._bytes += len(jpeg)
+            horizon = timestamp - self.pre_roll - self.post_roll
+            while self._frames and (self._frames[0][0] < horizon or self._bytes > self.max_bytes):
+                self._bytes -= len(self._frames.popleft()[1])
+            due = [clip for clip in self._pending if timestamp >= clip[1] + self.post_roll]
+            if due:
+                self._pending = [clip for clip in self._pending if clip not in due]
+        for name, trigger_ts in due:
+            self._cut(name, trigger_ts)
+
+    def trigger(self, name: str, timestamp: datetime) -> None:
+        """Record a clip around `timestamp` once its post-roll has been received."""
+        with self._lock:
+            self._pending.append((name, timestamp))
+
+    def _cut(self, name: str, trigger_ts: datetime) -> None:
+        with self._lock:
+            frames = [frame for frame in self._frames
+                      if trigger_ts - self.pre_roll <= frame[0] <= trigger_ts + self.post_roll]
+        if not frames:
+            logger.warning(f"{self.camera_name}: No frames kept around the {name} at {trigger_ts}, no clip written")
+            return
+        try:
+            self._queue.put_nowait((name, trigger_ts, frames))
+        except queue.Full:
+            logger.error(f"{self.camera_name}: Clip writer busy, {name} clip at {trigger_ts} dropped")
+            metrics.inc('clips_dropped', self.camera_name)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            name, trigger_ts, frames = item
+            try:
+                self._write(name, trigger_ts, frames)
+            except Exception:
+                logger.error(f"{self.camera_name}: Could not write {name} clip at {trigger_ts}", exc_info=True)
+                metrics.inc('clips_failed', self.camera_name)
+
+    def _write(self, name: str, trigger_ts: datetime, frames: list) -> None:
+        day_dir = os.path.join(save_location, trigger_ts.strftime("%d %B %Y"))
+        os.makedirs(day_dir, exist_ok=True)
+        path = os.path.join(day_dir, f'{trigger_ts.strftime("%H_%M_%S")}_{self.camera_name}_{name}.avi')
+        duration = (frames[-1][0] - frames[0][0]).total_seconds()
+        fps = (len(frames) - 1) / duration if duration > 0 else 1.0
+        width, height = next(((w, h) for _, _, w, h in frames if w and h), (0, 0))
+        with metrics.timer('clip_write', self.camera_name):
+            write_mjpeg_avi(path, [jpeg for _, jpeg, _, _ in frames], fps, width, height)
+        metrics.inc('clips_written', self.camera_name)
+        logger.info(f"{self.camera_name}: {name} clip with {len(frames)} frames ({duration:.1f} s) saved to {path}")
+
+    def close(self) -> None:
+        """Write pending clips with the frames received so far and stop the writer."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for name, trigger_ts in pending:
+            self._cut(name, trigger_ts)
+        self._queue.put(None)
+        self._thread.join(timeout=30)
@@ -0,0 +1,100 @@
+import os
+import time
+import asyncio
+import logging
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from utils.log_setup import setup_logging
+
+load_dotenv()
+CONSUMER_MODE = os.getenv('CONSUMER_MODE', 'sync')  # 'sync': everything in on_message, 'pipelined': FramePipeline
+CONSUMER_PREFETCH = int(os.getenv('CONSUMER_PREFETCH', 32))
+DECODE_WORKERS = int(os.getenv('DECODE_WORKERS', 2))
+ACK_EVERY = int(os.getenv('ACK_EVERY', 8))
+ACK_INTERVAL = float(os.getenv('ACK_INTERVAL', 0.5))  # seconds
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class FramePipeline:
+    """
+    Pipelined replacement for doing decode, inference, bookkeeping and ack inside pika's `on_message`.
+
+    Deliveries are decoded in a thread pool as soon as they arrive, then processed strictly in delivery
+    order by a single worker thread (tracker and incident windows depend on frame order), so the
+    asyncio ioloop only schedules work and keeps serving heartbeats. Since frames complete in order,
+    acks are batched with `multiple=True` every `ack_every` frames or `ack_interval` seconds.
+
+    Backpressure comes from the channel's prefetch window: when processing falls behind, unacked
+    deliveries pile up to `prefetch` and the broker stops sending until acks go out.
+    """
+
+    def __init__(self, loop, decode, process, ack, queue_name: str, prefetch: int = CONSUMER_PREFETCH,
+                 decode_workers: int = DECODE_WORKERS, ack_every: int = ACK_EVERY,
+                 ack_interval: float = ACK_INTERVAL):
+        """
+        Args:
+            decode: `decode(envelopes) -> frames`, a frame may be None to drop it
+            process: `process(envelopes, frames)`, runs on the single processing thread
+            ack: `ack(delivery_tag, multiple)`, called on the ioloop
+        """
+        self._loop = loop
+        self._decode = decode
+        self._process = process
+        self._ack = ack
+        self.queue_name = queue_name
+        self.ack_every = max(1, min(ack_every, prefetch // 2))
+        self.ack_interval = ack_interval
+
+        self._decode_pool = ThreadPoolExecutor(decode_workers, thread_name_prefix=f"{queue_name}-decode")
+        self._process_pool = ThreadPoolExecutor(1, thread_name_prefix=f"{queue_name}-process")
+        self._queue: asyncio.Queue = asyncio.Queue()  # bounded by the prefetch window
+        self._last_done = None
+        self._unacked = 0
+        self._last_ack = time.monotonic()
+        self._task = loop.create_task(self._run())
+
+    def submit(self, delivery_tag, envelopes):
+        future = self._decode_pool.submit(self._decode, envelopes)
+        self._queue.put_nowait((delivery_tag, envelopes, future))
+
+    def skip(self, delivery_tag):
+        """Acknowledge a delivery in order without decoding or processing it."""
+        self._queue.put_nowait((delivery_tag, None, None))
+
+    async def _run(self):
+        while True:
+            try:
+                delivery_tag, envelopes, future = await asyncio.wait_for(self._queue.get(), self.ack_interval)
+            except asyncio.TimeoutError:
+                self.flush_acks()
+                continue
+
+            if future is not None:
+                try:
+                    frames = await asyncio.wrap_future(future)
+                    await self._loop.run_in_executor(self._process_pool, self._process, envelopes, frames)
+                except Exception:
+                    logger.error(f"{self.queue_name}: Delivery {delivery_tag} failed in pipeline", exc_info=True)
+
+            self._last_done = delivery_tag
+            self._unacked += 1
+            if self._unacked >= self.ack_every or time.monotonic() - self._last_ack >= self.ack_interval:
+                self.flush_acks()
+
+    def flush_acks(self):
+        if self._unacked:
+            self._ack(self._last_done, True)
+            self._unacked = 0
+        self._last_ack = time.monotonic()
+
+    def close(self):
+        """
+        Stop taking frames, wait for the frame being processed and ack everything that completed.
+        Deliveries still queued are left unacked and get redelivered by the broker.
+        """
+        self._task.cancel()
+        self._decode_pool.shutdown(wait=False, cancel_futures=True)
+        self._process_pool.shutdown(wait=True, cancel_futures=True)
+        self.flush_acks()
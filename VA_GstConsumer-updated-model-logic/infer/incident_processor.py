@@ -1,4 +1,5 @@
 import os
+import time
 import pika
 import torch
 import logging
@@ -6,11 +7,19 @@ import functools
 from ultralytics import YOLO
 from dotenv import load_dotenv
 from turbojpeg import TurboJPEG
+from utils.metrics import metrics
 from utils.utilities import init_logger
+from utils.frame_ring import SharedFrameReader
+from utils.frame_envelope import envelopes_from_message, SequenceTracker, EnvelopeError, CODEC_SHM, CODEC_JPEG, unpack_shm_descriptor
+from utils.queue_policy import QueuePolicy, QUEUE_DECLARE
+from utils.log_setup import setup_logging, FrameLog
+from infer.frame_pipeline import FramePipeline, CONSUMER_MODE, CONSUMER_PREFETCH
+from infer.load_shedder import LoadShedder, INCIDENT_MAX_STRIDE
 from datetime import datetime, timedelta
 from pika.exceptions import AMQPConnectionError
 from pika.adapters.asyncio_connection import AsyncioConnection
 from infer.incident_result_processor import SequentialDeque
+from infer.evidence_recorder import EvidenceRecorder, EVIDENCE_CLIPS
 
 
 load_dotenv()
@@ -25,14 +34,14 @@ jpeg = TurboJPEG()
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model = YOLO(MODEL_PATH).to(device)
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
 class RTSPFrameConsumer:
 
     def __init__(self, amqp_url, location, main_logger,
-                 streams_log_dir=f'{LOG_FOLDER}/streams', frames_log_dir=f'{LOG_FOLDER}/frames'):
+                 streams_log_dir=f'{LOG_FOLDER}/streams', frames_log_dir=f'{LOG_FOLDER}/frames', queue_policy=None):
 
         self.should_reconnect = False
         self.was_consuming = False
@@ -42,7 +51,13 @@ class RTSPFrameConsumer:
         self._consumer_tag = None
         self._url = amqp_url
         self._consuming = False
-        self._prefetch_count = 0
+        self.queue_policy = queue_policy or QueuePolicy()  # the camera's own, see `load_policies`
+        self._prefetch_count = CONSUMER_PREFETCH if CONSUMER_MODE == 'pipelined' else 0
+        if self.queue_policy.queue_type == 'stream':  # streams refuse unlimited prefetch
+            self._prefetch_count = self._prefetch_count or CONSUMER_PREFETCH
+        self._pipeline = None
+        self.shedder = LoadShedder(location, max_stride=INCIDENT_MAX_STRIDE,
+                                   keep_all=lambda: self.seque is not None and self.seque.escalated)
         self.queue_name = location
         self.ml = main_logger
         self.seque = None
@@ -50,8 +65,13 @@ class RTSPFrameConsumer:
         self.stream_start_time = None  # can be used while logging
         # self.db_connection = None  # pymongo connection
 
+        self.frame_reader = SharedFrameReader()  # raw frames from a producer on the same host
+        self.sequence = SequenceTracker()
+        self.evidence = EvidenceRecorder(location) if EVIDENCE_CLIPS else None  # recent JPEGs for incident clips
+
         # logging Setup
         self.stream_logger = init_logger(streams_log_dir, self.queue_name, type='stream')
+        self.frame_log = FrameLog(self.stream_logger, self.queue_name)
         # self.frame_logger = init_logger(frames_log_dir, self.queue_name, type='frames')
         # os.makedirs(f'frames/{self.queue_name}', exist_ok=True)
 
@@ -94,15 +114,14 @@ class RTSPFrameConsumer:
     def open_channel(self):
         self.stream_logger.info('Creating a new channel')
         self._connection.channel(on_open_callback=self.on_channel_open)
-        self.seque: SequentialDeque = SequentialDeque(camera_name = self.queue_name)
+        self.seque: SequentialDeque = SequentialDeque(camera_name = self.queue_name, evidence=self.evidence)
 
 
     def on_channel_open(self, channel):
         self.stream_logger.info('Channel opened')
         self._channel = channel
         self.add_on_channel_close_callback()
-
-        self._channel.basic_qos(prefetch_count=self._prefetch_count, callback=self.on_basic_qos_ok)
+        self.declare_queue()
 
     def add_on_channel_close_callback(self):
         self.stream_logger.info('Adding channel close callback')
@@ -113,6 +132,20 @@ class RTSPFrameConsumer:
         self.seque = None
         self.close_connection()
 
+    def declare_queue(self):
+        """
+        The producer owns the queue arguments, so by default only check the queue exists. With
+        QUEUE_DECLARE=policy the queue is declared from the environment's policy, which has to match
+        the producer's or the broker closes the channel.
+        """
+        passive = QUEUE_DECLARE != 'policy'
+        self.stream_logger.info(f"Declaring queue {'passively' if passive else f'with {self.queue_policy}'}")
+        self._channel.queue_declare(queue=self.queue_name, callback=self.on_queue_declareok,
+                                    **self.queue_policy.declare_kwargs(passive=passive))
+
+    def on_queue_declareok(self, _unused_frame):
+        self._channel.basic_qos(prefetch_count=self._prefetch_count, callback=self.on_basic_qos_ok)
+
     def on_basic_qos_ok(self, _unused_frame):
         self.stream_logger.info('QOS set to: %d', self._prefetch_count)
         self.start_consuming()
@@ -121,7 +154,10 @@ class RTSPFrameConsumer:
         self.stream_logger.info('Issuing consumer related RPC commands')
         self.add_on_cancel_callback()
         self._consumer_tag = self._channel.basic_consume(
-            self.queue_name, self.on_message, auto_ack=False)
+            self.queue_name, self.on_message, auto_ack=False, arguments=self.queue_policy.consume_arguments())
+        if CONSUMER_MODE == 'pipelined':
+            self._pipeline = FramePipeline(self._connection.ioloop, self.read_frames, self.process_frames, self.ack,
+                                           self.queue_name, prefetch=self._prefetch_count)
         self.was_consuming = True
         self._consuming = True
 
@@ -135,20 +171,110 @@ class RTSPFrameConsumer:
         if self._channel:
             self._channel.close()
 
+    def open_envelopes(self, properties, body):
+        """
+        Parse a delivery's frame envelopes (several when the producer batches frames) and account for
+        frames lost or reordered on the way. Returns an empty list for messages that cannot be parsed.
+        """
+        try:
+            envelopes = envelopes_from_message(properties, body, self.queue_name)
+        except EnvelopeError as e:
+            self.stream_logger.warning(f"Dropping message: {e}")
+            metrics.inc('frames_corrupt', self.queue_name)
+            return []
+        for envelope in envelopes:
+            missing = self.sequence.observe(envelope)
+            if missing > 0:
+                metrics.inc('frames_lost', self.queue_name, missing)
+                self.stream_logger.warning(f"{missing} frames lost before frame {envelope.seq}")
+            elif missing < 0:
+                metrics.inc('frames_reordered', self.queue_name)
+                self.stream_logger.warning(f"Frame {envelope.seq} arrived out of order")
+        return envelopes
+
     def on_message(self, _unused_channel, _basic_deliver, properties, body):
+        envelopes = self.open_envelopes(properties, body)
+        if self.evidence is not None:
+            # every received frame goes into the clip buffer, also those skipped by the idle rate
+            for envelope in envelopes:
+                if envelope.codec == CODEC_JPEG:
+                    self.evidence.add(envelope.timestamp, envelope.payload, envelope.width, envelope.height)
+        envelopes = [envelope for envelope in envelopes
+                     if self.sample(envelope) and self.shedder.should_process(envelope.timestamp)]
+        if not envelopes:
+            if self._pipeline is not None:
+                self._pipeline.skip(_basic_deliver.delivery_tag)
+            else:
+                self._channel.basic_ack(_basic_deliver.delivery_tag)
+            return
+
+        if self._pipeline is not None:
+            self._pipeline.submit(_basic_deliver.delivery_tag, envelopes)
+            return
+
+        self.process_frames(envelopes, self.read_frames(envelopes))
+        with metrics.timer('ack', self.queue_name):
+            self._channel.basic_ack(_basic_deliver.delivery_tag)
+
+    def ack(self, delivery_tag, multiple=False):
+        if self._channel and self._channel.is_open:
+            with metrics.timer('ack', self.queue_name):
+                self._channel.basic_ack(delivery_tag, multiple=multiple)
+
+    def sample(self, envelope) -> bool:
+        """Two-rate gate: quiet streams are inferred at the idle rate only, see `SequentialDeque`."""
+        if self.seque.wants_frame(envelope.timestamp):
+            return True
+        metrics.inc('frames_idle_skipped', self.queue_name)
+        return False
+
+    def process_frames(self, envelopes, images):
+        """Run the detector once over all frames of a delivery, then feed the results in capture order."""
+        decoded = [(envelope, image) for envelope, image in zip(envelopes, images) if image is not None]
+        if not decoded:
+            return
+        start = time.perf_counter()
+        results = model.predict([image for _, image in decoded])
+        inference_time = (time.perf_counter() - start) / len(decoded)
+        for (envelope, image), result in zip(decoded, results):
+            metrics.observe('inference', self.queue_name, inference_time)
+            self.process_frame(envelope, image, result)
+
+    def process_frame(self, envelope, image, result):
         global msg_count
-        image = jpeg.decode(body)
-        timestamp = datetime.strptime(properties.headers['timestamp'], "%Y-%m-%d %H:%M:%S.%f")
-        result = model.predict(image)
+        timestamp = envelope.timestamp
+        metrics.observe('queue_wait', self.queue_name, (datetime.now() - timestamp).total_seconds())
 
-        self.seque.process_result(result, timestamp, image)
+        with metrics.timer('incident_logic', self.queue_name):
+            if self.seque.update_rate(result, timestamp):
+                metrics.inc('incident_escalations', self.queue_name)
+            encoded = envelope.payload if envelope.codec == CODEC_JPEG else None  # shm frames were never JPEG
+            self.seque.process_result(result, timestamp, image, encoded)
 
         #-----------------------------------------------------------
 
-        self._channel.basic_ack(_basic_deliver.delivery_tag)
+        metrics.inc('frames_processed', self.queue_name)
         msg_count += 1
-        logger.info(f"Processed {msg_count} | TS: {properties.headers['timestamp']} | "
-                    f"Resume: {properties.headers['resume']}")
+        self.frame_log("Processed %d | TS: %s | Resume: %s", msg_count, timestamp, envelope.resume,
+                       force=bool(envelope.resume))
+
+    def read_frames(self, envelopes):
+        return [self.read_frame(envelope) for envelope in envelopes]
+
+    def read_frame(self, envelope):
+        """
+        Decode an envelope into a BGR frame. Returns None when its shared memory slot was already reused.
+        """
+        if envelope.codec == CODEC_SHM:
+            descriptor = unpack_shm_descriptor(envelope.payload)
+            with metrics.timer('shm_read', self.queue_name):
+                frame = self.frame_reader.read(descriptor)
+            if frame is None:
+                self.stream_logger.warning(f"Frame slot {descriptor['slot']} was overwritten or its ring is gone, skipping")
+                metrics.inc('frames_stale', self.queue_name)
+            return frame
+        with metrics.timer('jpeg_decode', self.queue_name):
+            return jpeg.decode(envelope.payload)
 
     def stop_consuming(self):
         if self._channel:
@@ -181,6 +307,12 @@ class RTSPFrameConsumer:
         if not self._closing:
             self._closing = True
             self.stream_logger.info(f'Stopping')
+            if self._pipeline is not None:
+                self._pipeline.close()
+                self._pipeline = None
+            self.frame_reader.close()
+            if self.evidence is not None:
+                self.evidence.close()
             if self._consuming:
                 self.stop_consuming()
                 self._connection.ioloop.run_forever()
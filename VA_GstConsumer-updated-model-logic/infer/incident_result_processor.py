@@ -1,26 +1,34 @@
 import os
-import uuid
-import base64
-import requests
 import datetime
 import logging
 
 from collections import deque
 from dotenv import load_dotenv
 from typing import Deque, Dict
-from db.crud_mongo import push_to_incidents
+from infer.alert_dispatcher import Alert, AlertDispatcher, get_dispatcher
+from infer.evidence_recorder import EvidenceRecorder
+from utils.log_setup import setup_logging
 
 load_dotenv()
-disc_webhoook_url = os.getenv("DISCORD_WEBHOOK_URL")
-save_location = os.getenv("INCIDENT_SAVE_LOCATION")
+INCIDENT_IDLE_FPS = float(os.getenv("INCIDENT_IDLE_FPS", 2.5))  # frames per second sampled while windows are quiet, 0: every frame
+INCIDENT_PRE_THRESHOLD = float(os.getenv("INCIDENT_PRE_THRESHOLD", 0.4))  # any incident confidence above this escalates to full rate
+INCIDENT_COOLDOWN = float(os.getenv("INCIDENT_COOLDOWN", 10))  # seconds of full rate after the last escalating frame
+INCIDENT_CLASSES = (3, 8, 9)  # accident, fire, fight
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 class SequentialDeque:
-    def __init__(self, camera_name: str, window_size: int = 25,threshold: float = 0.75, order: int = 25) -> None:
+    def __init__(self, camera_name: str, window_size: int = 25,threshold: float = 0.75, order: int = 25,
+                 idle_fps: float = INCIDENT_IDLE_FPS, pre_threshold: float = INCIDENT_PRE_THRESHOLD,
+                 cooldown: float = INCIDENT_COOLDOWN, dispatcher: AlertDispatcher = None,
+                 evidence: EvidenceRecorder = None) -> None:
         
-        ''''''
+        '''
+        Incident windows of one stream. Quiet streams are only sampled at `idle_fps`; a frame with any
+        incident class above `pre_threshold` escalates the stream to full rate until `cooldown` seconds
+        (capture time) after the last such frame and while any window still holds positive frames.
+        '''
         self.acc_pred_queue: Deque = deque(maxlen=window_size)  # The DeQue Window for observing the frames of accident (Consist of only flags)
         self.fire_pred_queue: Deque = deque(maxlen=window_size)  # The DeQue Window for observing the frames of fire (Consist of only flags)
         self.fight_pred_queue: Deque = deque(maxlen=window_size)  # The DeQue Window for observing the frames of fight (Consist of only flags)
@@ -36,105 +44,76 @@ class SequentialDeque:
         self.incident_counts: Dict[str, int] = {"acc": 0, "fire": 0, "fight": 0}  # No. of incidents detected
         self.incident_ts: Dict[str, str] = {"acc": None, "fire": None, "fight": None}  # Timestamp of latest detected incident
         # self.json_value: Dict = {}  # Dictionary for logging
-        self.currentDir: str = None  # Today's date directory
         self.camera_name: str = camera_name
-
-        start_folder = datetime.date.today().strftime("%d %B %Y")
-        init_day_dir = os.path.join(save_location, start_folder)
-        os.makedirs(init_day_dir, exist_ok=True)
-        self.currentDir = init_day_dir 
-
-
-    def capture_frame(self, image, timestamp) -> str:
+        self.dispatcher: AlertDispatcher = dispatcher or get_dispatcher()  # saves and sends incidents off the frame path
+        self.evidence: EvidenceRecorder = evidence  # writes a clip around each incident, None disables clips
+
+        self.idle_interval: float = 1 / idle_fps if idle_fps > 0 else 0  # seconds between sampled frames when quiet
+        self.pre_threshold: float = pre_threshold
+        self.cooldown: datetime.timedelta = datetime.timedelta(seconds=cooldown)
+        self.escalated_until: datetime.datetime = None  # capture time until which every frame is inferred
+        self.last_sampled: datetime.datetime = None  # capture time of the latest frame let through while quiet
+        self.latest_ts: datetime.datetime = None  # capture time of the latest frame offered
+
+
+    @property
+    def has_spike(self) -> bool:
+        """True while any incident window holds positive frames, i.e. an incident may be building up."""
+        return self.acc_frame_count > 0 or self.fire_frame_count > 0 or self.fight_frame_count > 0
+
+    @property
+    def escalated(self) -> bool:
+        """True while the stream runs at full rate."""
+        if self.has_spike:
+            return True
+        return self.escalated_until is not None and self.latest_ts is not None and self.latest_ts < self.escalated_until
+
+    def wants_frame(self, timestamp) -> bool:
         """
-        Captures the Current frame and saves to stream directory's current date folder.
+        Whether a frame captured at `timestamp` should be inferred: every frame while escalated, otherwise
+        one per `idle_interval`.
         """
-        self.ts.append(timestamp)
-        time_stamp = self.ts[-1].strftime("%H:%M:%S").replace(":", "_")
-        img_filename = os.path.join(self.currentDir, f'{time_stamp}_{uuid.uuid4()}')
-        # img_data = base64.b64decode(b64_image)
-        with open(img_filename, 'wb') as f:
-            f.write(image)
-            
-        loc = f'{img_filename}.jpg'
-        return loc
-
-
-    def send_discord_alert(self, img_path: str, incident_type: str) -> requests.models.Response:
-        """
-        Send alert to discord channel with image, metadata.
+        self.latest_ts = timestamp if self.latest_ts is None else max(self.latest_ts, timestamp)
+        if self.escalated or self.idle_interval <= 0:
+            return True
+        if self.last_sampled is None or (timestamp - self.last_sampled).total_seconds() >= self.idle_interval:
+            self.last_sampled = timestamp
+            return True
+        return False
+
+    def update_rate(self, result, timestamp) -> bool:
         """
-        files = {
-            'payload_json': (
-                None, 
-                f'{{"content": "{incident_type} detected at {self.camera_name} at {self.incident_ts[incident_type]}"}}'
-            ),
-            'media': open(img_path, 'rb')
-        }
-        response = requests.post(disc_webhoook_url, files = files)
-        return response
-    
-
-    @staticmethod
-    def get_b64(img_path: str) -> str:
-        ''' Returns the image encoded into base64 string '''
-        with open(img_path, "rb") as img_file:
-            encoded_string = base64.b64encode(img_file.read()).decode('utf-8')
-        
-        return encoded_string
-
+        Escalate to full rate when any incident class in `result` reaches the pre-threshold.
 
-    def notify_acc(self, image, timestamp) -> None:
+        Returns:
+            True if this frame switched the stream from the sampled to the full rate.
         """
-        Notify Accident as per logic in class definition. If the last 'order' no. of windows
-        have a time difference of less than limit seconds then, notify.
-        """
-        logger.info("====================!! Accident Detected !!====================")
-        img_path = self.capture_frame(image, timestamp)
-        self.incident_ts["acc"] = str(self.ts[-1])
-        r = self.send_discord_alert(img_path, "Accident")
-        if r.status_code == 200:
-            logger.info("Sent Accident alert to discord.")
-        else:
-            logger.info(f"!! Accident alert to discord failed. Response {r.status_code} !!")
-        push_to_incidents(date=self.incident_ts["acc"], name="Accident", img_path=img_path)
-        self.incident_counts["acc"] += 1
-
-
-    def notify_fire(self,image, timestamp) -> None:
-        """
-        Notify Fire as per logic in class definition. If the last 'order' no. of windows
-        have a time difference of less than limit seconds then, notify.
-        """
-        logger.info(f"====================!! Fire Detected !!====================")
-        img_path = self.capture_frame(image, timestamp)
-        self.incident_ts["fire"] = str(self.ts[-1])
-        r = self.send_discord_alert(img_path, "Fire")    
-        if r.status_code == 200:
-            logger.info("Sent Fire alert to discord.")
-        else:
-            logger.info(f"!! Fire alert to discord failed. Response {r.status_code} !!")
-        push_to_incidents(date=self.incident_ts["fire"], name="Fire", img_path=img_path)
-        self.incident_counts["fire"] += 1
-
-    def notify_fight(self,image, timestamp) -> None:
+        was_escalated = self.escalated
+        for box in result.boxes:
+            if int(box.cls) in INCIDENT_CLASSES and float(box.conf) >= self.pre_threshold:
+                self.escalated_until = timestamp + self.cooldown
+                if not was_escalated:
+                    logger.info(f"{self.camera_name}: Incident confidence {float(box.conf):.2f} at {timestamp}, "
+                                f"switching to full rate")
+                return not was_escalated
+        return False
+
+    def notify(self, key: str, name: str, image, timestamp, encoded: bytes = None) -> None:
         """
-        Notify Fight as per logic in class definition. If the last 'order' no. of windows
-        have a time difference of less than limit seconds then, notify.
+        Record an incident and hand its side effects (image file, Discord, MongoDB) to the alert dispatcher,
+        which runs them in the background so the frame callback does not wait on I/O. `encoded` is the frame's
+        JPEG as received, saved instead of encoding `image` again. The evidence clip is written once its
+        post-roll frames arrived.
         """
-        logger.info(f"====================!! Fire Detected !!====================")
-        img_path = self.capture_frame(image, timestamp)
-        self.incident_ts["fight"] = str(self.ts[-1])
-        r = self.send_discord_alert(img_path, "Fight")    
-        if r.status_code == 200:
-            logger.info("Sent Fight alert to discord.")
-        else:
-            logger.info(f"!! Fight alert to discord failed. Response {r.status_code} !!")
-        push_to_incidents(camera_name=self.camera_name, timestamp=self.incident_ts["fight"], name="Fight", img_path=img_path)
-        self.incident_counts["fight"] += 1
+        logger.info(f"====================!! {name} Detected !!====================")
+        self.incident_ts[key] = str(timestamp)
+        self.incident_counts[key] += 1
+        self.dispatcher.submit(Alert(self.camera_name, name, timestamp, image, encoded))
+        if self.evidence is not None:
+            self.evidence.trigger(name, timestamp)
 
 
-    async def process_result(self, result, timestamp, image) -> None:
+    def process_result(self, result, timestamp, image, encoded: bytes = None) -> None:
         '''
         Receives detection results from frames individually (multiple boxes per frame)
         '''
@@ -190,7 +169,7 @@ class SequentialDeque:
                 time1 = self.ts[-self.order]
                 time_diff = time2 - time1
                 if time_diff.total_seconds() < limit:
-                    await self.notify_acc(image,timestamp)
+                    self.notify("acc", "Accident", image, timestamp, encoded)
                     self.acc_frame_count = 0  # Clears the acc window
                     
         # For Fire Alert
@@ -202,7 +181,7 @@ class SequentialDeque:
                 time1 = self.ts[-self.order]
                 time_diff = time2 - time1
                 if time_diff.total_seconds() < limit:
-                    await self.notify_fire(image, timestamp)
+                    self.notify("fire", "Fire", image, timestamp, encoded)
                     self.fire_frame_count = 0
 
         # For Fight Alert
@@ -214,6 +193,6 @@ class SequentialDeque:
                 time1 = self.ts[-self.order]
                 time_diff = time2 - time1
                 if time_diff.total_seconds() < limit:
-                    await self.notify_fight(image, timestamp)
+                    self.notify("fight", "Fight", image, timestamp, encoded)
                     self.fight_frame_count = 0
                         
\ No newline at end of file
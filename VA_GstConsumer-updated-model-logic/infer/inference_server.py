@@ -0,0 +1,226 @@
+import os
+import time
+import queue
+import logging
+import multiprocessing
+import numpy as np
+from dotenv import load_dotenv
+from utils.log_setup import setup_logging
+
+load_dotenv()
+MODEL_PATH = os.getenv('CONGESTION_MODEL_PATH')
+MAX_BATCH_SIZE = int(os.getenv('INFER_MAX_BATCH', 16))
+MAX_WAIT_MS = float(os.getenv('INFER_MAX_WAIT_MS', 20))
+RESPONSE_TIMEOUT = float(os.getenv('INFER_RESPONSE_TIMEOUT', 30))
+STALE = -1  # answer for a frame the server could not read, e.g. a reused shared memory slot, or decode
+FAILED = -2  # answer for a frame of a batch the model failed on
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class InferenceClient:
+    """
+    Per-stream handle to a `BatchInferenceServer` worker. Picklable, so it can be handed to the consumer
+    process as a `multiprocessing.Process` argument.
+    """
+
+    def __init__(self, stream_name: str, request_queue, response_queue, timeout: float = RESPONSE_TIMEOUT):
+        self.stream_name = stream_name
+        self._request_queue = request_queue
+        self._response_queue = response_queue
+        self._timeout = timeout
+        self._seq = 0
+
+    def track(self, frame):
+        """
+        Send a single frame and block until its tracks come back. Frames are sent as they arrived, JPEG bytes
+        or the descriptor dict of a shared memory slot, and decoded by the server; a decoded BGR array works
+        too but costs a copy of the whole frame through the request queue.
+
+        Returns:
+            (tracking_ids, classes) as integer numpy arrays, one entry per tracked box, or None when the server
+            could not read, decode or run the frame, which the caller skips.
+        """
+        return self.track_many([frame])[0]
+
+    def track_many(self, frames) -> list:
+        """
+        Send consecutive frames of this stream in one go so the server can batch them together with
+        other streams. Results come back in the same order as `frames`.
+        """
+        pending = []
+        for frame in frames:
+            seq = self._seq
+            self._seq += 1
+            self._request_queue.put((self.stream_name, seq, frame))
+            pending.append(seq)
+
+        results = {}
+        deadline = time.monotonic() + self._timeout
+        while len(results) < len(pending):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{self.stream_name}: No inference result within {self._timeout}s")
+            seq, track_ids, classes = self._response_queue.get(timeout=remaining)
+            if seq < pending[0]:
+                continue  # stale answer to a request that already timed out
+            if isinstance(track_ids, int):
+                if track_ids == FAILED:
+                    logger.warning(f"{self.stream_name}: Inference server failed on frame {seq}")
+                results[seq] = None
+            else:
+                results[seq] = (track_ids, classes)
+        return [results[seq] for seq in pending]
+
+
+class BatchInferenceServer:
+    """
+    Hosts the congestion model in `num_workers` processes shared by every stream. Each worker collects
+    frames from all of its streams into micro-batches of at most `max_batch_size` frames, waiting at most
+    `max_wait_ms` after the first frame for the batch to fill, runs one batched forward pass and then
+    updates a ByteTrack instance per stream so tracking ids never mix between cameras.
+    Streams are sharded across workers round-robin.
+    """
+
+    def __init__(self, stream_names, num_workers: int = 1, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS, conf: float = 0.3, iou: float = 0.8,
+                 tracker_type: str = "bytetrack.yaml"):
+        self.num_workers = max(1, num_workers)
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.conf = conf
+        self.iou = iou
+        self.tracker_type = tracker_type
+
+        self._request_queues = [multiprocessing.Queue() for _ in range(self.num_workers)]
+        self._response_queues = {name: multiprocessing.Queue() for name in stream_names}
+        self._shards = {name: idx % self.num_workers for idx, name in enumerate(stream_names)}
+        self._workers = []
+
+    def client(self, stream_name: str) -> InferenceClient:
+        return InferenceClient(stream_name, self._request_queues[self._shards[stream_name]],
+                               self._response_queues[stream_name])
+
+    def start(self):
+        for idx, request_queue in enumerate(self._request_queues):
+            responses = {name: q for name, q in self._response_queues.items() if self._shards[name] == idx}
+            worker = multiprocessing.Process(
+                target=serve,
+                args=(request_queue, responses, self.max_batch_size, self.max_wait_ms,
+                      self.conf, self.iou, self.tracker_type),
+                name=f"InferenceWorker-{idx}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {len(self._workers)} inference workers for {len(self._shards)} streams "
+                    f"(max batch: {self.max_batch_size}, max wait: {self.max_wait_ms} ms)")
+
+    def stop(self, timeout: float = 10):
+        for request_queue in self._request_queues:
+            request_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+
+
+def collect_batch(request_queue, max_batch_size: int, max_wait_ms: float):
+    """
+    Block for the first request, then keep pulling until the batch is full or `max_wait_ms` has passed.
+
+    Returns:
+        (batch, stop) where `stop` is True once the shutdown sentinel was seen.
+    """
+    item = request_queue.get()
+    if item is None:
+        return [], True
+
+    batch = [item]
+    deadline = time.monotonic() + max_wait_ms / 1000
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = request_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is None:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+def serve(request_queue, response_queues, max_batch_size, max_wait_ms, conf, iou, tracker_type):
+    """
+    Worker process entry point. Heavy imports live here so that consumer processes which only hold an
+    `InferenceClient` never load torch or the model weights.
+    """
+    import torch
+    from ultralytics import YOLO
+    from turbojpeg import TurboJPEG
+    from ultralytics.utils import IterableSimpleNamespace, yaml_load
+    from ultralytics.utils.checks import check_yaml
+    from ultralytics.trackers.byte_tracker import BYTETracker
+    from utils.frame_ring import SharedFrameReader
+
+    jpeg = TurboJPEG()
+    readers = {}  # stream name -> SharedFrameReader, a reader keeps only the rings of one producer
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = YOLO(MODEL_PATH).to(device)
+    tracker_cfg = IterableSimpleNamespace(**yaml_load(check_yaml(tracker_type)))
+    trackers = {}
+    empty = np.empty(0, dtype=np.int64)
+
+    stop = False
+    while not stop:
+        batch, stop = collect_batch(request_queue, max_batch_size, max_wait_ms)
+        if not batch:
+            continue
+        # a frame that cannot be read or decoded only fails its own request, not the batch of other streams
+        requests, frames = [], []
+        for stream_name, seq, frame in batch:
+            try:
+                if isinstance(frame, (bytes, bytearray, memoryview)):
+                    frame = jpeg.decode(frame)
+                elif isinstance(frame, dict):
+                    reader = readers.get(stream_name)
+                    if reader is None:
+                        reader = readers[stream_name] = SharedFrameReader()
+                    frame = reader.read(frame)
+            except Exception as e:
+                logger.warning(f"{stream_name}: Could not read frame {seq}: {e!r}")
+                frame = None
+            if frame is None:
+                response_queues[stream_name].put((seq, STALE, STALE))
+            else:
+                requests.append((stream_name, seq))
+                frames.append(frame)
+        if not frames:
+            continue
+
+        answered = 0
+        try:
+            results = model.predict(frames, conf=conf, iou=iou, verbose=False)
+
+            # tracker updates must follow frame order within each stream, which the batch preserves
+            for (stream_name, seq), result in zip(requests, results):
+                tracker = trackers.get(stream_name)
+                if tracker is None:
+                    tracker = trackers[stream_name] = BYTETracker(args=tracker_cfg, frame_rate=30)
+                det = result.boxes.cpu().numpy()
+                tracks = tracker.update(det, result.orig_img) if len(det) else det
+                if len(tracks) == 0:
+                    response_queues[stream_name].put((seq, empty, empty))
+                else:
+                    # track rows are [x1, y1, x2, y2, track_id, score, cls, det_idx]
+                    response_queues[stream_name].put((seq, tracks[:, 4].astype(np.int64), tracks[:, 6].astype(np.int64)))
+                answered += 1
+
+        except Exception:
+            logger.error(f"Inference failed for a batch of {len(frames)} frames", exc_info=True)
+            for stream_name, seq in requests[answered:]:
+                response_queues[stream_name].put((seq, FAILED, FAILED))
@@ -0,0 +1,42 @@
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from utils.metrics import metrics
+
+load_dotenv()
+LAG_BUDGET = float(os.getenv('LAG_BUDGET', 5))  # seconds behind wall clock before shedding starts, 0 disables
+CONGESTION_MAX_STRIDE = int(os.getenv('CONGESTION_MAX_STRIDE', 3))  # ByteTrack still links tracks at 1/3 fps
+INCIDENT_MAX_STRIDE = int(os.getenv('INCIDENT_MAX_STRIDE', 10))
+
+
+class LoadShedder:
+    """
+    Drops frames of a consumer that fell behind the live stream. Lag is measured from the frame's
+    capture timestamp against wall clock; while it is within `budget` seconds every frame is kept,
+    beyond that only every `stride`-th frame is, with the stride growing by one per `budget` of lag
+    up to `max_stride`. Frames for which `keep_all()` is True are never dropped (e.g. while an
+    incident window has an active spike). Dropped frames are counted as `frames_skipped`.
+    """
+
+    def __init__(self, queue_name: str, max_stride: int, budget: float = LAG_BUDGET, keep_all=None):
+        self.queue_name = queue_name
+        self.max_stride = max(1, max_stride)
+        self.budget = budget
+        self.keep_all = keep_all
+        self._since_kept = 0
+
+    def should_process(self, timestamp: datetime) -> bool:
+        if self.budget <= 0:
+            return True
+        lag = (datetime.now() - timestamp).total_seconds()
+        if lag <= self.budget or (self.keep_all is not None and self.keep_all()):
+            self._since_kept = 0
+            return True
+
+        stride = min(self.max_stride, 1 + int(lag // self.budget))
+        self._since_kept += 1
+        if self._since_kept >= stride:
+            self._since_kept = 0
+            return True
+        metrics.inc('frames_skipped', self.queue_name)
+        return False
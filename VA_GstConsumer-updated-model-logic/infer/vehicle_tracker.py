@@ -66,3 +66,107 @@ class VehicleTracker:
         elif out_type == 'lst':
             # print({self.mapping[k]: v for k, v in self.class_counts.items()})
             return [self.class_counts[key] if key in self.class_counts else 0 for key in range(6)]
+
+
+class ArrayVehicleTracker:
+    def __init__(self, vehicle_counts: dict[int, int], max_frames_absent: int = 10,
+                 capacity: int = 128, num_classes: int = 7):
+        """
+        Drop-in replacement for `VehicleTracker` that keeps the tracked vehicles in preallocated numpy
+        arrays instead of nested dicts. Every vehicle owns a slot; `slots` maps a tracking id to its slot.
+        Per-frame updates, eviction and majority-vote class resolution are done with vectorized ops.
+        On ties the lowest class id wins, where `VehicleTracker` picks the class that was seen first.
+        Args:
+            max_frames_absent (int): maximum number of frames to consider the vehicle as absent and evict it
+            capacity (int): initial number of slots, doubled whenever it runs out
+            num_classes (int): initial width of the class vote histogram, grown on unseen class ids
+        """
+
+        self.max_frames_absent = max_frames_absent
+        self.class_counts = vehicle_counts
+        self.mapping = {0: 'auto', 1: 'bus', 2: 'car', 3: 'motorbike', 4: 'truck', 5: 'person'}
+
+        self.slots: dict[int, int] = {}
+        self.track_ids = np.full(capacity, -1, dtype=np.int64)
+        self.votes = np.zeros((capacity, num_classes), dtype=np.int32)
+        self.frame_count = np.zeros(capacity, dtype=np.int32)
+        self.absent_frames = np.zeros(capacity, dtype=np.int32)
+        self.active = np.zeros(capacity, dtype=bool)
+
+    def _grow(self, min_capacity: int, min_classes: int):
+        capacity, num_classes = self.votes.shape
+        new_capacity = capacity
+        while new_capacity < min_capacity:
+            new_capacity *= 2
+        new_classes = max(num_classes, min_classes)
+        if new_capacity == capacity and new_classes == num_classes:
+            return
+
+        votes = np.zeros((new_capacity, new_classes), dtype=np.int32)
+        votes[:capacity, :num_classes] = self.votes
+        self.votes = votes
+        extra = new_capacity - capacity
+        self.track_ids = np.concatenate([self.track_ids, np.full(extra, -1, dtype=np.int64)])
+        self.frame_count = np.concatenate([self.frame_count, np.zeros(extra, dtype=np.int32)])
+        self.absent_frames = np.concatenate([self.absent_frames, np.zeros(extra, dtype=np.int32)])
+        self.active = np.concatenate([self.active, np.zeros(extra, dtype=bool)])
+
+    def update(self, tracking_ids, classes):
+        track_ids = np.asarray(tracking_ids, dtype=np.float64).astype(np.int64).ravel()
+        clss = np.asarray(classes, dtype=np.float64).astype(np.int64).ravel()
+
+        # keep the first occurrence of each id, like the per-id lookup in `VehicleTracker`
+        track_ids, first = np.unique(track_ids, return_index=True)
+        clss = clss[first]
+        if len(clss) and clss.max() >= self.votes.shape[1]:
+            self._grow(len(self.slots), int(clss.max()) + 1)
+
+        slot_of = np.fromiter((self.slots.get(tid, -1) for tid in track_ids.tolist()),
+                              dtype=np.int64, count=len(track_ids))
+        seen = slot_of >= 0
+
+        # update existing vehicles
+        seen_slots = slot_of[seen]
+        self.votes[seen_slots, clss[seen]] += 1
+        self.frame_count[seen_slots] += 1
+        self.absent_frames[seen_slots] = 0
+
+        # age the vehicles missing from this frame and evict the ones absent for too long
+        missing = self.active.copy()
+        missing[seen_slots] = False
+        self.absent_frames[missing] += 1
+        evicted = np.flatnonzero(missing & (self.absent_frames > self.max_frames_absent))
+        if len(evicted):
+            most_seen = self.votes[evicted].argmax(axis=1)  # the class seen the most no. of times
+            counted = np.bincount(most_seen)
+            for cls in np.flatnonzero(counted).tolist():
+                self.class_counts[cls] = self.class_counts.get(cls, 0) + int(counted[cls])
+
+            for tid in self.track_ids[evicted].tolist():
+                del self.slots[tid]
+            self.active[evicted] = False
+            self.track_ids[evicted] = -1
+            self.votes[evicted] = 0
+            self.frame_count[evicted] = 0
+            self.absent_frames[evicted] = 0
+
+        # add new vehicles
+        new_ids = track_ids[~seen]
+        if len(new_ids):
+            free = np.flatnonzero(~self.active)
+            if len(free) < len(new_ids):
+                self._grow(len(self.active) + len(new_ids) - len(free), 0)
+                free = np.flatnonzero(~self.active)
+            new_slots = free[:len(new_ids)]
+            self.track_ids[new_slots] = new_ids
+            self.votes[new_slots, clss[~seen]] = 1
+            self.frame_count[new_slots] = 1
+            self.absent_frames[new_slots] = 0
+            self.active[new_slots] = True
+            self.slots.update(zip(new_ids.tolist(), new_slots.tolist()))
+
+    def get_class_counts(self, out_type: str = 'dct'):
+        if out_type == 'dct':
+            return self.class_counts
+        elif out_type == 'lst':
+            return [self.class_counts[key] if key in self.class_counts else 0 for key in range(6)]
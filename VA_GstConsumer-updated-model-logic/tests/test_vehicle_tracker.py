@@ -0,0 +1,36 @@
+import numpy as np
+from collections import defaultdict
+from infer.vehicle_tracker import ArrayVehicleTracker, VehicleTracker
+
+
+def run(tracker, frames) -> dict:
+    for ids, classes in frames:
+        tracker.update(ids, classes)
+    return {int(k): v for k, v in tracker.class_counts.items() if v}
+
+
+def random_frames(seed: int, count: int = 400) -> list:
+    """Vehicles entering and leaving the view; each id keeps one class, so there are no ties to break."""
+    rng = np.random.default_rng(seed)
+    class_of = rng.integers(0, 9, size=60)  # class ids past the initial vote width of 7
+    frames = []
+    for _ in range(count):
+        ids = np.flatnonzero(rng.random(60) < 0.3)
+        rng.shuffle(ids)
+        frames.append((ids.astype(float), class_of[ids].astype(float)))  # as float as the model's tensors
+    return frames
+
+
+def test_counts_match_vehicle_tracker():
+    for seed in range(3):
+        frames = random_frames(seed)
+        expected = run(VehicleTracker(defaultdict(int), max_frames_absent=3), frames)
+        assert expected
+        assert run(ArrayVehicleTracker(defaultdict(int), max_frames_absent=3, capacity=4), frames) == expected
+
+
+def test_majority_class_is_counted():
+    frames = [([1], [2]), ([1], [4]), ([1], [4])] + [([], [])] * 11
+    for tracker in (VehicleTracker(defaultdict(int)), ArrayVehicleTracker(defaultdict(int))):
+        assert run(tracker, frames) == {4: 1}
+        assert tracker.get_class_counts('lst') == [0, 0, 0, 0, 1, 0]
@@ -0,0 +1,205 @@
+import os
+import zlib
+import struct
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+ENVELOPE_CONTENT_TYPE = 'application/x-va-frame'
+BATCH_CONTENT_TYPE = 'application/x-va-frame-batch'  # consecutive envelopes of one stream, see `pack_batch`
+LEGACY_SHM_CONTENT_TYPE = 'application/x-shm-frame'  # header based descriptors of older producers
+FRAME_CHECKSUM = os.getenv('FRAME_CHECKSUM', 'false').lower() == 'true'  # producer: add a crc32 of the payload
+VERSION = 1
+
+FLAG_RESUME = 0x01  # first frame after the producer restarted the pipeline
+FLAG_CHECKSUM = 0x02  # crc32 of the payload follows the stream id
+
+CODEC_JPEG = 1
+CODEC_SHM = 2  # payload is a shared memory slot descriptor, see `pack_shm_descriptor`
+
+_MAGIC = b'VF'
+# magic, version, flags, codec, reserved, width, height, seq, pts (epoch ns), stream id length
+_HEADER = struct.Struct('<2sBBBBHHQqB')
+_CRC = struct.Struct('<I')
+_SHM = struct.Struct('<IqHHB')  # slot, ring seq, height, width, channels; the ring name follows
+_BATCH_MAGIC = b'VB'
+_BATCH = struct.Struct('<2sBH')  # magic, version, frame count; then one uint32 length per frame
+
+
+class EnvelopeError(ValueError):
+    """Body is not a frame envelope this version understands, or its checksum does not match."""
+
+
+def pack_shm_descriptor(name: str, slot: int, seq: int, shape) -> bytes:
+    height, width, channels = shape
+    return _SHM.pack(slot, seq, height, width, channels) + name.encode()
+
+
+def unpack_shm_descriptor(payload) -> dict:
+    """The descriptor as the dict `SharedFrameReader.read` takes."""
+    try:
+        slot, seq, height, width, channels = _SHM.unpack_from(payload, 0)
+        name = bytes(payload[_SHM.size:]).decode()
+    except (struct.error, UnicodeDecodeError) as e:
+        raise EnvelopeError(f"Corrupt shared memory descriptor: {e}") from None
+    return {'shm': name, 'slot': slot, 'seq': seq, 'shape': (height, width, channels)}
+
+
+class FrameEnvelope:
+    """
+    One frame on the wire: a fixed little-endian header, the stream id, an optional crc32 and the payload
+    (JPEG bytes or a shared memory descriptor), all in the message body instead of AMQP headers.
+
+    `seq` counts every frame the producer pulled from its pipeline, so a consumer can tell frames lost
+    on the way (see `SequenceTracker`). `pts_ns` is the capture time in nanoseconds since the epoch.
+    """
+
+    __slots__ = ('stream_id', 'seq', 'pts_ns', 'payload', 'codec', 'width', 'height', 'resume', '_timestamp')
+
+    def __init__(self, stream_id: str, seq: int, pts_ns: int, payload, codec: int = CODEC_JPEG,
+                 width: int = 0, height: int = 0, resume: bool = False):
+        self.stream_id = stream_id
+        self.seq = seq
+        self.pts_ns = pts_ns
+        self.payload = payload
+        self.codec = codec
+        self.width = width
+        self.height = height
+        self.resume = resume
+        self._timestamp = None
+
+    @property
+    def timestamp(self) -> datetime:
+        """Capture time as a naive local datetime, like the old `timestamp` header."""
+        if self._timestamp is None:
+            self._timestamp = datetime.fromtimestamp(self.pts_ns / 1e9)
+        return self._timestamp
+
+    def pack(self, checksum: bool = FRAME_CHECKSUM) -> bytes:
+        stream_id = self.stream_id.encode()
+        flags = (FLAG_RESUME if self.resume else 0) | (FLAG_CHECKSUM if checksum else 0)
+        header = _HEADER.pack(_MAGIC, VERSION, flags, self.codec, 0, self.width, self.height,
+                              self.seq, self.pts_ns, len(stream_id))
+        crc = _CRC.pack(zlib.crc32(self.payload)) if checksum else b''
+        return b''.join((header, stream_id, crc, self.payload))
+
+    @classmethod
+    def unpack(cls, body) -> 'FrameEnvelope':
+        """The payload is a zero-copy memoryview into `body`."""
+        if len(body) < _HEADER.size:
+            raise EnvelopeError(f"Envelope truncated: {len(body)} bytes")
+        magic, version, flags, codec, _, width, height, seq, pts_ns, id_len = _HEADER.unpack_from(body, 0)
+        if magic != _MAGIC or version != VERSION:
+            raise EnvelopeError(f"Not a version {VERSION} frame envelope: {magic!r} v{version}")
+        offset = _HEADER.size + id_len
+        payload_offset = offset + (_CRC.size if flags & FLAG_CHECKSUM else 0)
+        if len(body) < payload_offset:  # a corrupt id length, or a body cut short
+            raise EnvelopeError(f"Envelope truncated: {len(body)} bytes, its header needs {payload_offset}")
+        try:
+            stream_id = bytes(body[_HEADER.size:offset]).decode()
+        except UnicodeDecodeError:
+            raise EnvelopeError(f"Corrupt stream id on frame {seq}") from None
+        payload = memoryview(body)[payload_offset:]
+        if flags & FLAG_CHECKSUM and _CRC.unpack_from(body, offset)[0] != zlib.crc32(payload):
+            raise EnvelopeError(f"{stream_id}: Checksum mismatch on frame {seq}")
+        return cls(stream_id, seq, pts_ns, payload, codec, width, height, bool(flags & FLAG_RESUME))
+
+    @classmethod
+    def from_message(cls, properties, body, stream_id: str = '') -> 'FrameEnvelope':
+        """
+        Envelope of a delivery. Messages of producers that still send `timestamp`/`resume` headers are
+        converted, they carry no sequence number (`seq` is None).
+        """
+        if properties.content_type == ENVELOPE_CONTENT_TYPE:
+            return cls.unpack(body)
+
+        headers = properties.headers or {}
+        if 'timestamp' not in headers:
+            raise EnvelopeError(f"{stream_id}: Message has neither an envelope nor a timestamp header")
+        try:
+            timestamp = datetime.strptime(headers['timestamp'], "%Y-%m-%d %H:%M:%S.%f")
+            if properties.content_type == LEGACY_SHM_CONTENT_TYPE:
+                codec, payload = CODEC_SHM, pack_shm_descriptor(headers['shm'], headers['slot'], headers['seq'],
+                                                                headers['shape'])
+            else:
+                codec, payload = CODEC_JPEG, body
+        except (KeyError, TypeError, ValueError, struct.error) as e:
+            raise EnvelopeError(f"{stream_id}: Malformed headers {headers}: {e!r}") from None
+        envelope = cls(stream_id, None, int(timestamp.timestamp() * 1e6) * 1000, payload, codec,
+                       resume=headers.get('resume') is not None)
+        envelope._timestamp = timestamp
+        return envelope
+
+    def __repr__(self):
+        return (f"FrameEnvelope({self.stream_id}, seq={self.seq}, ts={self.timestamp}, codec={self.codec}, "
+                f"{self.width}x{self.height}, resume={self.resume}, {len(self.payload)} bytes)")
+
+
+def pack_batch(envelopes: list) -> bytes:
+    """Packed envelopes in one message body, behind an index table of their lengths."""
+    index = struct.pack(f'<{len(envelopes)}I', *map(len, envelopes))
+    return b''.join((_BATCH.pack(_BATCH_MAGIC, VERSION, len(envelopes)), index, *envelopes))
+
+
+def unpack_batch(body) -> list:
+    if len(body) < _BATCH.size:
+        raise EnvelopeError(f"Batch truncated: {len(body)} bytes")
+    magic, version, count = _BATCH.unpack_from(body, 0)
+    if magic != _BATCH_MAGIC or version != VERSION:
+        raise EnvelopeError(f"Not a version {VERSION} frame batch: {magic!r} v{version}")
+    offset = _BATCH.size + 4 * count
+    if len(body) < offset:
+        raise EnvelopeError(f"Batch index truncated: {len(body)} bytes for {count} frames")
+    lengths = struct.unpack_from(f'<{count}I', body, _BATCH.size)
+    if len(body) < offset + sum(lengths):
+        raise EnvelopeError(f"Batch truncated: {len(body)} bytes, its index needs {offset + sum(lengths)}")
+    view = memoryview(body)
+    envelopes = []
+    for length in lengths:
+        envelopes.append(FrameEnvelope.unpack(view[offset:offset + length]))
+        offset += length
+    return envelopes
+
+
+def frame_count(content_type: str, body) -> int:
+    """Frames in a message body without unpacking it."""
+    if content_type == BATCH_CONTENT_TYPE:
+        return _BATCH.unpack_from(body, 0)[2]
+    return 1
+
+
+def envelopes_from_message(properties, body, stream_id: str = '') -> list:
+    """Envelopes of a delivery in capture order, one unless the producer batches frames."""
+    if properties.content_type == BATCH_CONTENT_TYPE:
+        return unpack_batch(body)
+    return [FrameEnvelope.from_message(properties, body, stream_id)]
+
+
+class SequenceTracker:
+    """
+    Gap and reorder detection from envelope sequence numbers, one per stream on the consumer side.
+    A sequence number going back while the capture time moves forward means the producer process
+    restarted and counts from zero again, which resets tracking instead of counting as a reorder.
+    """
+
+    def __init__(self):
+        self.last_seq = None
+        self.last_pts = None
+
+    def observe(self, envelope: FrameEnvelope) -> int:
+        """
+        Returns:
+            number of frames missing right before this one, 0 when it is in order, -1 when it arrived
+            late or twice.
+        """
+        seq = envelope.seq
+        if seq is None:
+            return 0
+        if self.last_seq is None or envelope.resume or (seq <= self.last_seq and envelope.pts_ns > self.last_pts):
+            self.last_seq, self.last_pts = seq, envelope.pts_ns
+            return 0
+        if seq <= self.last_seq:
+            return -1
+        missing = seq - self.last_seq - 1
+        self.last_seq, self.last_pts = seq, envelope.pts_ns
+        return missing
@@ -4,8 +4,12 @@ import pika
 import pandas as pd
 import multiprocessing
 from dotenv import load_dotenv
+from utils.metrics import metrics
 from utils.utilities import init_logger_alt
 from stream_handler.async_producer import RTSPFrameProducer
+from stream_handler.multiplexed_producer import MultiplexedProducer
+from stream_handler.pipeline_options import PipelineOptions
+from utils.queue_policy import QueuePolicy
 
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
@@ -15,22 +19,38 @@ load_dotenv()
 
 GST_DEBUG = os.getenv('GST_DEBUG')
 GST_DEBUG_FILE = os.getenv('GST_DEBUG_FILE')
+FRAME_TRANSPORT = os.getenv('FRAME_TRANSPORT', 'amqp')  # 'shm' only when consumers run on this host
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 15))
+PRODUCER_MODE = os.getenv('PRODUCER_MODE', 'process')  # 'process': one per camera, 'multiplexed': see README
+PRODUCER_SHARDS = int(os.getenv('PRODUCER_SHARDS', 2))  # processes in multiplexed mode
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # multiplexed mode, shard n serves on METRICS_PORT + n, 0 disables
 
 Gst.init(None)
 main_logger = init_logger_alt('logs/main_log')
 
 
-def start_producer(uri, loc, rabbitmq_params, ml):
+def start_producer(uri, loc, rabbitmq_params, ml, options=None, queue_policy=None):
+    metrics.start_reporter(METRICS_INTERVAL, textfile=f'logs/metrics/{loc}.prom')
     producer = RTSPFrameProducer(
         uri=uri,
         queue_name=loc,
         rabbitmq_params=rabbitmq_params,
-        main_logger=ml
+        main_logger=ml,
+        transport=FRAME_TRANSPORT,
+        options=options,
+        queue_policy=queue_policy,
     )
     producer.setup_pipeline()
     producer.start()
 
 
+def start_multiplexed_producer(streams, rabbitmq_params, ml, shard):
+    metrics.start_reporter(METRICS_INTERVAL, textfile=f'logs/metrics/shard_{shard}.prom')
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT + shard)
+    MultiplexedProducer(streams, rabbitmq_params, ml, transport=FRAME_TRANSPORT).run()
+
+
 def main():
     rabbitmq_params = pika.ConnectionParameters(
         host='localhost',
@@ -52,16 +72,28 @@ def main():
 
     uris = df_working.RTSPLink
     locations = df_working.Location
+    options = [PipelineOptions.from_row(row) for _, row in df_working.iterrows()]
+    queue_policies = [QueuePolicy.from_row(row) for _, row in df_working.iterrows()]
 
     main_logger.info(f"Starting processes for: {locations.to_list()}")
 
     processes = []
-    for uri, loc in zip(uris, locations):
-        process = multiprocessing.Process(target=start_producer, args=(uri, loc, rabbitmq_params, main_logger))
-        process.start()
-        processes.append(process)
-
-    main_logger.info(f"Started {len(processes)} RTSP stream producers")
+    if PRODUCER_MODE == 'multiplexed':
+        streams = list(zip(uris, locations, options, queue_policies))
+        shards = [streams[i::PRODUCER_SHARDS] for i in range(min(PRODUCER_SHARDS, len(streams)))]
+        for shard, shard_streams in enumerate(shards):
+            process = multiprocessing.Process(target=start_multiplexed_producer,
+                                              args=(shard_streams, rabbitmq_params, main_logger, shard))
+            process.start()
+            processes.append(process)
+        main_logger.info(f"Started {len(streams)} RTSP stream producers in {len(processes)} multiplexed processes")
+    else:
+        for uri, loc, opts, policy in zip(uris, locations, options, queue_policies):
+            process = multiprocessing.Process(target=start_producer,
+                                              args=(uri, loc, rabbitmq_params, main_logger, opts, policy))
+            process.start()
+            processes.append(process)
+        main_logger.info(f"Started {len(processes)} RTSP stream producers")
 
     try:
         for process in processes:
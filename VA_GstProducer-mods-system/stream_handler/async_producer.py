@@ -8,7 +8,17 @@ import numpy as np
 import pika.exceptions
 
 from turbojpeg import TurboJPEG
+from dotenv import load_dotenv
+from utils.metrics import metrics
 from utils.utilities import init_logger
+from utils.queue_policy import QueuePolicy
+from utils.frame_ring import SharedFrameRing, ring_name, remove_stale_rings
+from utils.frame_envelope import FrameEnvelope, ENVELOPE_CONTENT_TYPE, CODEC_JPEG, CODEC_SHM, pack_shm_descriptor
+from utils.log_setup import setup_logging, FrameLog
+from stream_handler.pipeline_options import PipelineOptions
+from stream_handler.pipeline_builder import choose_decoder, drop_delta_frames
+from stream_handler.delivery_window import DeliveryWindow, appsink_properties, new_spill_buffer
+from stream_handler.frame_batcher import FrameBatcher
 from datetime import datetime, timedelta
 from pika.exceptions import ConnectionClosed
 from pika.adapters.select_connection import SelectConnection
@@ -17,8 +27,11 @@ gi.require_version('Gst', '1.0')
 gi.require_version('GstApp', '1.0')
 from gi.repository import Gst, GLib, GstApp
 
+load_dotenv()
+SHM_SLOTS = int(os.getenv('SHM_SLOTS', 16))  # raw frames per shared memory ring, about 6 MB each at 1080p
+
 jpeg = TurboJPEG()
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 Gst.init(None)
 FAILS = 0
@@ -27,7 +40,8 @@ TRIALS = 0
 
 class RTSPFrameProducer:
     def __init__(self, uri, queue_name, rabbitmq_params, main_logger, streams_log_dir=r"logs/stream_logs",
-                 frames_log_dir=r"logs/frame_logs"):
+                 frames_log_dir=r"logs/frame_logs", transport='amqp', options=None, publisher=None,
+                 queue_policy=None):
         self.uri = uri
         self.queue_name = queue_name
         self.pipeline = None
@@ -50,14 +64,29 @@ class RTSPFrameProducer:
         self._running = None
         self._retrying = None
         self._was_retrying = None
-        # self._deliveries = {}
-        # self._acked = None
-        # self._nacked = None
-        # self._message_number = 0
+        self.transport = transport  # 'amqp': JPEG bodies over RabbitMQ, 'shm': raw frames in shared memory
+        self.options = options or PipelineOptions()
+        self.decoder_choice = None  # probed once, reused when the pipeline is rebuilt
+        self.pipeline_description = None
+        self._ring = None
+        self._ring_generation = time.time_ns() // 1_000_000  # starts at the run's start time, a restarted producer never reuses a ring name
+        self._decode_starts = {}  # buffer pts -> perf_counter at decoder input
+        self._seq = 0  # envelope sequence number, counts every frame pulled from the pipeline
+        self.queue_policy = queue_policy or QueuePolicy()
+        self.window = DeliveryWindow(queue_name, spill=new_spill_buffer(queue_name, transport),
+                                     delivery_mode=self.queue_policy.delivery_mode)
+        self.batcher = None
+        if self.options.batch_frames > 1:
+            self.batcher = FrameBatcher(queue_name, self.publish_message, self.options.batch_frames,
+                                        self.options.batch_linger_ms)
+        self.publisher = publisher  # shared AMQP publisher of a multiplexed producer, None: own connection
+        if publisher is not None:
+            publisher.add_stream(queue_name, self.window, self.queue_policy)
 
         # Logging setup
         os.makedirs(streams_log_dir, exist_ok=True)
         self.stream_logger = init_logger(streams_log_dir, self.queue_name, type='stream')
+        self.frame_log = FrameLog(self.stream_logger, self.queue_name)
 
         # os.makedirs(frames_log_dir, exist_ok=True)
         # self.frame_logger = init_logger(frames_log_dir, self.queue_name, type='frame')
@@ -66,22 +95,33 @@ class RTSPFrameProducer:
 
     def setup_pipeline(self):
         try:
-            # perfect
+            if self.decoder_choice is None:
+                self.decoder_choice = choose_decoder(self.uri, self.fps, self.options)
+                self.ml.info(f"{self.queue_name}: Decoder chosen: {self.decoder_choice}")
+
+            # rate is reduced first so crop, scale and colour conversion only touch the frames we send
+            shaping = self.options.elements()
             pipeline_str = (
                 f'rtspsrc location="{self.uri}" protocols=tcp latency=0 ! '
-                f'rtph264depay ! h264parse ! avdec_h264 ! videoconvert ! videorate ! '
-                f'video/x-raw,format=BGR,framerate={self.fps}/1 ! queue ! appsink name=sink emit-signals=true'
+                f'{self.decoder_choice.elements()} ! videorate ! '
+                f'video/x-raw,framerate={self.fps}/1 ! {shaping + " ! " if shaping else ""}videoconvert ! '
+                f'video/x-raw,format=BGR ! queue ! appsink name=sink emit-signals=true {appsink_properties(self.window.policy)}'
             )
             self.pipeline = Gst.parse_launch(pipeline_str)
+            self.pipeline_description = pipeline_str
             appsink = self.pipeline.get_by_name('sink')
             appsink.connect('new-sample', self.on_new_sample)
+            decoder = self.pipeline.get_by_name('decoder')
+            if self.decoder_choice.keyframes_only:
+                drop_delta_frames(decoder)
+            self.add_decode_probes(decoder)
 
             self.bus = self.pipeline.get_bus()
             self.bus.add_signal_watch()
             self.bus.connect('message', self.on_message)
 
             if self._retrying is None:
-                self.stream_logger.info(f"Pipeline set up successfully")
+                self.stream_logger.info(f"Pipeline set up successfully with {self.options}: {pipeline_str}")
             else:
                 self.stream_logger.info(f"Pipeline set up")
 
@@ -89,7 +129,34 @@ class RTSPFrameProducer:
             self.ml.error(f"{self.queue_name}: Error setting up pipeline: {e}")
             raise
 
+    def add_decode_probes(self, decoder):
+        """
+        Time every buffer between the decoder's sink and src pads, keyed by pts.
+        """
+        self._decode_starts = {}
+
+        def on_decoder_input(_pad, info):
+            buffer = info.get_buffer()
+            if len(self._decode_starts) > 256:  # frames the decoder dropped never come out
+                self._decode_starts.clear()
+            self._decode_starts[buffer.pts] = time.perf_counter()
+            return Gst.PadProbeReturn.OK
+
+        def on_decoder_output(_pad, info):
+            start = self._decode_starts.pop(info.get_buffer().pts, None)
+            if start is not None:
+                metrics.observe('decode', self.queue_name, time.perf_counter() - start)
+            return Gst.PadProbeReturn.OK
+
+        decoder.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, on_decoder_input)
+        decoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, on_decoder_output)
+
     def start(self):
+        if self.publisher is not None:  # multiplexed: the shared publisher and supervisor do the rest
+            self.pipeline.set_state(Gst.State.PLAYING)
+            self._running = True
+            return
+
         if not self._retrying:
             logger.info(f"Starting pipeline for {self.uri}")
             self.pipeline.set_state(Gst.State.PLAYING)
@@ -119,9 +186,25 @@ class RTSPFrameProducer:
         self.stream_logger.info(f"Pipeline set to NULL.")
         if not self._retrying:
             self._running = False
+            self.release_ring()
         if self.connection:
             self.connection.close()  # will join threads here
 
+    def restart_pipeline(self):
+        """
+        Rebuild and restart only the GStreamer pipeline, leaving the AMQP side alone. Used by the
+        multiplexed producer's supervisor, where the connection is shared with other streams.
+        """
+        if self.pipeline is not None:
+            self.pipeline.set_state(Gst.State.NULL)
+        if self.bus is not None:
+            self.bus.remove_signal_watch()
+        self._retrying = True
+        self._was_retrying = True
+        self._start_time = datetime.now() + timedelta(milliseconds=0)
+        self.setup_pipeline()
+        self.pipeline.set_state(Gst.State.PLAYING)
+
     def monitor_messages(self):
         time.sleep(30)
         if self._latest_msg_ts is None:  # stream was dead from start, stop both thread processes
@@ -182,6 +265,7 @@ class RTSPFrameProducer:
 
     def on_connection_closed(self, _unused_connection, reason):
         self.stream_logger.info(f"Connection closed: {reason}")
+        self.window.detach()
         self.connection.ioloop.call_later(5, self.connection.ioloop.stop)
         # self.connection = None
         self.stream_logger.info(f"IOLoop Stopped.")
@@ -189,14 +273,50 @@ class RTSPFrameProducer:
     def on_channel_open(self, channel):
         logger.info("Channel opened")
         self.channel = channel
+        self.channel.add_on_close_callback(self.on_channel_closed)
         self.channel.queue_declare(
             queue=self.queue_name,
-            durable=True,
-            callback=self.on_queue_declareok
+            callback=self.on_queue_declareok,
+            **self.queue_policy.declare_kwargs()
         )
 
+    def on_channel_closed(self, _channel, reason):
+        self.stream_logger.info(f"Channel closed: {reason}")
+        self.window.detach()
+
     def on_queue_declareok(self, _unused_frame):
-        self.stream_logger.info(f"Stream queue {self.queue_name} declared")
+        self.stream_logger.info(f"Stream queue {self.queue_name} declared with {self.queue_policy}")
+        self.window.attach(self.channel, self.connection.ioloop.add_callback_threadsafe)
+
+    def publish_frame(self, body, ts):
+        """
+        Publish one enveloped frame, or queue it for the next batch message when batching is on.
+        Runs on the GStreamer streaming thread.
+        """
+        if self.batcher is not None:
+            self.batcher.add(body, ts)
+        else:
+            self.publish_message(ENVELOPE_CONTENT_TYPE, body, 1, ts)
+
+    def publish_message(self, content_type, body, frames, ts):
+        """
+        Hand a message of `frames` frames to the stream's delivery window, which publishes it on this
+        producer's own channel or on the shared connection of a multiplexed producer.
+        """
+        if self.window.offer(content_type, None, body):
+            self.msg_count += frames
+            self._latest_msg_ts = ts
+            # self.frame_logger.info(
+            #     f"Received: {self.frame_count} | Sent: {self.msg_count} | "
+            #     f"TS: {self._latest_msg_ts} | Resume: {self._was_retrying}"
+            # )
+            self.frame_log("Received: %d | Sent: %d | TS: %s | Resume: %s", self.frame_count, self.msg_count,
+                           self._latest_msg_ts, self._was_retrying, frames=frames,
+                           force=self._was_retrying is not None)
+            self._was_retrying = None
+        else:
+            self._unsent_frames += frames
+            self.stream_logger.warning(f"Channel down or publish window full, frames not sent: {self._unsent_frames}")
 
     def on_new_sample(self, _appsink):
         try:
@@ -219,40 +339,24 @@ class RTSPFrameProducer:
             success, height = structure.get_int("height")
 
             mem = memoryview(map_info.data)
-            img = np.frombuffer(mem, dtype=np.uint8).reshape((height, width, 3))
-            cmp_img = jpeg.encode(img, quality=20)
+            img = self.options.apply_roi(np.frombuffer(mem, dtype=np.uint8).reshape((height, width, 3)))
+            if self.transport == 'shm':
+                codec = CODEC_SHM
+                with metrics.timer('shm_write', self.queue_name):
+                    payload = self.write_to_ring(img)
+            else:
+                codec = CODEC_JPEG
+                with metrics.timer('jpeg_encode', self.queue_name):
+                    payload = jpeg.encode(img, quality=20)
+            body = FrameEnvelope(
+                self.queue_name, self._seq, int(ts.timestamp() * 1e6) * 1000, payload, codec,
+                width=img.shape[1], height=img.shape[0], resume=bool(self._was_retrying)
+            ).pack()
+            self._seq += 1
             self.frame_count += 1
+            metrics.inc('frames_received', self.queue_name)
             try:
-                if self.channel and self.channel.is_open:
-                    self.channel.basic_publish(
-                        exchange='',
-                        routing_key=self.queue_name,
-                        body=cmp_img,
-                        properties=pika.BasicProperties(
-                            content_type='application/octet-stream',
-                            delivery_mode=2,
-                            headers={
-                                'timestamp': str(ts),
-                                'resume': True if self._was_retrying else None
-                            },
-                        )
-                    )
-                    self.msg_count += 1
-                    self._latest_msg_ts = str(ts)
-                    # self.frame_logger.info(
-                    #     f"Received: {self.frame_count} | Sent: {self.msg_count} | "
-                    #     f"TS: {self._latest_msg_ts} | Resume: {self._was_retrying}"
-                    # )
-                    self._was_retrying = None
-
-                    logger.info(
-                        f"Received: {self.frame_count} | Sent: {self.msg_count} | "
-                        f"TS: {self._latest_msg_ts} | Resume: {self._was_retrying}"
-                    )
-                else:
-                    self._unsent_frames += 1
-                    self.stream_logger.warning(f"Channel not available, frame not sent: {self._unsent_frames}")
-
+                self.publish_frame(body, ts)
             except Exception:
                 self.ml.error(f"{self.queue_name}: Frame not sent: ", exc_info=True)
             except ConnectionClosed:
@@ -272,6 +376,31 @@ class RTSPFrameProducer:
             self.ml.error(f"{self.queue_name}: Error in on_new_sample: {e}")
             return Gst.FlowReturn.ERROR
 
+    def write_to_ring(self, img):
+        """
+        Copy the raw frame into this stream's shared memory ring and return the descriptor of its slot.
+        The ring is sized on the first frame and recreated under a new name if the resolution grows; the rings of
+        an earlier run of the stream are unlinked first, consumers move to the new name with the next descriptor.
+        """
+        if self._ring is None or not self._ring.fits(img.nbytes):
+            if self._ring is not None:
+                self._ring.close()
+                self._ring_generation += 1
+            else:
+                remove_stale_rings(self.queue_name)
+            self._ring = SharedFrameRing.create(ring_name(self.queue_name, self._ring_generation),
+                                                SHM_SLOTS, img.nbytes)
+            self.stream_logger.info(f"Frame ring {self._ring.name} created: {SHM_SLOTS} x {img.shape}")
+
+        slot, seq = self._ring.write(img)
+        return pack_shm_descriptor(self._ring.name, slot, seq, img.shape)
+
+    def release_ring(self):
+        """Unlink the shared memory ring, called once the pipeline stopped writing to it."""
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
     def on_message(self, _bus, message):
         msg_type = message.type
 
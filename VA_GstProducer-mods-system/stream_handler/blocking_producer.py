@@ -6,6 +6,9 @@ import gi
 import logging
 import pika
 from utils.utilities import init_logger
+from utils.queue_policy import QueuePolicy
+from utils.frame_envelope import FrameEnvelope, ENVELOPE_CONTENT_TYPE
+from utils.log_setup import setup_logging, FrameLog
 from turbojpeg import TurboJPEG
 
 from datetime import datetime, timedelta
@@ -18,7 +21,7 @@ from gi.repository import Gst, GLib, GstApp
 
 Gst.init(None)
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 Gst.init(None)
@@ -27,7 +30,7 @@ TRIALS = 0
 
 
 class RTSPFrameProducer:
-    def __init__(self, uri, queue_name, connection, main_logger, log_dir=r'logs/stream_logs'):
+    def __init__(self, uri, queue_name, connection, main_logger, log_dir=r'logs/stream_logs', queue_policy=None):
 
         self.uri = uri
         self.queue_name = queue_name
@@ -37,6 +40,7 @@ class RTSPFrameProducer:
         self.msg_count = 0
         self.connection = connection
         self.channel = None
+        self.queue_policy = queue_policy or QueuePolicy()
         self._start_time = datetime.now() + timedelta(milliseconds=0)
         self.fps = 18  # gives 14 fps while sending
         self.ml = main_logger
@@ -49,13 +53,11 @@ class RTSPFrameProducer:
 
         os.makedirs(log_dir, exist_ok=True)
         self.stream_logger = init_logger(log_dir, self.queue_name, type='stream')
+        self.frame_log = FrameLog(self.stream_logger, self.queue_name)
 
     def open_channel(self):
         self.channel = self.connection.channel()
-        self.channel.queue_declare(
-            queue=self.queue_name,
-            durable=True,
-        )
+        self.channel.queue_declare(queue=self.queue_name, **self.queue_policy.declare_kwargs())
 
     def setup_pipeline(self):
         try:
@@ -114,7 +116,7 @@ class RTSPFrameProducer:
         global FAILS, TRIALS
         while self._running:
             try:
-                ts1 = datetime.strptime(self._latest_msg_ts, "%Y-%m-%d %H:%M:%S.%f")
+                ts1 = self._latest_msg_ts
                 ts2 = datetime.now()
                 if (ts2 - ts1).seconds > 120:
                     self._retrying = True
@@ -134,7 +136,7 @@ class RTSPFrameProducer:
                         time.sleep(20)  # wait for 20 seconds to check again
                         # self.connection.sleep(20)
                         reference = datetime.now()
-                        msg_ts = datetime.strptime(self._latest_msg_ts, "%Y-%m-%d %H:%M:%S.%f")
+                        msg_ts = self._latest_msg_ts
                         if (reference - msg_ts).seconds < 60:
                             self.stream_logger.info(f"Pipeline resumed. Latest message TS: {self._latest_msg_ts}.")
                             self._retrying = False
@@ -178,33 +180,30 @@ class RTSPFrameProducer:
             img = np.frombuffer(mem, dtype=np.uint8).reshape((height, width, 3))
 
             cmp_img = jpeg.encode(img, quality=20)
+            body = FrameEnvelope(self.queue_name, self.frame_count - 1, int(ts.timestamp() * 1e6) * 1000, cmp_img,
+                                 width=width, height=height, resume=bool(self._was_retrying)).pack()
 
             try:
                 if self.channel and self.channel.is_open:
                     self.channel.basic_publish(
                         exchange='',
                         routing_key=self.queue_name,
-                        body=cmp_img,
+                        body=body,
                         properties=pika.BasicProperties(
-                            content_type='application/octet-stream',
-                            delivery_mode=2,
-                            headers={
-                                'timestamp': str(ts),
-                                'resume': True if self._was_retrying else None},
+                            content_type=ENVELOPE_CONTENT_TYPE,
+                            delivery_mode=self.queue_policy.delivery_mode,
                         )
                     )
                     self.msg_count += 1
-                    self._latest_msg_ts = str(ts)
+                    self._latest_msg_ts = ts
                     # self.frame_logger.info(
                     #     f"Received: {self.frame_count} | Sent: {self.msg_count} | "
                     #     f"TS: {self._latest_msg_ts} | Resume: {self._was_retrying}"
                     # )
+                    self.frame_log("Received: %d | Sent: %d | TS: %s | Resume: %s", self.frame_count,
+                                   self.msg_count, self._latest_msg_ts, self._was_retrying,
+                                   force=self._was_retrying is not None)
                     self._was_retrying = None
-
-                    logger.info(
-                        f"Received: {self.frame_count} | Sent: {self.msg_count} | "
-                        f"TS: {self._latest_msg_ts} | Resume: {self._was_retrying}"
-                    )
                 else:
                     self._unsent_frames += 1
                     self.stream_logger.warning(f"Channel not available, frame not sent: {self._unsent_frames}")
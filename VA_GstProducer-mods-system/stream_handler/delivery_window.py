@@ -0,0 +1,240 @@
+import os
+import pika
+import logging
+import threading
+from dotenv import load_dotenv
+from utils.metrics import metrics
+from utils.spill_buffer import SpillBuffer
+from utils.frame_envelope import frame_count
+
+load_dotenv()
+PUBLISH_CONFIRMS = os.getenv('PUBLISH_CONFIRMS', 'true').lower() == 'true'
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', 64))  # frames handed to the ioloop but not confirmed yet, per stream
+BACKPRESSURE = os.getenv('BACKPRESSURE', 'drop')  # 'drop': never stall the pipeline, 'block': wait for the window
+BLOCK_TIMEOUT = float(os.getenv('BLOCK_TIMEOUT', 1.0))  # seconds a frame waits for the window in 'block' mode
+APPSINK_MAX_BUFFERS = int(os.getenv('APPSINK_MAX_BUFFERS', 4))
+SPILL_DIR = os.getenv('SPILL_DIR', '')  # spill ring per stream under this directory, empty disables spilling
+SPILL_MAX_MB = int(os.getenv('SPILL_MAX_MB', 512))  # per stream
+
+logger = logging.getLogger(__name__)
+
+
+def appsink_properties(policy: str = BACKPRESSURE) -> str:
+    """
+    appsink settings matching the backpressure policy: with 'drop' the appsink discards its oldest buffers
+    while `on_new_sample` is busy, with 'block' it holds them and the pipeline stalls up to rtspsrc.
+    """
+    return f"max-buffers={APPSINK_MAX_BUFFERS} drop={'false' if policy == 'block' else 'true'}"
+
+
+def new_spill_buffer(queue_name: str, transport: str):
+    """Spill ring for a stream when `SPILL_DIR` is set. Shared memory descriptors go stale, so never for 'shm'."""
+    if not SPILL_DIR or transport == 'shm':
+        return None
+    return SpillBuffer(os.path.join(SPILL_DIR, queue_name), SPILL_MAX_MB * 1024 * 1024)
+
+
+class DeliveryWindow:
+    """
+    Publisher confirms and flow control for one stream's channel.
+
+    `offer` runs on the GStreamer streaming thread. It reserves a slot in a window of `max_in_flight`
+    frames and schedules the `basic_publish` on the connection's ioloop, since pika is not thread safe.
+    A slot is released when the broker acks the delivery (immediately after publishing without confirms).
+    When the window is full the frame is dropped right away ('drop') or after waiting up to
+    `block_timeout` for a slot ('block'). Frames that cannot be published are written to the spill
+    buffer instead, if there is one, and so are nacked deliveries and deliveries that were still
+    unconfirmed when the channel closed (delivery is at least once). While the spill buffer holds
+    frames, new frames are appended behind them and the buffer is drained into the window as
+    confirms come back, so the consumer still gets them in capture order.
+    """
+
+    def __init__(self, queue_name: str, max_in_flight: int = MAX_IN_FLIGHT, policy: str = BACKPRESSURE,
+                 confirms: bool = PUBLISH_CONFIRMS, spill: SpillBuffer = None, block_timeout: float = BLOCK_TIMEOUT,
+                 delivery_mode: int = 2):
+        self.queue_name = queue_name
+        self.max_in_flight = max(1, max_in_flight)
+        self.policy = policy
+        self.confirms = confirms
+        self.spill = spill
+        self.block_timeout = block_timeout
+        self.delivery_mode = delivery_mode
+        self.channel = None
+        self._schedule = None
+        self._cond = threading.Condition()
+        self._reserved = 0
+        self._deliveries = {}  # delivery tag -> (content_type, headers, body) awaiting confirmation
+        self._message_number = 0
+        self._drain_scheduled = False
+
+    def attach(self, channel, schedule):
+        """
+        Start publishing on `channel`, called on the ioloop once the stream queue is declared.
+        `schedule` runs a callable on the ioloop from any thread (`ioloop.add_callback_threadsafe`).
+        """
+        if self.confirms:
+            channel.confirm_delivery(self.on_delivery_confirmation)
+        with self._cond:
+            self.channel = channel
+            self._schedule = schedule
+            self._deliveries = {}
+            self._message_number = 0
+            self._reserved = 0
+        self._drain()
+
+    def detach(self):
+        """Channel or connection closed: spill what the broker never confirmed and wake blocked threads."""
+        with self._cond:
+            unconfirmed = list(self._deliveries.values())
+            self.channel = None
+            self._schedule = None
+            self._deliveries = {}
+            self._reserved = 0
+            self._cond.notify_all()
+        for record in unconfirmed:
+            self._spill_or_drop(record)
+
+    def offer(self, content_type: str, headers: dict, body: bytes) -> bool:
+        """
+        Hand a frame over for publishing.
+
+        Returns:
+            False if the frame was dropped.
+        """
+        record = (content_type, headers, body)
+        with self._cond:
+            if self.channel is None or (self.spill is not None and len(self.spill)):
+                reserved = False
+            elif self._reserved < self.max_in_flight:
+                reserved = True
+            elif self.policy == 'block':
+                reserved = self._cond.wait_for(
+                    lambda: self.channel is None or self._reserved < self.max_in_flight, self.block_timeout
+                ) and self.channel is not None
+            else:
+                reserved = False
+            if reserved:
+                self._reserved += 1
+                schedule = self._schedule
+
+        if not reserved:
+            kept = self._spill_or_drop(record)
+            if kept:
+                self._schedule_drain()
+            return kept
+        try:
+            schedule(lambda: self._publish(record))
+        except Exception:  # ioloop already closed
+            self._release(1)
+            return self._spill_or_drop(record)
+        return True
+
+    def _spill_or_drop(self, record) -> bool:
+        frames = frame_count(record[0], record[2])
+        if self.spill is not None:
+            self.spill.append(*record)
+            metrics.inc('frames_spilled', self.queue_name, frames)
+            return True
+        metrics.inc('frames_unsent', self.queue_name, frames)
+        return False
+
+    def _release(self, count: int):
+        with self._cond:
+            self._reserved = max(0, self._reserved - count)
+            self._cond.notify_all()
+
+    def _publish(self, record, spilled: bool = False) -> bool:
+        """
+        Runs on the ioloop, with a slot already reserved. A `spilled` record that cannot be published goes
+        back to the head of the spill buffer, so it keeps its place before the frames spilled after it.
+
+        Returns:
+            False if the record was not published.
+        """
+        channel = self.channel
+        if channel is None or not channel.is_open:
+            self._unpublished(record, spilled)
+            return False
+        content_type, headers, body = record
+        try:
+            with metrics.timer('publish', self.queue_name):
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=self.queue_name,
+                    body=body,
+                    properties=pika.BasicProperties(
+                        content_type=content_type,
+                        delivery_mode=self.delivery_mode,
+                        headers=headers,
+                    )
+                )
+        except Exception:
+            logger.error(f"{self.queue_name}: Frame not published", exc_info=True)
+            self._unpublished(record, spilled)
+            return False
+        metrics.inc('frames_sent', self.queue_name, frame_count(content_type, body))
+        if self.confirms:
+            self._message_number += 1
+            self._deliveries[self._message_number] = record
+        else:
+            self._release(1)
+        return True
+
+    def _unpublished(self, record, spilled: bool):
+        self._release(1)
+        if not spilled:
+            self._spill_or_drop(record)
+        elif not self.spill.unpop():  # its segment went to the size limit, like the frames spilled with it
+            metrics.inc('frames_unsent', self.queue_name, frame_count(record[0], record[2]))
+
+    def on_delivery_confirmation(self, method_frame):
+        method = method_frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self._deliveries if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self._deliveries else []
+        records = [self._deliveries.pop(tag) for tag in tags]
+        frames = sum(frame_count(record[0], record[2]) for record in records)
+        if acked:
+            metrics.inc('frames_confirmed', self.queue_name, frames)
+        else:
+            metrics.inc('frames_nacked', self.queue_name, frames)
+            logger.warning(f"{self.queue_name}: Broker nacked {frames} frames")
+            for record in records:
+                self._spill_or_drop(record)
+        self._release(len(records))
+        self._drain()
+
+    def _schedule_drain(self):
+        with self._cond:
+            if self._drain_scheduled or self._schedule is None:
+                return
+            self._drain_scheduled = True
+            schedule = self._schedule
+        try:
+            schedule(self._drain)
+        except Exception:
+            with self._cond:
+                self._drain_scheduled = False
+
+    def _drain(self):
+        """Move spilled frames into free window slots. Runs on the ioloop."""
+        with self._cond:
+            self._drain_scheduled = False
+        if self.spill is None:
+            return
+        while self.channel is not None:
+            with self._cond:
+                if self._reserved >= self.max_in_flight:
+                    return
+                record = self.spill.pop()
+                if record is None:
+                    return
+                self._reserved += 1
+            if not self._publish(record, spilled=True):
+                return  # retried on the next drain, after a confirm or a new channel
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
@@ -0,0 +1,69 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from utils.frame_envelope import pack_batch, BATCH_CONTENT_TYPE, ENVELOPE_CONTENT_TYPE
+
+load_dotenv()
+FRAME_BATCH = int(os.getenv('FRAME_BATCH', 1))  # frames per message, 1 disables batching
+FRAME_BATCH_LINGER_MS = float(os.getenv('FRAME_BATCH_LINGER_MS', 250))
+
+
+class FrameBatcher:
+    """
+    Packs consecutive enveloped frames of one stream into batch messages of `batch_size` frames, which cuts
+    the broker's message rate by that factor. A partial batch is sent as soon as its first frame has
+    waited `max_linger_ms`, so batching never delays a frame by more than that (a lone frame goes out
+    as a plain envelope).
+
+    `publish(content_type, body, frames, last_ts)` is called with the batcher's lock held, from the
+    streaming thread when a batch fills up and from the linger thread otherwise, so messages leave in order.
+    """
+
+    def __init__(self, queue_name: str, publish, batch_size: int = FRAME_BATCH,
+                 max_linger_ms: float = FRAME_BATCH_LINGER_MS):
+        self.queue_name = queue_name
+        self.batch_size = max(1, batch_size)
+        self.max_linger = max_linger_ms / 1000
+        self._publish = publish
+        self._frames = []
+        self._last_ts = None
+        self._deadline = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._linger, name=f"{queue_name}-batcher", daemon=True)
+        self._thread.start()
+
+    def add(self, body: bytes, ts):
+        with self._cond:
+            self._frames.append(body)
+            self._last_ts = ts
+            if len(self._frames) == 1:
+                self._deadline = time.monotonic() + self.max_linger
+                self._cond.notify()
+            if len(self._frames) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        frames, self._frames, self._deadline = self._frames, [], None
+        if len(frames) == 1:
+            self._publish(ENVELOPE_CONTENT_TYPE, frames[0], 1, self._last_ts)
+        elif frames:
+            self._publish(BATCH_CONTENT_TYPE, pack_batch(frames), len(frames), self._last_ts)
+
+    def _linger(self):
+        with self._cond:
+            while not self._closed:
+                if self._deadline is None:
+                    self._cond.wait()
+                elif time.monotonic() < self._deadline:
+                    self._cond.wait(self._deadline - time.monotonic())
+                else:
+                    self._flush()
+
+    def close(self):
+        """Send what is pending and stop the linger thread."""
+        with self._cond:
+            self._flush()
+            self._closed = True
+            self._cond.notify()
@@ -0,0 +1,262 @@
+import os
+import gi
+import time
+import logging
+import threading
+import functools
+from dotenv import load_dotenv
+from utils.metrics import metrics
+from utils.log_setup import setup_logging
+from stream_handler.async_producer import RTSPFrameProducer
+from pika.adapters.select_connection import SelectConnection
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+load_dotenv()
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', 10))  # seconds
+STARTUP_GRACE = float(os.getenv('STARTUP_GRACE', 30))  # seconds before the first health check
+MAX_RESTART_BACKOFF = float(os.getenv('MAX_RESTART_BACKOFF', 300))  # seconds between restarts of a dead stream
+RECONNECT_DELAY = 5  # seconds
+
+setup_logging()
+logger = logging.getLogger(__name__)
+Gst.init(None)
+
+
+class SharedPublisher:
+    """
+    One AMQP connection for all streams of a multiplexed producer, with one channel per stream.
+
+    pika connections are not thread safe and GStreamer delivers samples on one streaming thread per
+    pipeline, so each stream's `DeliveryWindow` only schedules its publishes onto this connection's
+    ioloop thread with `add_callback_threadsafe`. A dropped connection is reopened, with all its
+    channels, after `RECONNECT_DELAY` seconds, and a closed channel is reopened on its own.
+    """
+
+    def __init__(self, rabbitmq_params, main_logger):
+        self.rabbitmq_params = rabbitmq_params
+        self.ml = main_logger
+        self.connection = None
+        self.windows = {}  # queue name -> DeliveryWindow
+        self.queue_policies = {}
+        self._running = False
+        self._thread = None
+
+    def add_stream(self, queue_name, window, queue_policy):
+        self.windows[queue_name] = window
+        self.queue_policies[queue_name] = queue_policy
+
+    def start(self):
+        channel_max = getattr(self.rabbitmq_params, 'channel_max', None)
+        if channel_max and len(self.windows) >= channel_max:
+            self.ml.warning(f"{len(self.windows)} streams share a connection limited to {channel_max} channels, "
+                            f"raise channel_max or PRODUCER_SHARDS")
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="SharedPublisher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            self.connection = SelectConnection(
+                parameters=self.rabbitmq_params,
+                on_open_callback=self.on_connection_open,
+                on_open_error_callback=self.on_connection_open_error,
+                on_close_callback=self.on_connection_closed,
+            )
+            self.connection.ioloop.start()
+            for window in self.windows.values():
+                window.detach()
+            if self._running:
+                self.ml.info(f"Reconnecting to RabbitMQ in {RECONNECT_DELAY} seconds...")
+                time.sleep(RECONNECT_DELAY)
+
+    def stop(self):
+        self._running = False
+        if self.connection is not None:
+            try:
+                self.connection.ioloop.add_callback_threadsafe(self._close)
+            except Exception:
+                self.ml.error("Could not schedule close of the shared connection", exc_info=True)
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        for window in self.windows.values():
+            window.close()
+
+    def _close(self):
+        if self.connection.is_open:
+            self.connection.close()  # on_connection_closed stops the ioloop
+        else:
+            self.connection.ioloop.stop()
+
+    def on_connection_open(self, _connection):
+        self.ml.info(f"Shared connection opened for {len(self.windows)} streams")
+        for queue_name in self.windows:
+            self._open_channel(queue_name)
+
+    def on_connection_open_error(self, _connection, err):
+        self.ml.error(f"Shared connection open failed: {err}")
+        self.connection.ioloop.stop()
+
+    def on_connection_closed(self, _connection, reason):
+        self.ml.info(f"Shared connection closed: {reason}")
+        self.connection.ioloop.stop()
+
+    def _open_channel(self, queue_name):
+        if self.connection.is_open:
+            self.connection.channel(on_open_callback=functools.partial(self.on_channel_open, queue_name))
+
+    def on_channel_open(self, queue_name, channel):
+        channel.add_on_close_callback(functools.partial(self.on_channel_closed, queue_name))
+        channel.queue_declare(
+            queue=queue_name,
+            callback=lambda _frame: self.on_queue_declareok(queue_name, channel),
+            **self.queue_policies[queue_name].declare_kwargs()
+        )
+
+    def on_queue_declareok(self, queue_name, channel):
+        self.windows[queue_name].attach(channel, self.connection.ioloop.add_callback_threadsafe)
+        self.ml.info(f"{queue_name}: Channel opened, stream queue declared with {self.queue_policies[queue_name]}")
+
+    def on_channel_closed(self, queue_name, _channel, reason):
+        self.windows[queue_name].detach()
+        if self._running and self.connection.is_open:
+            self.ml.warning(f"{queue_name}: Channel closed: {reason}. Reopening in {RECONNECT_DELAY} seconds...")
+            self.connection.ioloop.call_later(RECONNECT_DELAY, functools.partial(self._open_channel, queue_name))
+
+
+class StreamSupervisor:
+    """
+    A single health check thread for every pipeline in the process, in place of one `monitor_messages`
+    thread per stream. A stream whose latest published timestamp did not move since its previous check
+    gets its GStreamer pipeline rebuilt, the shared connection is left alone. Checks of a failing stream
+    back off exponentially up to `max_backoff` so a dead camera is not rebuilt every few seconds.
+    """
+
+    def __init__(self, producers, main_logger, interval: float = HEALTH_CHECK_INTERVAL,
+                 grace: float = STARTUP_GRACE, max_backoff: float = MAX_RESTART_BACKOFF):
+        self.producers = producers
+        self.ml = main_logger
+        self.interval = interval
+        self.grace = grace
+        self.max_backoff = max_backoff
+        self._last_ts = {}
+        self._failures = {}
+        self._next_check = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        first_check = time.monotonic() + self.grace
+        for producer in self.producers:
+            self._last_ts[producer.queue_name] = None
+            self._failures[producer.queue_name] = 0
+            self._next_check[producer.queue_name] = first_check
+        self._thread = threading.Thread(target=self._run, name="StreamSupervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            for producer in self.producers:
+                if self._stop.is_set():
+                    return
+                try:
+                    self.check(producer, now)
+                except Exception:
+                    self.ml.error(f"{producer.queue_name}: Health check failed", exc_info=True)
+
+    def check(self, producer, now: float):
+        name = producer.queue_name
+        if now < self._next_check[name]:
+            return
+
+        latest = producer._latest_msg_ts
+        if latest is not None and latest != self._last_ts[name]:
+            if self._failures[name]:
+                producer.stream_logger.info(f"Pipeline resumed. Latest message TS: {latest}.")
+                self.ml.info(f"{name}: Pipeline resumed")
+            self._last_ts[name] = latest
+            self._failures[name] = 0
+            self._next_check[name] = now
+            return
+
+        self._failures[name] += 1
+        backoff = min(self.max_backoff, self.interval * 2 ** (self._failures[name] - 1))
+        self._next_check[name] = now + backoff
+        producer.stream_logger.info(f"No frames since {latest}. Restarting pipeline, trial {self._failures[name]}, "
+                                    f"next check in {backoff:.0f} seconds...")
+        self.ml.info(f"{name}: Pipeline may be stopped. Restarting...")
+        metrics.inc('pipeline_restarts', name)
+        producer.restart_pipeline()
+
+
+class MultiplexedProducer:
+    """
+    Hosts many `RTSPFrameProducer` pipelines in one process instead of a process per camera.
+
+    All pipelines publish through one `SharedPublisher` (one connection, one channel per stream), one
+    `StreamSupervisor` restarts stalled pipelines, and the GLib main loop in the calling thread
+    dispatches the bus messages of every pipeline. GStreamer still decodes each stream on its own
+    streaming threads.
+    """
+
+    def __init__(self, streams, rabbitmq_params, main_logger, transport='amqp'):
+        """
+        Args:
+            streams: (uri, queue_name, PipelineOptions, QueuePolicy) per camera
+        """
+        self.ml = main_logger
+        self.publisher = SharedPublisher(rabbitmq_params, main_logger)
+        self.producers = [
+            RTSPFrameProducer(
+                uri=uri,
+                queue_name=queue_name,
+                rabbitmq_params=rabbitmq_params,
+                main_logger=main_logger,
+                transport=transport,
+                options=options,
+                publisher=self.publisher,
+                queue_policy=queue_policy,
+            )
+            for uri, queue_name, options, queue_policy in streams
+        ]
+        self.supervisor = StreamSupervisor(self.producers, main_logger)
+        self.loop = GLib.MainLoop()
+
+    def run(self):
+        self.publisher.start()
+        for producer in self.producers:
+            try:
+                producer.setup_pipeline()
+                producer.start()
+            except Exception:
+                # the supervisor keeps retrying it
+                self.ml.error(f"{producer.queue_name}: Could not start pipeline", exc_info=True)
+        self.supervisor.start()
+        self.ml.info(f"Multiplexed producer running {len(self.producers)} streams: "
+                     f"{[producer.queue_name for producer in self.producers]}")
+
+        try:
+            self.loop.run()
+        except KeyboardInterrupt:
+            self.ml.info("Interrupted by user. Stopping multiplexed producer...")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.supervisor.stop()
+        for producer in self.producers:
+            if producer.pipeline is not None:
+                producer.pipeline.set_state(Gst.State.NULL)
+            producer._running = False
+            producer.release_ring()
+        self.publisher.stop()
+        if self.loop.is_running():
+            self.loop.quit()
+        self.ml.info("Multiplexed producer stopped")
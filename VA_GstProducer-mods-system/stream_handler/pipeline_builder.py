@@ -0,0 +1,100 @@
+import gi
+import logging
+
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import Gst, GstPbutils, GLib
+
+logger = logging.getLogger(__name__)
+
+# depayloader, parser, decoder per RTP payload
+CODECS = {
+    'h264': ('rtph264depay', 'h264parse', 'avdec_h264'),
+    'h265': ('rtph265depay', 'h265parse', 'avdec_h265'),
+}
+CAPS_TO_CODEC = {'video/x-h264': 'h264', 'video/x-h265': 'h265'}
+SKIP_B_FRAMES = 1  # avdec_* skip-frame value for "Skip B-frames"
+SKIP_RATIO = 2  # source/target fps ratio from which B-frames are skipped in 'auto' decode mode
+
+
+def probe_stream(uri: str, timeout: int = 10):
+    """
+    Discover the codec and frame rate of the first video stream.
+
+    Returns:
+        (codec, source_fps), either may be None when the probe fails or the codec is unsupported.
+    """
+    try:
+        info = GstPbutils.Discoverer.new(timeout * Gst.SECOND).discover_uri(uri)
+    except GLib.Error as e:
+        logger.warning(f"Could not probe {uri}: {e}")
+        return None, None
+
+    for stream in info.get_video_streams():
+        codec = CAPS_TO_CODEC.get(stream.get_caps().get_structure(0).get_name())
+        num, denom = stream.get_framerate_num(), stream.get_framerate_denom()
+        return codec, (num / denom if num and denom else None)
+    return None, None
+
+
+class DecoderChoice:
+    """
+    The decode chain picked for a stream and why, kept on the producer for logging.
+    `keyframes_only` means delta frames have to be dropped in front of the decoder.
+    """
+
+    def __init__(self, codec: str, decode: str, source_fps: float, threads: int):
+        self.codec = codec
+        self.decode = decode
+        self.source_fps = source_fps
+        self.threads = threads
+
+    @property
+    def keyframes_only(self) -> bool:
+        return self.decode == 'keyframes'
+
+    def elements(self) -> str:
+        depay, parse, decoder = CODECS[self.codec]
+        props = ['name=decoder']
+        if self.threads:
+            props.append(f'max-threads={self.threads}')
+        if self.decode == 'skip_b':
+            props.append(f'skip-frame={SKIP_B_FRAMES}')
+        return f'{depay} ! {parse} ! {decoder} {" ".join(props)}'
+
+    def __str__(self):
+        fps = f"{self.source_fps:.1f}" if self.source_fps else "unknown"
+        return f"{self.codec} ({self.decode} decode, source fps {fps}, threads {self.threads or 'auto'})"
+
+
+def choose_decoder(uri: str, target_fps: int, options, probe=probe_stream) -> DecoderChoice:
+    """
+    Pick depayloader/parser/decoder from `options.codec`, or from the probed stream caps when it is 'auto',
+    and a decode mode from `options.decode`. In 'auto' mode B-frames are skipped once the source runs at
+    `SKIP_RATIO` times the target rate, since videorate drops most decoded frames anyway.
+    'keyframes' has to be asked for explicitly, it only suits targets at or below the camera's GOP rate.
+    """
+    codec, source_fps = (None, None)
+    if options.codec == 'auto' or options.decode == 'auto':
+        codec, source_fps = probe(uri)
+    if options.codec != 'auto':
+        codec = options.codec
+    if codec not in CODECS:
+        logger.warning(f"Unsupported or unknown codec {codec!r} for {uri}, falling back to h264")
+        codec = 'h264'
+
+    decode = options.decode
+    if decode == 'auto':
+        decode = 'skip_b' if source_fps and source_fps >= SKIP_RATIO * target_fps else 'full'
+    return DecoderChoice(codec, decode, source_fps, options.decode_threads)
+
+
+def drop_delta_frames(decoder):
+    """Drop every non-keyframe in front of the decoder, so only keyframes are ever decoded."""
+
+    def on_decoder_input(_pad, info):
+        if info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+    decoder.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, on_decoder_input)
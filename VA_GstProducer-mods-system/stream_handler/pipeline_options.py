@@ -0,0 +1,98 @@
+import numpy as np
+from stream_handler.frame_batcher import FRAME_BATCH, FRAME_BATCH_LINGER_MS
+
+
+def _cell(row, column):
+    """Spreadsheet cell as a stripped string, None when the column is missing or the cell is empty."""
+    value = row.get(column) if hasattr(row, 'get') else None
+    if value is None or value != value:  # NaN from pandas
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def polygon_mask(points, height: int, width: int) -> np.ndarray:
+    """
+    Rasterise a polygon (even-odd rule, pixel centres) into a (height, width, 1) uint8 mask of 0/1.
+    """
+    ys = np.arange(height, dtype=np.float32)[:, None] + 0.5
+    xs = np.arange(width, dtype=np.float32)[None, :] + 0.5
+    inside = np.zeros((height, width), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+        if y1 == y2:
+            continue
+        crosses = (y1 > ys) != (y2 > ys)
+        x_at_y = (x2 - x1) * (ys - y1) / (y2 - y1) + x1
+        inside ^= crosses & (xs < x_at_y)
+    return inside.astype(np.uint8)[..., None]
+
+
+class PipelineOptions:
+    """
+    Per-camera frame shaping, read from optional columns of the stream config spreadsheet:
+
+    - `Crop`: pixels to cut from the source frame as "top,right,bottom,left" (GStreamer `videocrop`)
+    - `Width`, `Height`: output size after cropping (GStreamer `videoscale`)
+    - `ROI`: polygon "x1,y1;x2,y2;..." in output pixels, everything outside is blacked out before encode
+    - `Codec`: 'h264', 'h265' or 'auto' (default, probed from the stream)
+    - `Decode`: 'auto' (default), 'full', 'skip_b' or 'keyframes', see `pipeline_builder.choose_decoder`
+    - `DecodeThreads`: `max-threads` of the decoder, 0 (default) lets libav decide
+    - `BatchFrames`: frames per AMQP message, defaults to `FRAME_BATCH` (1, no batching)
+    - `BatchLingerMs`: longest a frame waits for its batch to fill, defaults to `FRAME_BATCH_LINGER_MS`
+    """
+
+    def __init__(self, width: int = None, height: int = None, crop: tuple = None, roi: list = None,
+                 codec: str = 'auto', decode: str = 'auto', decode_threads: int = 0,
+                 batch_frames: int = FRAME_BATCH, batch_linger_ms: float = FRAME_BATCH_LINGER_MS):
+        self.width = width
+        self.height = height
+        self.crop = crop
+        self.roi = roi
+        self.codec = codec
+        self.decode = decode
+        self.decode_threads = decode_threads
+        self.batch_frames = batch_frames
+        self.batch_linger_ms = batch_linger_ms
+        self._mask = None
+
+    @classmethod
+    def from_row(cls, row) -> 'PipelineOptions':
+        width, height = _cell(row, 'Width'), _cell(row, 'Height')
+        crop, roi = _cell(row, 'Crop'), _cell(row, 'ROI')
+        threads = _cell(row, 'DecodeThreads')
+        batch_frames, batch_linger = _cell(row, 'BatchFrames'), _cell(row, 'BatchLingerMs')
+        return cls(
+            width=int(float(width)) if width else None,
+            height=int(float(height)) if height else None,
+            crop=tuple(int(v) for v in crop.split(',')) if crop else None,
+            roi=[tuple(int(v) for v in point.split(',')) for point in roi.split(';') if point.strip()] if roi else None,
+            codec=(_cell(row, 'Codec') or 'auto').lower(),
+            decode=(_cell(row, 'Decode') or 'auto').lower(),
+            decode_threads=int(float(threads)) if threads else 0,
+            batch_frames=int(float(batch_frames)) if batch_frames else FRAME_BATCH,
+            batch_linger_ms=float(batch_linger) if batch_linger else FRAME_BATCH_LINGER_MS,
+        )
+
+    def elements(self) -> str:
+        """GStreamer elements to splice in after the frame rate is reduced, empty when nothing is configured."""
+        parts = []
+        if self.crop:
+            top, right, bottom, left = self.crop
+            parts.append(f'videocrop top={top} right={right} bottom={bottom} left={left}')
+        if self.width and self.height:
+            parts.append(f'videoscale ! video/x-raw,width={self.width},height={self.height}')
+        return ' ! '.join(parts)
+
+    def apply_roi(self, img: np.ndarray) -> np.ndarray:
+        """Black out everything outside the ROI polygon. Returns `img` itself when no ROI is set."""
+        if not self.roi:
+            return img
+        height, width = img.shape[:2]
+        if self._mask is None or self._mask.shape[:2] != (height, width):
+            self._mask = polygon_mask(self.roi, height, width)
+        return np.multiply(img, self._mask)
+
+    def __repr__(self):
+        return (f"PipelineOptions(width={self.width}, height={self.height}, crop={self.crop}, roi={self.roi}, "
+                f"codec={self.codec}, decode={self.decode}, decode_threads={self.decode_threads}, "
+                f"batch_frames={self.batch_frames}, batch_linger_ms={self.batch_linger_ms})")
@@ -0,0 +1,100 @@
+import numpy as np
+from datetime import date
+import dash_bootstrap_components as dbc
+from dash_bootstrap_templates import load_figure_template
+from dash import Dash, html, dcc
+from dash.dependencies import Input, Output
+import plotly.graph_objs as go
+from plotly.subplots import make_subplots
+from utils.log_analysis import FrameLogIndex
+
+# Run from the producer project root as `python -m tests.graph_fps`.
+LOG_FOLDER = r"C:\VA\GstProducer\logs"
+index = FrameLogIndex()
+
+def refresh_index():
+    # only reads what was logged since the last refresh
+    index.update_folder(LOG_FOLDER)
+    return index.streams()
+
+def process_log_file(location_name, day):
+    counts = index.counts(location_name, day)
+    seconds = np.flatnonzero(counts)
+    times = [f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}' for s in seconds.tolist()]
+    return times, counts[seconds]
+
+load_figure_template("lux")
+external_stylesheets = [dbc.themes.LUX]
+app = Dash(__name__, external_stylesheets=external_stylesheets)
+
+def serve_layout():
+    locations = refresh_index()
+    return html.Div([
+        html.H1('Log Analysis: Frames Sent Per Second by Location'),
+        dcc.Dropdown(
+            id='location-dropdown',
+            options=[{'label': name, 'value': name} for name in locations],
+            value=locations[0] if locations else None,
+            placeholder="Select a location"
+        ),
+        dcc.Dropdown(id='day-dropdown', placeholder="Select a day"),
+        dcc.Graph(id='frame-count-graph')
+    ])
+
+app.layout = serve_layout
+
+@app.callback(
+    Output('day-dropdown', 'options'),
+    Output('day-dropdown', 'value'),
+    Input('location-dropdown', 'value')
+)
+def update_days(location_name):
+    if not location_name:
+        return [], None
+    days = [str(day) for day in index.days(location_name)]
+    return days, days[-1] if days else None
+
+@app.callback(
+    Output('frame-count-graph', 'figure'),
+    Input('day-dropdown', 'value'),
+    Input('location-dropdown', 'value')
+)
+def update_graph(day, location_name):
+    if not location_name or not day:
+        return go.Figure()  # Return empty figure if no location selected
+
+    if date.fromisoformat(day) == date.today():
+        refresh_index()  # today's log is still growing
+    times, frame_counts = process_log_file(location_name, date.fromisoformat(day))
+
+    avg_fps = index.average_fps(location_name, [date.fromisoformat(day)])
+    
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.1,
+                        subplot_titles=("Bar Plot", "Line Plot"))
+
+    fig.add_trace(
+        go.Bar(x=times, y=frame_counts, name="Frame Count"),
+        row=1, col=1
+    )
+
+    fig.add_trace(
+        go.Scatter(x=times, y=frame_counts, mode='lines', name="Frame Count"),
+        row=2, col=1
+    )
+
+    fig.update_layout(
+        title=f'Number of Frames Sent Per Second - {location_name} (Avg FPS: {avg_fps:.2f})',
+        height=800,  
+        xaxis_title='Time',
+        showlegend=False
+    )
+
+    fig.update_yaxes(title_text="Number of Frames", row=1, col=1)
+    fig.update_yaxes(title_text="Number of Frames", row=2, col=1)
+
+    fig.update_xaxes(tickangle=-90)
+    
+    return fig
+
+if __name__ == '__main__':
+    app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,62 @@
+import struct
+import pytest
+from utils.frame_envelope import (FrameEnvelope, EnvelopeError, SequenceTracker, CODEC_SHM, pack_batch,
+                                  unpack_batch, pack_shm_descriptor, unpack_shm_descriptor)
+
+
+def envelope(seq: int = 7, payload: bytes = b'\xff\xd8jpeg\xff\xd9', resume: bool = False) -> FrameEnvelope:
+    return FrameEnvelope('cam-1', seq, 1712650000123456789, payload, width=1920, height=1080, resume=resume)
+
+
+@pytest.mark.parametrize('checksum', [False, True])
+def test_round_trip(checksum):
+    sent = envelope(resume=True)
+    received = FrameEnvelope.unpack(sent.pack(checksum=checksum))
+    assert (received.stream_id, received.seq, received.pts_ns) == ('cam-1', 7, 1712650000123456789)
+    assert (received.width, received.height, received.resume) == (1920, 1080, True)
+    assert bytes(received.payload) == sent.payload
+
+
+def test_batch_round_trip():
+    sent = [envelope(seq, f'frame {seq}'.encode()) for seq in range(3)]
+    received = unpack_batch(pack_batch([e.pack() for e in sent]))
+    assert [(e.seq, bytes(e.payload)) for e in received] == [(e.seq, e.payload) for e in sent]
+
+
+def test_shm_descriptor_round_trip():
+    payload = pack_shm_descriptor('va_cam-1_1', 3, 41, (1080, 1920, 3))
+    assert unpack_shm_descriptor(payload) == {'shm': 'va_cam-1_1', 'slot': 3, 'seq': 41, 'shape': (1080, 1920, 3)}
+    received = FrameEnvelope.unpack(FrameEnvelope('cam-1', 41, 0, payload, CODEC_SHM).pack())
+    assert received.codec == CODEC_SHM and unpack_shm_descriptor(received.payload)['slot'] == 3
+
+
+def test_corrupt_envelopes():
+    body = envelope().pack(checksum=True)
+    with pytest.raises(EnvelopeError):
+        FrameEnvelope.unpack(body[:10])  # shorter than the header
+    with pytest.raises(EnvelopeError):
+        FrameEnvelope.unpack(b'XX' + body[2:])
+    with pytest.raises(EnvelopeError):
+        FrameEnvelope.unpack(body[:-7])  # payload cut short, checksum mismatch
+
+    id_len_at = struct.calcsize('<2sBBBBHHQq')
+    with pytest.raises(EnvelopeError):
+        FrameEnvelope.unpack(body[:id_len_at] + b'\xff' + body[id_len_at + 1:])
+    with pytest.raises(EnvelopeError):
+        unpack_shm_descriptor(b'\x01\x02')
+
+
+def test_corrupt_batches():
+    body = pack_batch([envelope(seq).pack() for seq in range(3)])
+    with pytest.raises(EnvelopeError):
+        unpack_batch(body[:3])
+    with pytest.raises(EnvelopeError):
+        unpack_batch(body[:-7])
+    with pytest.raises(EnvelopeError):
+        unpack_batch(body[:5] + b'\x00' * (len(body) - 5))  # index intact, envelopes zeroed
+
+
+def test_sequence_tracker():
+    tracker = SequenceTracker()
+    assert [tracker.observe(envelope(seq)) for seq in (1, 2, 5, 4, 6)] == [0, 0, 2, -1, 0]
+    assert tracker.observe(envelope(0, resume=True)) == 0
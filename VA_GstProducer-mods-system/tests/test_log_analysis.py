@@ -0,0 +1,54 @@
+import os
+from datetime import date
+from utils.log_analysis import FrameLogIndex, parse_seconds, stream_name
+
+SUMMARY = b'2024-04-09 10:00:%02d,500 - INFO - cam-1 | Frames: %d | FPS: %d.0\n'
+FRAME = b'2024-04-09 10:00:%02d,040 - Frame: 1712650000.04\n'
+OTHER = b'2024-04-09 10:00:%02d,000 - INFO - Connected to the broker\n'
+
+
+def test_parse_seconds():
+    data = b''.join((SUMMARY % (1, 25, 25), FRAME % 2, OTHER % 3, b'Traceback (most recent call last):\n',
+                     b'2024-04-10 00:00:00,001 - Frame: 0\n'))
+    days, seconds, frames = parse_seconds(data)
+    assert days.tolist() == [20240409] * 3 + [20240410]
+    assert seconds.tolist() == [36001, 36002, 36003, 0]
+    assert frames.tolist() == [25, 1, 0, 1]
+
+
+def test_stream_name():
+    assert stream_name('logs/cam-1.log') == stream_name('logs/cam-1.log.3') == stream_name('cam-1_frames.log') == 'cam-1'
+
+
+def test_index_reads_only_appended_lines(tmp_path):
+    log = tmp_path / 'logs' / 'cam-1.log'
+    log.parent.mkdir()
+    log.write_bytes(SUMMARY % (1, 25, 25) + SUMMARY % (2, 20, 20))
+    index = FrameLogIndex(str(tmp_path / 'index'))
+    assert index.update_folder(str(log.parent)) == ['cam-1']
+    assert index.update_file(str(log)) == 0
+
+    with open(log, 'ab') as f:
+        f.write(SUMMARY % (3, 10, 10) + b'2024-04-09 10:00:04,500 - INFO - cam-1 | Fra')
+    assert index.update_file(str(log)) == 10  # the cut line waits for its newline
+    with open(log, 'ab') as f:
+        f.write(b'mes: 5 | FPS: 5.0\n')
+    assert index.update_file(str(log)) == 5
+
+    # a fresh index over the same store picks up where the last one stopped
+    index = FrameLogIndex(str(tmp_path / 'index'))
+    assert index.update_file(str(log)) == 0
+    counts = index.counts('cam-1', date(2024, 4, 9))
+    assert counts[36001:36005].tolist() == [25, 20, 10, 5]
+    assert index.average_fps('cam-1') == 60 / 4
+
+
+def test_replaced_log_is_read_from_the_start(tmp_path):
+    log = tmp_path / 'cam-1.log'
+    log.write_bytes(FRAME % 1 * 3)
+    index = FrameLogIndex(str(tmp_path / 'index'))
+    assert index.update_file(str(log)) == 3
+    os.remove(log)
+    log.write_bytes(FRAME % 2)  # shorter than the offset read so far
+    assert index.update_file(str(log)) == 1
+    assert index.counts('cam-1', date(2024, 4, 9))[36001:36003].tolist() == [3, 1]
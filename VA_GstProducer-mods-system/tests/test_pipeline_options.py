@@ -0,0 +1,24 @@
+import numpy as np
+from stream_handler.pipeline_options import polygon_mask
+
+
+def test_square_mask():
+    mask = polygon_mask([(2, 2), (6, 2), (6, 6), (2, 6)], 8, 10)
+    assert mask.shape == (8, 10, 1) and mask.dtype == np.uint8
+    expected = np.zeros((8, 10), np.uint8)
+    expected[2:6, 2:6] = 1
+    assert (mask[..., 0] == expected).all()
+
+
+def test_triangle_mask_matches_pixel_centres():
+    points = [(0, 0), (12, 0), (0, 12)]
+    mask = polygon_mask(points, 12, 12)[..., 0]
+    ys, xs = np.mgrid[0:12, 0:12] + 0.5
+    assert (mask == (xs + ys < 12)).all()
+
+
+def test_self_intersecting_mask_is_even_odd():
+    # a bow tie crossing at the centre: the left and right triangles are inside, the top and bottom ones not
+    mask = polygon_mask([(0, 0), (10, 10), (10, 0), (0, 10)], 10, 10)[..., 0]
+    assert mask[5, 0] == 1 and mask[5, 9] == 1
+    assert mask[0, 5] == 0 and mask[9, 5] == 0
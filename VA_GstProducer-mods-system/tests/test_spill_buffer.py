@@ -0,0 +1,46 @@
+from utils.spill_buffer import SpillBuffer
+
+
+def fill(buffer: SpillBuffer, count: int, start: int = 0):
+    for i in range(start, start + count):
+        buffer.append('application/x-va-frame', {'n': i}, f'frame {i}'.encode())
+
+
+def drain(buffer: SpillBuffer) -> list:
+    bodies = []
+    while (record := buffer.pop()) is not None:
+        bodies.append(record[2].decode())
+    return bodies
+
+
+def test_pop_in_order_and_unpop(tmp_path):
+    buffer = SpillBuffer(str(tmp_path), max_bytes=1 << 20, segment_bytes=64)  # a few records per segment
+    fill(buffer, 6)
+    assert buffer.pop()[1] == {'n': 0}
+    assert buffer.pop()[2] == b'frame 1'
+    assert buffer.unpop()
+    assert not buffer.unpop()  # only the last pop can be put back
+    assert len(buffer) == 5
+    assert drain(buffer) == [f'frame {i}' for i in range(1, 6)]
+    assert len(buffer) == 0 and not list(tmp_path.iterdir())
+    buffer.close()
+
+
+def test_leftover_segments_are_resent(tmp_path):
+    buffer = SpillBuffer(str(tmp_path), max_bytes=1 << 20, segment_bytes=64)
+    fill(buffer, 5)
+    buffer.close()
+
+    buffer = SpillBuffer(str(tmp_path), max_bytes=1 << 20, segment_bytes=64)
+    assert len(buffer) == 5
+    fill(buffer, 2, start=5)
+    assert drain(buffer) == [f'frame {i}' for i in range(7)]
+    buffer.close()
+
+
+def test_oldest_segments_dropped_at_the_limit(tmp_path):
+    buffer = SpillBuffer(str(tmp_path), max_bytes=300, segment_bytes=100)
+    fill(buffer, 20)
+    assert buffer.dropped > 0 and len(buffer) == 20 - buffer.dropped
+    assert drain(buffer) == [f'frame {i}' for i in range(buffer.dropped, 20)]
+    buffer.close()
@@ -0,0 +1,177 @@
+import os
+import re
+import struct
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+_MAGIC = b'VARB'
+_HEADER = struct.Struct('<4sII')  # magic, slots, slot_bytes
+_HEADER_BYTES = 64
+
+
+def ring_name(stream_name: str, generation: int = 0) -> str:
+    return f"{ring_prefix(stream_name)}{generation}"
+
+
+def ring_prefix(stream_name: str) -> str:
+    return f"va_{re.sub(r'[^A-Za-z0-9_]', '_', stream_name)}_"
+
+
+def remove_stale_rings(stream_name: str) -> None:
+    """
+    Unlink the rings an earlier producer of the stream left behind, e.g. after a crash. Readers still
+    attached keep their mapping until they drop it. Only POSIX lists shared memory, on Windows a segment
+    disappears with its last handle anyway.
+    """
+    if not os.path.isdir('/dev/shm'):
+        return
+    prefix = ring_prefix(stream_name)
+    for entry in os.listdir('/dev/shm'):
+        if entry.startswith(prefix) and entry[len(prefix):].isdigit():
+            try:
+                os.unlink(os.path.join('/dev/shm', entry))
+            except OSError:
+                pass
+
+
+class SharedFrameRing:
+    """
+    Fixed-size ring of raw frames in `multiprocessing.shared_memory`, written by one producer and read by
+    consumers on the same host. Only a small descriptor (slot, seq, shape) travels over AMQP.
+
+    Layout: 64 byte header, one int64 sequence number per slot, then `slots` data slots of `slot_bytes`.
+    A slot's sequence number is invalidated before its pixels are overwritten and set after, so a reader
+    that lagged a full lap behind the writer sees a mismatch instead of a torn frame.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, slot_bytes: int, owner: bool):
+        self.shm = shm
+        self.name = shm.name
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self._owner = owner
+        self._next_seq = 0
+        self.seqs = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=_HEADER_BYTES)
+        data_offset = _HEADER_BYTES + -(-slots * 8 // 64) * 64
+        self.data = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=shm.buf, offset=data_offset)
+
+    @classmethod
+    def create(cls, name: str, slots: int, slot_bytes: int) -> 'SharedFrameRing':
+        size = _HEADER_BYTES + -(-slots * 8 // 64) * 64 + slots * slot_bytes
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:  # left behind by a crashed producer
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, slots, slot_bytes)
+        ring = cls(shm, slots, slot_bytes, owner=True)
+        ring.seqs[:] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedFrameRing':
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            # readers must not unlink the producer's segment when they exit
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        magic, slots, slot_bytes = _HEADER.unpack_from(shm.buf, 0)
+        if magic != _MAGIC:
+            shm.close()
+            raise ValueError(f"{name} is not a frame ring")
+        return cls(shm, slots, slot_bytes, owner=False)
+
+    def fits(self, nbytes: int) -> bool:
+        return nbytes <= self.slot_bytes
+
+    def write(self, frame: np.ndarray) -> tuple[int, int]:
+        """
+        Copy a frame into the next slot.
+
+        Returns:
+            (slot, seq) to put in the descriptor.
+        """
+        seq = self._next_seq
+        slot = seq % self.slots
+        self._next_seq += 1
+        flat = frame.reshape(-1)
+        self.seqs[slot] = -1
+        self.data[slot, :flat.size] = flat
+        self.seqs[slot] = seq
+        return slot, seq
+
+    def read(self, slot: int, seq: int, shape) -> np.ndarray | None:
+        """
+        Copy a frame out of its slot. Returns None if the writer already reused the slot.
+        """
+        if self.seqs[slot] != seq:
+            return None
+        size = int(np.prod(shape))
+        frame = self.data[slot, :size].copy().reshape(shape)
+        if self.seqs[slot] != seq:
+            return None
+        return frame
+
+    def close(self):
+        self.seqs = None
+        self.data = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+class SharedFrameReader:
+    """
+    Consumer side cache of attached rings, keyed by the ring name carried in each descriptor.
+    Safe to share between decode threads: a ring that is dropped while threads still read from it is
+    only unmapped once the last of them is done.
+    """
+
+    def __init__(self):
+        self._rings: dict[str, SharedFrameRing] = {}
+        self._readers: dict[SharedFrameRing, int] = {}  # threads inside ring.read, per ring
+        self._retired: set[SharedFrameRing] = set()  # dropped rings waiting for their readers
+        self._lock = threading.Lock()
+
+    def read(self, headers: dict) -> np.ndarray | None:
+        """
+        Copy out the frame of a descriptor. Returns None if its slot was reused or its ring is gone, as after
+        a producer restart for descriptors still queued from the previous run.
+        """
+        name = headers['shm']
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is None:
+                try:
+                    ring = SharedFrameRing.attach(name)
+                except FileNotFoundError:
+                    return None
+                # the producer moved to a new generation or was restarted, drop the rings it abandoned
+                self._close_rings()
+                self._rings[name] = ring
+            self._readers[ring] = self._readers.get(ring, 0) + 1
+        try:
+            return ring.read(headers['slot'], headers['seq'], tuple(headers['shape']))
+        finally:
+            with self._lock:
+                self._readers[ring] -= 1
+                if not self._readers[ring]:
+                    del self._readers[ring]
+                    if ring in self._retired:
+                        self._retired.discard(ring)
+                        ring.close()
+
+    def _close_rings(self):
+        for ring in self._rings.values():
+            if ring in self._readers:
+                self._retired.add(ring)
+            else:
+                ring.close()
+        self._rings = {}
+
+    def close(self):
+        with self._lock:
+            self._close_rings()
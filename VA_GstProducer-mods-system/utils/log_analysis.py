@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import glob
+import numpy as np
+from datetime import date
+
+# Reads the per-stream logs `utils/log_setup.py` writes, of the producer or the consumers.
+LOG_INDEX_DIR = os.getenv("LOG_INDEX_DIR", "log_index")  # per-stream histograms and read offsets
+CHUNK_BYTES = 16 * 1024 * 1024  # read per step, only complete lines of a chunk are parsed
+SECONDS_PER_DAY = 86400
+_HEAD_BYTES = 64  # start of a file, tells a replaced file from the one an offset belongs to
+
+# logging's default asctime, "YYYY-MM-DD HH:MM:SS,mmm", at the start of every line
+_DIGITS = np.array([0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18])  # date and time, milliseconds not needed
+_SEPARATORS = np.array([4, 7, 10, 13, 16, 19])
+_SEPARATOR_CHARS = np.frombuffer(b'-- ::,', dtype=np.uint8)
+_TIMESTAMP_BYTES = 23
+_FRAMES = re.compile(rb'\| Frames: (\d+) \|')  # summary lines of utils.log_setup.FrameLog stand for N frames
+_FRAME_LINE = np.frombuffer(b' - Frame: ', dtype=np.uint8)  # old per-frame logs, one frame per line
+_FRAME_LINE_AT = np.arange(_TIMESTAMP_BYTES, _TIMESTAMP_BYTES + len(_FRAME_LINE))
+
+
+def stream_name(path: str) -> str:
+    """Stream of a log file: `cam.log`, rotated `cam.log.1` and old style `cam_frames.log` are all `cam`."""
+    name = os.path.basename(path).split('.log')[0]
+    return name[:-len('_frames')] if name.endswith('_frames') else name
+
+
+def parse_seconds(data):
+    """
+    Day, second of day and frame count of every line in `data` (bytes up to and including the last newline)
+    whose timestamp has the fixed layout, read straight from the digits without strptime. A `FrameLog`
+    summary line counts the frames it reports (`| Frames: N |`), a line of the old per-frame logs
+    (`<asctime> - Frame: ...`) one frame and any other line, such as connection messages, none. Lines without
+    a timestamp, such as traceback continuations, are skipped.
+
+    Returns:
+        (days as YYYYMMDD ints, seconds of day, frames), arrays with one entry per timestamped line
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buffer == 10)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    frames = np.zeros(len(starts), np.int64)
+    frame_lines = starts[ends - starts >= _FRAME_LINE_AT[-1] + 1]
+    is_frame_line = (buffer[frame_lines[:, None] + _FRAME_LINE_AT] == _FRAME_LINE).all(axis=1)
+    frames[np.isin(starts, frame_lines[is_frame_line])] = 1
+    for match in _FRAMES.finditer(data):
+        frames[np.searchsorted(starts, match.start(), side='right') - 1] = int(match.group(1))
+    long_enough = ends - starts >= _TIMESTAMP_BYTES
+    starts, frames = starts[long_enough], frames[long_enough]
+    if not len(starts):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    separators = buffer[starts[:, None] + _SEPARATORS]
+    digits = buffer[starts[:, None] + _DIGITS] - 48  # non digits wrap around to values above 9
+    valid = (separators == _SEPARATOR_CHARS).all(axis=1) & (digits <= 9).all(axis=1)
+    digits = digits[valid].astype(np.int64)
+    pairs = digits[:, 0::2] * 10 + digits[:, 1::2]  # century, year, month, day, hour, minute, second
+    days = pairs[:, 0] * 1000000 + pairs[:, 1] * 10000 + pairs[:, 2] * 100 + pairs[:, 3]
+    seconds = pairs[:, 4] * 3600 + pairs[:, 5] * 60 + pairs[:, 6]
+    return days, seconds, frames[valid]
+
+
+class FrameLogIndex:
+    """
+    Frames per second of every stream's log files, see `parse_seconds`, kept up to date incrementally.
+
+    Each stream gets one `uint32[86400]` array per day under `store_dir/<stream>/<YYYY-MM-DD>.npy`, and the
+    byte offset read so far is saved per file, so every `update` only parses what was appended since the last
+    one, in chunks, instead of re-reading whole logs. Files are tracked by device and inode rather than path,
+    so a log renamed by rotation is not read again; a file that shrank or whose first bytes changed is read
+    from the start. A line left without its newline is read once it is complete.
+    """
+
+    def __init__(self, store_dir: str = LOG_INDEX_DIR):
+        self.store_dir = store_dir
+        self._offsets_path = os.path.join(store_dir, 'offsets.json')
+        self._offsets = {}  # "device:inode" -> {'path', 'head', 'offset'}
+        if os.path.exists(self._offsets_path):
+            with open(self._offsets_path) as f:
+                self._offsets = json.load(f)
+
+    def _day_path(self, stream: str, day: str) -> str:
+        return os.path.join(self.store_dir, stream, f'{day}.npy')
+
+    def _save(self, path: str, save):
+        # written next to the target and renamed, an interrupted run never leaves half a file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            save(f)
+        os.replace(tmp_path, path)
+
+    def _save_offsets(self):
+        self._save(self._offsets_path, lambda f: f.write(json.dumps(self._offsets, indent=1).encode()))
+
+    def _add(self, stream: str, histograms: dict, days: np.ndarray, seconds: np.ndarray, frames: np.ndarray):
+        for day in np.unique(days):
+            key = f'{day // 10000:04d}-{day // 100 % 100:02d}-{day % 100:02d}'
+            histogram = histograms.get(key)
+            if histogram is None:
+                path = self._day_path(stream, key)
+                histogram = np.load(path) if os.path.exists(path) else np.zeros(SECONDS_PER_DAY, np.uint32)
+                histograms[key] = histogram
+            on_day = days == day
+            histogram += np.bincount(seconds[on_day], weights=frames[on_day], minlength=SECONDS_PER_DAY).astype(np.uint32)
+
+    def update_file(self, path: str) -> int:
+        """Count the frames logged to one log file since the last update. Returns the number of frames counted."""
+        stat = os.stat(path)
+        key = f'{stat.st_dev}:{stat.st_ino}'
+        with open(path, 'rb') as f:
+            head = f.read(_HEAD_BYTES).hex()
+            state = self._offsets.get(key)
+            if state is None or state['offset'] > stat.st_size or not head.startswith(state['head']):
+                state = {'path': path, 'head': head, 'offset': 0}
+            moved = state['path'] != path
+            state['path'], state['head'] = path, head
+            if state['offset'] == stat.st_size:
+                self._offsets[key] = state
+                if moved:
+                    self._save_offsets()
+                return 0
+
+            stream = stream_name(path)
+            histograms = {}  # day -> histogram, saved once the file is read
+            counted = 0
+            f.seek(state['offset'])
+            pending = b''
+            while True:
+                chunk = f.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                chunk = pending + chunk
+                end = chunk.rfind(b'\n') + 1
+                pending = chunk[end:]
+                if not end:
+                    continue  # a line longer than a chunk
+                days, seconds, frames = parse_seconds(memoryview(chunk)[:end])
+                self._add(stream, histograms, days, seconds, frames)
+                counted += int(frames.sum())
+                state['offset'] += end
+
+        for day, histogram in histograms.items():
+            self._save(self._day_path(stream, day), lambda f: np.save(f, histogram))
+        self._offsets[key] = state
+        self._save_offsets()
+        return counted
+
+    def update(self, paths) -> int:
+        """Bring the histograms up to date with `paths`, forgetting the offsets of files that are gone."""
+        counted = sum(self.update_file(path) for path in paths)
+        present = set()
+        for path in paths:
+            stat = os.stat(path)
+            present.add(f'{stat.st_dev}:{stat.st_ino}')
+        folders = {os.path.dirname(os.path.abspath(path)) for path in paths}
+        stale = [key for key, state in self._offsets.items()
+                 if key not in present and os.path.dirname(os.path.abspath(state['path'])) in folders]
+        if stale:
+            for key in stale:
+                del self._offsets[key]
+            self._save_offsets()
+        return counted
+
+    def update_folder(self, folder: str, pattern: str = '*.log*') -> list[str]:
+        """Update from every log file in `folder`. Returns the streams found there."""
+        paths = sorted(path for path in glob.glob(os.path.join(folder, pattern))
+                       if os.path.isfile(path) and not path.endswith('.tmp'))
+        self.update(paths)
+        return sorted({stream_name(path) for path in paths})
+
+    def streams(self) -> list[str]:
+        if not os.path.isdir(self.store_dir):
+            return []
+        return sorted(entry for entry in os.listdir(self.store_dir)
+                      if os.path.isdir(os.path.join(self.store_dir, entry)))
+
+    def days(self, stream: str) -> list[date]:
+        folder = os.path.join(self.store_dir, stream)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(date.fromisoformat(name[:-len('.npy')]) for name in os.listdir(folder) if name.endswith('.npy'))
+
+    def counts(self, stream: str, day: date) -> np.ndarray:
+        """Frames per second of day, memory mapped read-only; zeros for a day without logs."""
+        path = self._day_path(stream, str(day))
+        if not os.path.exists(path):
+            return np.zeros(SECONDS_PER_DAY, np.uint32)
+        return np.load(path, mmap_mode='r')
+
+    def average_fps(self, stream: str, days: list[date] = None) -> float:
+        """
+        Frames over the seconds from the first to the last logged frame of each day, summed over `days` (all by
+        default). Unlike the busy seconds alone, the span also holds when summaries come every few seconds.
+        """
+        frames = seconds = 0
+        for day in self.days(stream) if days is None else days:
+            counts = self.counts(stream, day)
+            active = np.flatnonzero(counts)
+            if len(active):
+                frames += int(counts.sum(dtype=np.int64))
+                seconds += int(active[-1] - active[0] + 1)
+        return frames / seconds if seconds else 0.0
@@ -0,0 +1,213 @@
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import multiprocessing
+from multiprocessing import util
+from datetime import date, datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 50 * 1024 * 1024))  # size at which a log file is rotated
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))  # rotated files kept per log
+LOG_JSON = os.getenv("LOG_JSON", "0") == "1"  # also write every file log as JSON lines to <name>.jsonl
+FRAME_LOG_INTERVAL = float(os.getenv("FRAME_LOG_INTERVAL", 1.0))  # seconds between frame summary lines of a stream
+FRAME_LOG_EVERY = int(os.getenv("FRAME_LOG_EVERY", 0))  # or every N frames, 0 to only go by time
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# arguments that cannot change before the writer thread formats the message
+_PLAIN_ARGS = (str, int, float, bool, type(None), datetime, date)
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and whatever was passed as `extra`."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # QueueHandler formats every record on the logging thread; here that is left to the writer thread
+    # unless an argument is mutable and could change before the record is written
+
+    def prepare(self, record):
+        if record.args and not (isinstance(record.args, tuple) and all(isinstance(a, _PLAIN_ARGS) for a in record.args)):
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class _Router(logging.Handler):
+    """Writes every record to the console and the records of loggers with file logs to their files."""
+
+    def __init__(self, console: logging.Handler):
+        super().__init__()
+        self.console = console
+        self.routes = {}  # logger name -> handlers, replaced as a whole so the writer reads it without a lock
+        self.per_process = {}  # logger name -> (log_dir, file_name, formatter) of logs written to a file per process
+
+    def emit(self, record):
+        for handler in (self.console, *self.routes.get(record.name, ())):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_lock = threading.Lock()
+_router = None
+_queue_handler = None
+_listener = None
+
+
+def _start():
+    global _queue_handler, _listener
+    root = logging.getLogger()
+    if _queue_handler is not None:
+        root.removeHandler(_queue_handler)
+    records = queue.SimpleQueue()
+    _queue_handler = _DeferredQueueHandler(records)
+    _listener = QueueListener(records, _router)
+    _listener.start()
+    root.addHandler(_queue_handler)
+
+
+def _after_fork():
+    # the writer thread of the parent does not exist in a forked child
+    global _lock
+    _lock = threading.Lock()  # may have been held by another thread of the parent
+    if _router is not None and _router.per_process:
+        # inherited per-process logs would otherwise share the parent's files
+        _router.routes = {**_router.routes, **{name: _file_handlers(log_dir, f"{file_name}.{os.getpid()}", formatter)
+                                               for name, (log_dir, file_name, formatter) in _router.per_process.items()}}
+    _start()
+
+
+def _stop_with_process(_registered):
+    # multiprocessing children exit without running atexit
+    util.Finalize(None, _join_threads, exitpriority=100)
+    util.Finalize(None, _stop, exitpriority=-100)
+
+
+def _join_threads():
+    # a child's finalizers run as soon as its target returns, while threads the target started may still be
+    # working; wait for them as the interpreter would at exit, so the writer and the other finalizers outlive them
+    current = threading.current_thread()
+    while True:
+        threads = [t for t in threading.enumerate() if t is not current and not t.daemon and t.is_alive()]
+        if not threads:
+            return
+        for thread in threads:
+            thread.join()
+
+
+def _stop():
+    # drains the queue, whatever is logged after that is written directly
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    root.addHandler(_router)
+
+
+def setup_logging(level: str = LOG_LEVEL) -> None:
+    """
+    Configure the root logger once per process, in place of `logging.basicConfig`. Records are put on a
+    queue and formatted and written by a background thread, to the console and to the file logs added with
+    `add_file_log`, so the threads that log never wait on I/O.
+    """
+    global _router
+    with _lock:
+        if _router is not None:
+            return
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        _router = _Router(console)
+        logging.getLogger().setLevel(level)
+        _start()
+        atexit.register(_stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_after_fork)
+        util.register_after_fork(_router, _stop_with_process)
+
+
+def _file_handlers(log_dir: str, file_name: str, formatter: logging.Formatter) -> tuple:
+    os.makedirs(log_dir, exist_ok=True)
+    handler = RotatingFileHandler(os.path.join(log_dir, f"{file_name}.log"), maxBytes=LOG_MAX_BYTES,
+                                  backupCount=LOG_BACKUPS, delay=True)
+    handler.setFormatter(formatter)
+    handlers = [handler]
+    if LOG_JSON:
+        json_handler = RotatingFileHandler(os.path.join(log_dir, f"{file_name}.jsonl"), maxBytes=LOG_MAX_BYTES,
+                                           backupCount=LOG_BACKUPS, delay=True)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+    return tuple(handlers)
+
+
+def add_file_log(logger_name: str, log_dir: str, file_name: str, formatter: logging.Formatter,
+                 per_process: bool = False) -> None:
+    """
+    Also write the records of `logger_name` to `log_dir/<file_name>.log`, rotated at `LOG_MAX_BYTES` with
+    `LOG_BACKUPS` old files kept, and as JSON lines to `<file_name>.jsonl` when `LOG_JSON` is set.
+
+    A rotating file must only have one writing process. Set `per_process` for loggers that child processes
+    use as well: the main process keeps `<file_name>.log` and every child, forked or spawned, writes its own
+    `<file_name>.<pid>.log`.
+    """
+    setup_logging()
+    with _lock:
+        if logger_name in _router.routes:
+            return
+        if per_process:
+            _router.per_process = {**_router.per_process, logger_name: (log_dir, file_name, formatter)}
+            if multiprocessing.parent_process() is not None:
+                file_name = f"{file_name}.{os.getpid()}"
+        _router.routes = {**_router.routes, logger_name: _file_handlers(log_dir, file_name, formatter)}
+
+
+class FrameLog:
+    """
+    Per-frame log of one stream, written as one summary line every `interval` seconds or `every` frames,
+    whichever comes first. Skipped frames only cost a counter; the arguments are formatted lazily and only
+    for the lines that are written, which carry the frames since the last line and their rate.
+    """
+
+    def __init__(self, logger: logging.Logger, stream: str, interval: float = FRAME_LOG_INTERVAL,
+                 every: int = FRAME_LOG_EVERY):
+        self.logger = logger
+        self.stream = stream
+        self.interval = interval
+        self.every = every
+        self.frames = 0
+        self._logged_frames = 0
+        self._logged_at = time.monotonic()
+
+    def __call__(self, msg: str, *args, frames: int = 1, force: bool = False):
+        """Count `frames` frames and log `msg % args` for them if a summary is due, or `force` is set."""
+        self.frames += frames
+        now = time.monotonic()
+        elapsed = now - self._logged_at
+        if not force and elapsed < self.interval and (not self.every or self.frames - self._logged_frames < self.every):
+            return
+        frames = self.frames - self._logged_frames
+        self._logged_frames, self._logged_at = self.frames, now
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(f"{msg} | Frames: %d | FPS: %.1f", *args, frames, frames / elapsed if elapsed > 0 else 0.0,
+                             extra={'stream': self.stream, 'frames': frames})
@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile, good enough for a compact dump."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class PipelineMetrics:
+    """
+    Process wide registry of per-stream counters and per-stage latency histograms.
+    Stages are free-form names (decode, jpeg_encode, publish, queue_wait, inference, ...) and
+    every observation is in seconds.
+    """
+
+    def __init__(self, prefix: str = 'va'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, str], int] = {}
+        self._histograms: dict[tuple[str, str], Histogram] = {}
+        self._reporter = None
+        self._server = None
+
+    def inc(self, name: str, stream: str, value: int = 1):
+        key = (name, stream)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, stage: str, stream: str, seconds: float):
+        key = (stage, stream)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str, stream: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, stream, time.perf_counter() - start)
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count)) for key, h in self._histograms.items())
+
+        lines = []
+        last_name = None
+        for (name, stream), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if name != last_name:
+                lines.append(f"# TYPE {metric} counter")
+                last_name = name
+            lines.append(f'{metric}{{stream="{_label(stream)}"}} {value}')
+
+        metric = f"{self.prefix}_stage_seconds"
+        if histograms:
+            lines.append(f"# TYPE {metric} histogram")
+        for (stage, stream), (counts, total, count) in histograms:
+            labels = f'stream="{_label(stream)}",stage="{_label(stage)}"'
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{metric}_count{{{labels}}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """One compact line per stream: counters, then count/mean/p95 in ms for every stage."""
+        with self._lock:
+            streams = sorted({stream for _, stream in self._counters} | {stream for _, stream in self._histograms})
+            lines = []
+            for stream in streams:
+                parts = [f"{name}={value}" for (name, s), value in sorted(self._counters.items()) if s == stream]
+                for (stage, s), h in sorted(self._histograms.items()):
+                    if s == stream and h.count:
+                        parts.append(f"{stage}={h.count}/{1000 * h.sum / h.count:.1f}/{1000 * h.quantile(0.95):.0f}ms")
+                lines.append(f"{stream}: " + " ".join(parts))
+        return "\n".join(lines)
+
+    def write_textfile(self, path: str):
+        """Write the exposition atomically, for the node_exporter textfile collector or a quick `cat`."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def start_reporter(self, interval: float, textfile: str = None, logger=None):
+        """Periodically write `textfile` and/or log the compact summary from a daemon thread."""
+        if self._reporter is not None:
+            return
+
+        def report():
+            while True:
+                time.sleep(interval)
+                try:
+                    if textfile:
+                        self.write_textfile(textfile)
+                    if logger:
+                        logger.info(f"Metrics | {self.summary()}")
+                except Exception:
+                    if logger:
+                        logger.error("Could not report metrics", exc_info=True)
+
+        self._reporter = threading.Thread(target=report, name="MetricsReporter", daemon=True)
+        self._reporter.start()
+
+    def start_http_server(self, port: int, host: str = '0.0.0.0'):
+        """Serve the exposition on http://host:port/metrics from a daemon thread."""
+        if self._server is not None:
+            return
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+
+
+metrics = PipelineMetrics()
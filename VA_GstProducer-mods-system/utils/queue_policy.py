@@ -0,0 +1,111 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+# Must match between producer and consumers, a queue redeclared with other arguments is refused.
+QUEUE_DURABLE = os.getenv('QUEUE_DURABLE', 'true').lower() == 'true'
+QUEUE_PERSISTENT = os.getenv('QUEUE_PERSISTENT', 'true').lower() == 'true'  # delivery_mode=2, fsynced by the broker
+QUEUE_MAX_LENGTH = int(os.getenv('QUEUE_MAX_LENGTH', 0))  # frames kept per queue, oldest dropped first, 0: unbounded
+QUEUE_MESSAGE_TTL = int(os.getenv('QUEUE_MESSAGE_TTL', 0))  # milliseconds a frame may wait in the queue, 0: forever
+QUEUE_TYPE = os.getenv('QUEUE_TYPE', 'classic')  # 'classic', 'lazy' or 'stream'
+QUEUE_DECLARE = os.getenv('QUEUE_DECLARE', 'passive')  # consumers: 'passive' only checks the queue, 'policy' declares it
+QUEUE_SHEET = os.getenv('QUEUE_SHEET', '')  # consumers: the producer's camera spreadsheet, for its per camera columns
+QUEUE_TYPES = ('classic', 'lazy', 'stream')
+
+
+def _cell(row, column):
+    value = row.get(column) if hasattr(row, 'get') else None
+    if value is None or value != value:  # NaN from pandas
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _flag(value: str) -> bool:
+    return value.lower() in ('1', 'true', 'yes', 'y')
+
+
+class QueuePolicy:
+    """
+    How a camera's frame queue is declared and how its frames are published.
+
+    Live frames are worthless after a few seconds, so a queue can be made transient (`durable=False`,
+    non-persistent messages, no fsync per frame), bounded to `max_length` frames with the oldest dropped
+    first (`x-overflow=drop-head`) and given a `message_ttl` in milliseconds. `queue_type` 'lazy' keeps
+    classic queue bodies on disk instead of in memory, 'stream' declares a RabbitMQ stream, which is
+    always durable and bounded by age (`x-max-age`) rather than by length and TTL.
+    """
+
+    def __init__(self, durable: bool = QUEUE_DURABLE, persistent: bool = QUEUE_PERSISTENT,
+                 max_length: int = QUEUE_MAX_LENGTH, message_ttl: int = QUEUE_MESSAGE_TTL,
+                 queue_type: str = QUEUE_TYPE):
+        if queue_type not in QUEUE_TYPES:
+            raise ValueError(f"Unknown queue type {queue_type!r}, expected one of {QUEUE_TYPES}")
+        self.queue_type = queue_type
+        self.durable = durable or queue_type == 'stream'
+        self.persistent = persistent
+        self.max_length = max_length
+        self.message_ttl = message_ttl
+
+    @classmethod
+    def from_row(cls, row) -> 'QueuePolicy':
+        """
+        Environment defaults overridden by the optional spreadsheet columns `Durable`, `Persistent`,
+        `MaxLength`, `MessageTTL` and `QueueType`.
+        """
+        durable, persistent = _cell(row, 'Durable'), _cell(row, 'Persistent')
+        max_length, message_ttl = _cell(row, 'MaxLength'), _cell(row, 'MessageTTL')
+        return cls(
+            durable=_flag(durable) if durable else QUEUE_DURABLE,
+            persistent=_flag(persistent) if persistent else QUEUE_PERSISTENT,
+            max_length=int(float(max_length)) if max_length else QUEUE_MAX_LENGTH,
+            message_ttl=int(float(message_ttl)) if message_ttl else QUEUE_MESSAGE_TTL,
+            queue_type=(_cell(row, 'QueueType') or QUEUE_TYPE).lower(),
+        )
+
+    @property
+    def delivery_mode(self) -> int:
+        return 2 if self.persistent else 1
+
+    def arguments(self) -> dict:
+        if self.queue_type == 'stream':
+            arguments = {'x-queue-type': 'stream'}
+            if self.message_ttl:
+                arguments['x-max-age'] = f"{max(1, self.message_ttl // 1000)}s"
+            return arguments
+
+        arguments = {}
+        if self.max_length:
+            arguments['x-max-length'] = self.max_length
+            arguments['x-overflow'] = 'drop-head'
+        if self.message_ttl:
+            arguments['x-message-ttl'] = self.message_ttl
+        if self.queue_type == 'lazy':
+            arguments['x-queue-mode'] = 'lazy'
+        return arguments
+
+    def declare_kwargs(self, passive: bool = False) -> dict:
+        """Keyword arguments for `channel.queue_declare`, on both the async and the blocking channel."""
+        if passive:
+            return {'passive': True}
+        return {'durable': self.durable, 'arguments': self.arguments() or None}
+
+    def consume_arguments(self) -> dict | None:
+        """`basic_consume` arguments, streams have to be told where to start reading."""
+        return {'x-stream-offset': 'next'} if self.queue_type == 'stream' else None
+
+    def __repr__(self):
+        return (f"QueuePolicy(type={self.queue_type}, durable={self.durable}, persistent={self.persistent}, "
+                f"max_length={self.max_length}, message_ttl={self.message_ttl})")
+
+
+def load_policies(path: str = QUEUE_SHEET) -> dict:
+    """
+    Policy of every camera in the producer's spreadsheet by queue name (`Location`), so a consumer prefetches and
+    consumes each queue the way the producer declared it. Empty without a spreadsheet, cameras missing from it
+    get the environment defaults of `QueuePolicy()`.
+    """
+    if not path:
+        return {}
+    import pandas as pd
+    return {str(row['Location']): QueuePolicy.from_row(row) for _, row in pd.read_excel(path).iterrows()}
@@ -0,0 +1,169 @@
+import os
+import json
+import struct
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_BYTES = 16 * 1024 * 1024
+_RECORD = struct.Struct('<II')  # meta length, body length
+_SUFFIX = '.spill'
+
+
+class SpillBuffer:
+    """
+    Bounded on-disk FIFO for frames the producer could not hand to the broker.
+
+    Records (content type, headers, body) are appended to numbered segment files of about `segment_bytes`
+    in `directory` and read back in order by `pop`. A segment is deleted once it was read completely.
+    When the buffer grows past `max_bytes` the oldest segment is deleted unread, so it behaves like a
+    ring that keeps the most recent frames. Segments left behind by a previous run are picked up again;
+    the read position is not persisted, so a segment that was partly drained before a crash is resent
+    from its start. Safe to share between the streaming thread (`append`) and the ioloop (`pop`).
+    """
+
+    def __init__(self, directory: str, max_bytes: int, segment_bytes: int = SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = min(segment_bytes, max_bytes)
+        self.dropped = 0  # frames lost to the size limit
+        self._lock = threading.Lock()
+        self._segments = []  # segment numbers, oldest first
+        self._sizes = {}
+        self._records = {}
+        self._total_bytes = 0
+        self._pending = 0
+        self._write_file = None
+        self._read_file = None
+        self._read_segment = None
+        self._read_records = 0
+        self._popped_at = None  # (segment, offset) of the record `pop` returned last, for `unpop`
+
+        os.makedirs(directory, exist_ok=True)
+        leftover = [f[:-len(_SUFFIX)] for f in os.listdir(directory) if f.endswith(_SUFFIX)]
+        for segment in sorted(int(s) for s in leftover if s.isdigit()):
+            self._load_segment(segment)
+        if self._pending:
+            logger.info(f"{directory}: {self._pending} spilled frames left from a previous run")
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment}{_SUFFIX}")
+
+    def _load_segment(self, segment: int):
+        records, size = 0, 0
+        with open(self._path(segment), 'rb') as f:
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                meta_len, body_len = _RECORD.unpack(header)
+                f.seek(meta_len + body_len, os.SEEK_CUR)
+                if f.tell() > os.fstat(f.fileno()).st_size:  # torn last record
+                    break
+                records += 1
+                size = f.tell()
+        if size < os.path.getsize(self._path(segment)):
+            os.truncate(self._path(segment), size)
+        self._segments.append(segment)
+        self._sizes[segment] = size
+        self._records[segment] = records
+        self._total_bytes += size
+        self._pending += records
+
+    def __len__(self):
+        return self._pending
+
+    def append(self, content_type: str, headers: dict, body: bytes):
+        meta = json.dumps({'content_type': content_type, 'headers': headers}).encode()
+        record = _RECORD.pack(len(meta), len(body)) + meta + body
+        with self._lock:
+            if self._write_file is None or self._sizes[self._segments[-1]] + len(record) > self.segment_bytes:
+                self._roll()
+            segment = self._segments[-1]
+            self._write_file.write(record)
+            self._write_file.flush()
+            self._sizes[segment] += len(record)
+            self._records[segment] += 1
+            self._total_bytes += len(record)
+            self._pending += 1
+            while self._total_bytes > self.max_bytes and len(self._segments) > 1:
+                self._drop_oldest()
+
+    def _roll(self):
+        if self._write_file is not None:
+            self._write_file.close()
+        segment = self._segments[-1] + 1 if self._segments else 0
+        self._segments.append(segment)
+        self._sizes[segment] = 0
+        self._records[segment] = 0
+        self._write_file = open(self._path(segment), 'ab')
+
+    def _drop_oldest(self):
+        segment = self._segments[0]
+        unread = self._records[segment] - (self._read_records if segment == self._read_segment else 0)
+        self.dropped += unread
+        self._pending -= unread
+        logger.warning(f"{self.directory}: Spill buffer full, dropped {unread} frames")
+        self._remove_segment(segment)
+
+    def _remove_segment(self, segment: int):
+        if segment == self._read_segment:
+            self._read_file.close()
+            self._read_file, self._read_segment, self._read_records = None, None, 0
+        self._segments.remove(segment)
+        self._total_bytes -= self._sizes.pop(segment)
+        self._records.pop(segment)
+        os.remove(self._path(segment))
+
+    def pop(self):
+        """
+        Oldest spilled frame as (content_type, headers, body), None when the buffer is empty.
+        """
+        with self._lock:
+            while self._segments:
+                segment = self._segments[0]
+                if self._read_segment != segment:
+                    self._read_file = open(self._path(segment), 'rb')
+                    self._read_segment, self._read_records = segment, 0
+
+                if self._read_records < self._records[segment]:
+                    self._popped_at = (segment, self._read_file.tell())
+                    meta_len, body_len = _RECORD.unpack(self._read_file.read(_RECORD.size))
+                    meta = json.loads(self._read_file.read(meta_len))
+                    body = self._read_file.read(body_len)
+                    self._read_records += 1
+                    self._pending -= 1
+                    return meta['content_type'], meta['headers'], body
+
+                if segment == self._segments[-1]:
+                    if self._write_file is not None:
+                        self._write_file.close()
+                        self._write_file = None
+                    self._remove_segment(segment)
+                    return None
+                self._remove_segment(segment)
+            return None
+
+    def unpop(self) -> bool:
+        """
+        Put the record `pop` returned last back at the head, so it is the next one popped.
+
+        Returns:
+            False if it cannot be, because its segment was dropped to the size limit in the meantime.
+        """
+        with self._lock:
+            if self._popped_at is None or self._popped_at[0] != self._read_segment:
+                return False
+            self._read_file.seek(self._popped_at[1])
+            self._popped_at = None
+            self._read_records -= 1
+            self._pending += 1
+            return True
+
+    def close(self):
+        with self._lock:
+            for f in (self._write_file, self._read_file):
+                if f is not None:
+                    f.close()
+            self._write_file, self._read_file, self._read_segment = None, None, None
@@ -0,0 +1,41 @@
+import sys
+import difflib
+from pathlib import Path
+
+# Run from this folder as `python check_shared_utils.py`. The producer and the consumers read each other's
+# envelopes, shared memory rings, queues, metric names and log layout, so these modules exist once per project
+# and have to stay identical. Edit one copy, then copy it over the other.
+
+ROOT = Path(__file__).resolve().parent
+PROJECTS = ('VA_GstProducer-mods-system', 'VA_GstConsumer-updated-model-logic')
+SHARED_MODULES = (
+    'utils/frame_envelope.py',
+    'utils/frame_ring.py',
+    'utils/log_setup.py',
+    'utils/metrics.py',
+    'utils/queue_policy.py',
+)
+
+
+def diff_shared(root: Path = ROOT) -> list:
+    """Unified diff lines of every shared module whose copies differ, empty when all match."""
+    first, second = (root / project for project in PROJECTS)
+    diff = []
+    for module in SHARED_MODULES:
+        a, b = first / module, second / module
+        missing = [path for path in (a, b) if not path.is_file()]
+        if missing:
+            diff.extend(f"{path.relative_to(root)}: missing\n" for path in missing)
+            continue
+        diff.extend(difflib.unified_diff(a.read_text().splitlines(keepends=True),
+                                         b.read_text().splitlines(keepends=True),
+                                         f"{PROJECTS[0]}/{module}", f"{PROJECTS[1]}/{module}"))
+    return diff
+
+
+if __name__ == "__main__":
+    diff = diff_shared()
+    sys.stdout.writelines(diff)
+    if diff:
+        sys.exit(f"\nShared modules differ between {PROJECTS[0]} and {PROJECTS[1]}")
+    print(f"{len(SHARED_MODULES)} shared modules identical")